@@ -0,0 +1,3 @@
+# Benchmarks for stats_to_pandas, run from the root of the repository:
+#
+#   python -m benchmarks.decode
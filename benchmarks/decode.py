@@ -0,0 +1,162 @@
+# coding: utf-8
+
+"""
+Times each stage of the decode path, and measures the memory it 
+allocates, on synthetic tables (no network access).
+
+    python -m benchmarks.decode
+    python -m benchmarks.decode --cells 1000 1000000 10000000 --nulls 0.1
+    python -m benchmarks.decode --out new.csv --baseline old.csv
+
+The memory is the peak allocated by python and numpy during the stage 
+(tracemalloc, measured in a separate run). Memory allocated by pyarrow 
+(the csv decoder and the arrow output) is not included.
+"""
+
+#%%
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pyjstat import pyjstat
+
+import stats_to_pandas as stp
+from benchmarks import generate
+
+# the (never downloaded) url of the synthetic table
+URL = 'http://benchmark.invalid/api/v0/en/table/99999'
+
+
+def measure(function, repeat = 3):
+    """
+    Returns the best time of repeat runs of function() in seconds, 
+    and the peak memory (bytes) allocated in one run.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def stages(sizes, null_density = 0.0, decimals = 0, pyjstat_cells = 10 ** 6):
+    """
+    Returns the stages to measure for a table with dimensions of the 
+    given sizes, as an ordered dict {name: function}.
+    """
+    cells = np.prod(sizes)
+    meta = generate.metadata(sizes)
+    variables = meta['variables']
+    
+    # the query functions get the metadata from the cache
+    stp.metadata_cache.set(stp._cache_key(URL), meta)
+    
+    content = generate.json_stat_bytes(sizes, null_density = null_density, decimals = decimals)
+    data = json.loads(content)
+    csv_content = generate.csv_bytes(sizes, null_density = null_density, decimals = decimals)
+    csv_query = stp._with_format(stp.full_json(full_url = URL, wildcard = True), 'csv')
+    
+    functions = OrderedDict()
+    functions['full_json'] = lambda: stp.full_json(full_url = URL)
+    functions['full_json (wildcard)'] = lambda: stp.full_json(full_url = URL, wildcard = True)
+    functions['select + get_json'] = lambda: stp.get_json(stp.select(full_url = URL))
+    functions['json.loads'] = lambda: json.loads(content)
+    if cells <= pyjstat_cells:
+        functions['pyjstat.from_json_stat'] = lambda: pyjstat.from_json_stat(
+            json.loads(content, object_pairs_hook = OrderedDict))[0]
+    functions['from_json_stat'] = lambda: stp.from_json_stat(data)
+    functions['native'] = lambda: stp._read_json_stat(content)
+    functions['native (categorical)'] = lambda: stp._read_json_stat(content, categorical = True)
+    functions['stream'] = lambda: stp._read_json_stat(content, engine = 'stream')
+    functions['csv'] = lambda: stp._read_csv(csv_content, csv_query, variables)
+    functions['to_arrow'] = lambda: stp.to_arrow(data)
+    functions['native (arrow)'] = lambda: stp._read_json_stat(content, output = 'arrow')
+    functions['csv (arrow)'] = lambda: stp._read_csv(csv_content, csv_query, variables, 
+                                                      output = 'arrow')
+    return functions
+
+
+def run(cells = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6), 
+        ndims = 3, 
+        null_density = 0.0, 
+        decimals = 0, 
+        repeat = 3, 
+        pyjstat_cells = 10 ** 6):
+    """
+    Returns a dataframe with the time and memory of each stage for 
+    tables of the given numbers of cells.
+    """
+    rows = []
+    for n in cells:
+        sizes = generate.shape(n, ndims)
+        functions = stages(sizes, null_density, decimals, pyjstat_cells)
+        for stage, function in functions.items():
+            seconds, peak = measure(function, repeat if n < 10 ** 6 else 1)
+            rows.append(OrderedDict([('cells', int(np.prod(sizes))), 
+                                     ('stage', stage), 
+                                     ('seconds', seconds), 
+                                     ('peak_mb', peak / 2.0 ** 20), 
+                                     ('cells_per_second', np.prod(sizes) / seconds)]))
+            print('{cells:>10} {stage:<25} {seconds:10.4f} s {peak:10.1f} MB'.format(
+                cells = rows[-1]['cells'], stage = stage, seconds = seconds, 
+                peak = rows[-1]['peak_mb']))
+    return pd.DataFrame(rows)
+
+
+def compare(results, baseline):
+    """
+    Returns the time and memory of the results relative to a baseline 
+    (a dataframe from an earlier run), below 1 is an improvement.
+    """
+    merged = results.merge(baseline, on = ['cells', 'stage'], suffixes = ('', '_baseline'))
+    merged['time_ratio'] = merged['seconds'] / merged['seconds_baseline']
+    merged['memory_ratio'] = merged['peak_mb'] / merged['peak_mb_baseline']
+    return merged[['cells', 'stage', 'seconds', 'time_ratio', 'peak_mb', 'memory_ratio']]
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().split('\n')[0])
+    parser.add_argument('--cells', type = int, nargs = '+', 
+                        default = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6], 
+                        help = 'table sizes (up to 10000000)')
+    parser.add_argument('--dims', type = int, default = 3, help = 'number of dimensions')
+    parser.add_argument('--nulls', type = float, default = 0.0, help = 'share of missing values')
+    parser.add_argument('--decimals', type = int, default = 0, help = 'decimals in the values')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per stage (best is used)')
+    parser.add_argument('--pyjstat-cells', type = int, default = 10 ** 6, 
+                        help = 'largest table to decode with pyjstat (it is slow)')
+    parser.add_argument('--out', help = 'csv file to store the results in')
+    parser.add_argument('--baseline', help = 'csv file with results to compare with')
+    args = parser.parse_args(args)
+    
+    results = run(args.cells, args.dims, args.nulls, args.decimals, args.repeat, 
+                  args.pyjstat_cells)
+    
+    with pd.option_context('display.width', 120, 'display.max_rows', 500):
+        print()
+        print(results.pivot(index = 'stage', columns = 'cells', values = 'seconds')
+              .reindex(results['stage'].unique()).round(4))
+        if args.baseline:
+            print()
+            print(compare(results, pd.read_csv(args.baseline)).round(3))
+    
+    if args.out:
+        results.to_csv(args.out, index = False)
+    return results
+
+
+if __name__ == '__main__':
+    main()
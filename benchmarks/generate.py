@@ -0,0 +1,167 @@
+# coding: utf-8
+
+# Synthetic PxWeb tables: metadata, json-stat and csv responses of any shape,
+# so the decoders can be measured without network access.
+
+#%%
+import itertools
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+
+def shape(cells, ndims = 3):
+    """
+    Returns the number of categories in each of ndims dimensions, 
+    for a table with about cells cells (the first dimension is the largest).
+    """
+    size = max(int(round(cells ** (1.0 / ndims))), 1)
+    sizes = [size] * ndims
+    sizes[0] = max(int(round(float(cells) / size ** (ndims - 1))), 1)
+    return sizes
+
+
+def variables(sizes, text_length = 12):
+    """
+    Returns the metadata variables (as get_variables) of a table with 
+    dimensions of the given sizes. The last dimension is time.
+    """
+    result = []
+    for i, size in enumerate(sizes):
+        last = i == len(sizes) - 1
+        var = OrderedDict()
+        var['code'] = 'Tid' if last else 'Var{i}'.format(i = i)
+        var['text'] = 'time' if last else 'variable {i}'.format(i = i)
+        var['values'] = [str(2000 + j) if last else '{j:05d}'.format(j = j) 
+                         for j in range(size)]
+        var['valueTexts'] = [code if last else 
+                             'Category {j} '.format(j = j).ljust(text_length, 'x') 
+                             for j, code in enumerate(var['values'])]
+        if last:
+            var['time'] = True
+        result.append(var)
+    return result
+
+
+def metadata(sizes, title = '99999: Synthetic table', text_length = 12):
+    """
+    Returns the metadata of a table (as get_metadata).
+    """
+    return OrderedDict([('title', title), 
+                        ('variables', variables(sizes, text_length))])
+
+
+def values(ncells, null_density = 0.0, decimals = 0, seed = 0):
+    """
+    Returns an array with ncells values, a share null_density of them 
+    missing (nan).
+    """
+    random = np.random.RandomState(seed)
+    array = random.randint(0, 1000000, ncells).astype(float)
+    if decimals:
+        array = np.round(array / 10 ** decimals, decimals)
+    if null_density:
+        array[random.rand(ncells) < null_density] = np.nan
+    return array
+
+
+def _number(value, decimals):
+    if value != value:
+        return None
+    if decimals:
+        return float(value)
+    return int(value)
+
+
+def dataset(variables, array, version = 1, decimals = 0):
+    """
+    Returns the json-stat response (a dict) with the values in array for 
+    the variables (the values of each variable are the selected ones).
+    
+    Version 1 is a bundle (as PxWeb's json-stat), 2 a json-stat2 dataset.
+    """
+    dimension = OrderedDict()
+    for var in variables:
+        dimension[var['code']] = OrderedDict([
+            ('label', var['text']), 
+            ('category', OrderedDict([
+                ('index', OrderedDict((code, n) for n, code in enumerate(var['values']))), 
+                ('label', OrderedDict(zip(var['values'], var['valueTexts'])))]))])
+    ids = [var['code'] for var in variables]
+    sizes = [len(var['values']) for var in variables]
+    numbers = [_number(value, decimals) for value in array]
+    
+    if version == 2:
+        return OrderedDict([('version', '2.0'), 
+                            ('class', 'dataset'), 
+                            ('label', 'Synthetic table'), 
+                            ('id', ids), 
+                            ('size', sizes), 
+                            ('dimension', dimension), 
+                            ('value', numbers)])
+    
+    dimension['id'] = ids
+    dimension['size'] = sizes
+    dimension['role'] = {'time' : [var['code'] for var in variables if var.get('time')]}
+    data = OrderedDict([('dimension', dimension), 
+                        ('label', 'Synthetic table'), 
+                        ('source', 'Synthetic'), 
+                        ('updated', '2016-06-01T08:00:00Z'), 
+                        ('value', numbers)])
+    return OrderedDict([('dataset', data)])
+
+
+def csv_text(variables, array, heading = 1, decimals = 0):
+    """
+    Returns the csv response with the values in array for the variables, 
+    with the last heading variables as columns (as PxWeb).
+    """
+    heading = min(heading, len(variables))
+    stub, head = variables[:len(variables) - heading], variables[len(variables) - heading:]
+    columns = [' '.join(texts) for texts in itertools.product(*[var['valueTexts'] for var in head])]
+    lines = [','.join('"{name}"'.format(name = name) 
+                      for name in [var['text'] for var in stub] + columns)]
+    
+    width = len(columns)
+    rows = itertools.product(*[var['valueTexts'] for var in stub])
+    for start, labels in zip(range(0, len(array), width), rows):
+        numbers = ['".."' if value != value else repr(_number(value, decimals)) 
+                   for value in array[start:start + width]]
+        lines.append(','.join(['"{label}"'.format(label = label) for label in labels] + numbers))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def json_stat(sizes, 
+              null_density = 0.0, 
+              decimals = 0, 
+              version = 1, 
+              seed = 0, 
+              text_length = 12):
+    """
+    Returns the json-stat response (a dict) to a query for all values of 
+    a table with dimensions of the given sizes (see dataset).
+    """
+    array = values(int(np.prod(sizes)), null_density, decimals, seed)
+    return dataset(variables(sizes, text_length), array, version, decimals)
+
+
+def json_stat_bytes(sizes, **options):
+    """
+    Returns the json-stat response as bytes (as it arrives from the server).
+    """
+    return json.dumps(json_stat(sizes, **options)).encode('utf-8')
+
+
+def csv_bytes(sizes, 
+              null_density = 0.0, 
+              decimals = 0, 
+              seed = 0, 
+              heading = 1, 
+              text_length = 12):
+    """
+    Returns the csv response to a query for all values of the table 
+    (see csv_text).
+    """
+    array = values(int(np.prod(sizes)), null_density, decimals, seed)
+    return csv_text(variables(sizes, text_length), array, heading, decimals).encode('utf-8')
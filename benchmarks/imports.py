@@ -0,0 +1,151 @@
+# coding: utf-8
+
+"""
+Times the import of stats_to_pandas (and first use of the widgets), each
+in a new python process, to keep the start of scripts and workers fast.
+
+    python -m benchmarks.imports
+    python -m benchmarks.imports --repeat 10 --modules 15
+    python -m benchmarks.imports --out new.csv --baseline old.csv
+
+The seconds are the median of the runs. The optional modules column
+lists the heavy, optional modules the statement imported. --modules
+shows the modules that take the longest to import (python -X importtime).
+"""
+
+#%%
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+# the statements to time, each after the setup (which is not timed)
+STATEMENTS = [
+    ('pandas, requests', '', 'import pandas, requests'), 
+    ('stats_to_pandas', '', 'import stats_to_pandas'), 
+    ('read functions', '', 'import stats_to_pandas; stats_to_pandas.read_with_json'), 
+    ('widgets', 'import stats_to_pandas', 'stats_to_pandas.select'), 
+]
+
+# modules that only some of the functions need
+OPTIONAL = ('ipywidgets', 'IPython', 'pyjstat', 'aiohttp', 'pyarrow')
+
+# runs in the new process, prints the seconds and the optional modules
+TIMER = '''
+import json, sys, time
+{setup}
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [name for name in {optional!r} if name in sys.modules]]))
+'''
+
+
+def _environment():
+    """
+    The environment of the new processes (the repository is on the path).
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] + [path for path in
+                                                  [env.get('PYTHONPATH')] if path])
+    return env
+
+
+def measure(setup, statement, repeat = 5):
+    """
+    Returns the median seconds of repeat runs of statement (each in a new
+    python process) and the optional modules it imported.
+    """
+    code = TIMER.format(setup = setup, statement = statement, optional = OPTIONAL)
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], 
+                                env = _environment(), 
+                                capture_output = True, 
+                                text = True, 
+                                check = True).stdout
+        seconds, modules = json.loads(output.strip().splitlines()[-1])
+        times.append(seconds)
+    return sorted(times)[len(times) // 2], modules
+
+
+def run(repeat = 5):
+    """
+    Returns a dataframe with the import time of each statement.
+    """
+    rows = []
+    for name, setup, statement in STATEMENTS:
+        seconds, modules = measure(setup, statement, repeat)
+        rows.append({'statement' : name, 
+                     'seconds' : seconds, 
+                     'optional modules' : ', '.join(modules)})
+        print('{name:<20} {seconds:8.3f}  {modules}'.format(
+            name = name, seconds = seconds, modules = ', '.join(modules)), flush = True)
+    return pd.DataFrame(rows)
+
+
+def slowest(statement = 'import stats_to_pandas', top = 10):
+    """
+    Returns the modules that take the longest to import (cumulative
+    microseconds, as reported by python -X importtime) in statement.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], 
+                            env = _environment(), 
+                            capture_output = True, 
+                            text = True, 
+                            check = True).stderr
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        # only the modules imported directly, not their own imports
+        if len(name) - len(name.lstrip()) <= 3:
+            rows.append({'module' : name.strip(), 
+                         'self_us' : int(own), 
+                         'cumulative_us' : int(cumulative)})
+    return (pd.DataFrame(rows)
+            .sort_values('cumulative_us', ascending = False)
+            .head(top)
+            .reset_index(drop = True))
+
+
+def compare(results, baseline):
+    """
+    Returns the seconds of the results and the baseline side by side.
+    """
+    both = results.merge(baseline, on = 'statement', suffixes = ('', '_baseline'))
+    both['ratio'] = both['seconds'] / both['seconds_baseline']
+    return both[['statement', 'seconds_baseline', 'seconds', 'ratio']]
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type = int, default = 5, help = 'runs per statement (median is used)')
+    parser.add_argument('--modules', type = int, default = 0, 
+                        help = 'show the slowest modules to import')
+    parser.add_argument('--out', help = 'csv file to store the results in')
+    parser.add_argument('--baseline', help = 'csv file with results to compare with')
+    args = parser.parse_args(args)
+    
+    results = run(args.repeat)
+    
+    with pd.option_context('display.width', 120):
+        if args.modules:
+            print()
+            print(slowest(top = args.modules))
+        if args.baseline:
+            print()
+            print(compare(results, pd.read_csv(args.baseline)).round(3))
+    
+    if args.out:
+        results.to_csv(args.out, index = False)
+    return results
+
+
+if __name__ == '__main__':
+    main()
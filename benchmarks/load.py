@@ -0,0 +1,230 @@
+# coding: utf-8
+
+"""
+Load test: drives the entry points of stats_to_pandas (search, 
+get_variables, select and read_box, read_with_json, read_all, read_premade) 
+against the local PxWeb stand-in server, and reports the throughput and 
+the latency percentiles for different client configurations.
+
+    python -m benchmarks.load
+    python -m benchmarks.load --operations 300 --latency 0.05 --quota 30 --concurrency 1 8 32
+"""
+
+#%%
+import argparse
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import stats_to_pandas as stp
+from benchmarks.server import Server
+
+# the client configurations to compare
+#   client:          arguments to stp.Client
+#   metadata_ttl:    seconds metadata is cached (0: no cache)
+#   source:          limits of the source (requests, per, max_concurrency), 
+#                    the quota of the server unless given
+#   engine, response_format: how the tables are read
+CONFIGS = OrderedDict([
+    ('default', {}), 
+    ('no metadata cache', {'metadata_ttl' : 0}), 
+    ('pool of 2', {'client' : {'pool_maxsize' : 2}}), 
+    ('source limits', {'source' : {'max_concurrency' : 4}}), 
+    ('csv', {'response_format' : 'csv'}), 
+    ('stream', {'engine' : 'stream'}), 
+])
+
+# the operations, and how often they are used
+WEIGHTS = OrderedDict([('search', 2), 
+                       ('get_variables', 4), 
+                       ('select + read_box', 1), 
+                       ('read_with_json', 6), 
+                       ('read_all', 2), 
+                       ('read_premade', 1)])
+
+
+def _operations(base_url, config):
+    """
+    Returns the operations {name: function()} of the test.
+    """
+    options = dict((key, config[key]) for key in ('engine', 'response_format') if key in config)
+    premade_options = {'engine' : options.get('engine', 'native')}
+    
+    def read_box():
+        box = stp.select(table_id = '10001', base_url = base_url)
+        for var in stp.get_variables(table_id = '10001', base_url = base_url):
+            box.query.all(var['code'])
+        box.query.top('Tid', 3)
+        return stp.read_box(box, **options)
+    
+    def read_with_json():
+        table_id = random.choice(['10000', '10001', '10002'])
+        query = stp.Query()
+        for var in stp.get_variables(table_id = table_id, base_url = base_url):
+            query.all(var['code'])
+        query.top('Tid', random.randint(1, 5))
+        return stp.read_with_json(table_id = table_id, query = query, base_url = base_url, 
+                                  **options)
+    
+    return OrderedDict([
+        ('search', lambda: stp.search('synthetic', base_url = base_url)), 
+        ('get_variables', lambda: stp.get_variables(table_id = random.choice(['10000', '10001', '10002']), 
+                                                    base_url = base_url)), 
+        ('select + read_box', read_box), 
+        ('read_with_json', read_with_json), 
+        ('read_all', lambda: stp.read_all(table_id = random.choice(['10000', '10001']), 
+                                          base_url = base_url, **options)), 
+        ('read_premade', lambda: stp.read_premade(premade_id = '10000', 
+                                                  base_url = base_url + '/dataset', 
+                                                  **premade_options)), 
+    ])
+
+
+def _configure(server, config):
+    """
+    Gives the module a new client, scheduler and metadata cache, 
+    configured as config.
+    """
+    stp.client.close()
+    stp.client = stp.Client(**config.get('client', {}))
+    stp.scheduler = stp.Scheduler()
+    stp.metadata_cache = stp.MetadataCache(ttl = config.get('metadata_ttl', 3600))
+    
+    # the cell limit of the server is always known (as for a real source), 
+    # with source limits also its quota
+    limits = config.get('source', {})
+    stp.add_source(stp.Source('local', server.base_url, 
+                              max_cells = server.max_cells, 
+                              requests = limits.get('requests', server.requests if limits else None), 
+                              per = limits.get('per', server.per), 
+                              max_concurrency = limits.get('max_concurrency')))
+
+
+def run_config(server, config, operations = 100, concurrency = 4, seed = 0):
+    """
+    Runs the operations with concurrency threads and returns the latency of 
+    each operation as a dataframe, and the time it took.
+    """
+    _configure(server, config)
+    functions = _operations(server.base_url, config)
+    
+    random.seed(seed)
+    names = random.choices(list(WEIGHTS), weights = list(WEIGHTS.values()), k = operations)
+    
+    def timed(name):
+        start = time.perf_counter()
+        try:
+            functions[name]()
+            error = None
+        except Exception as exception:
+            error = repr(exception)
+        return OrderedDict([('operation', name), 
+                            ('seconds', time.perf_counter() - start), 
+                            ('error', error)])
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        rows = list(executor.map(timed, names))
+    return pd.DataFrame(rows), time.perf_counter() - start
+
+
+def run(configs = None, 
+        concurrency = (1, 8), 
+        operations = 100, 
+        latency = 0.02, 
+        max_cells = 20000, 
+        quota = None, 
+        per = 1.0):
+    """
+    Returns a dataframe with the throughput and latency percentiles 
+    (milliseconds) of each configuration and concurrency, and one with 
+    the percentiles of each operation.
+    """
+    configs = configs or CONFIGS
+    summary = []
+    by_operation = []
+    
+    for threads in concurrency:
+        for name, config in configs.items():
+            server = Server(latency = latency, max_cells = max_cells, requests = quota, per = per)
+            server.start()
+            try:
+                latencies, seconds = run_config(server, config, operations, threads)
+            finally:
+                server.stop()
+            
+            ms = latencies['seconds'] * 1000
+            throttled = int(stp.scheduler.stats()['throttled'].sum())
+            summary.append(OrderedDict([
+                ('config', name), 
+                ('concurrency', threads), 
+                ('ops_per_second', operations / seconds), 
+                ('p50_ms', np.percentile(ms, 50)), 
+                ('p90_ms', np.percentile(ms, 90)), 
+                ('p99_ms', np.percentile(ms, 99)), 
+                ('errors', int(latencies['error'].notnull().sum())), 
+                ('http_requests', server.stats['requests']), 
+                ('429', server.stats['throttled']), 
+                ('throttled_hosts', throttled)]))
+            print('{config:<20} {threads:>3} threads {ops:8.1f} ops/s  p50 {p50:8.1f} ms  '
+                  'p99 {p99:8.1f} ms  errors {errors}'.format(
+                      config = name, threads = threads, ops = summary[-1]['ops_per_second'], 
+                      p50 = summary[-1]['p50_ms'], p99 = summary[-1]['p99_ms'], 
+                      errors = summary[-1]['errors']))
+            
+            errors = latencies['error'].dropna()
+            if len(errors):
+                print('    first error:', errors.iloc[0])
+            
+            for operation, group in latencies.groupby('operation'):
+                by_operation.append(OrderedDict([
+                    ('config', name), 
+                    ('concurrency', threads), 
+                    ('operation', operation), 
+                    ('count', len(group)), 
+                    ('p50_ms', np.percentile(group['seconds'] * 1000, 50)), 
+                    ('p99_ms', np.percentile(group['seconds'] * 1000, 99))]))
+    
+    return pd.DataFrame(summary), pd.DataFrame(by_operation)
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = 'Load test against a local PxWeb stand-in')
+    parser.add_argument('--configs', nargs = '+', choices = list(CONFIGS), 
+                        help = 'the configurations to test (default: all)')
+    parser.add_argument('--concurrency', type = int, nargs = '+', default = [1, 8], 
+                        help = 'threads running operations at the same time')
+    parser.add_argument('--operations', type = int, default = 100)
+    parser.add_argument('--latency', type = float, default = 0.02, help = 'server latency (s)')
+    parser.add_argument('--max-cells', type = int, default = 20000, help = 'server cell limit')
+    parser.add_argument('--quota', type = int, help = 'server requests per --per seconds')
+    parser.add_argument('--per', type = float, default = 1.0)
+    parser.add_argument('--out', help = 'csv file to store the summary in')
+    args = parser.parse_args(args)
+    
+    configs = None
+    if args.configs:
+        configs = OrderedDict((name, CONFIGS[name]) for name in args.configs)
+    
+    summary, by_operation = run(configs, args.concurrency, args.operations, 
+                                args.latency, args.max_cells, args.quota, args.per)
+    
+    with pd.option_context('display.width', 140, 'display.max_rows', 500):
+        print()
+        print(summary.round(1).to_string(index = False))
+        print()
+        print(by_operation.pivot_table(index = ['config', 'concurrency'], 
+                                       columns = 'operation', 
+                                       values = 'p50_ms').round(1))
+    
+    if args.out:
+        summary.to_csv(args.out, index = False)
+    return summary, by_operation
+
+
+if __name__ == '__main__':
+    main()
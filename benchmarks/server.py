@@ -0,0 +1,384 @@
+# coding: utf-8
+
+"""
+A local stand-in for a PxWeb (v0) api with synthetic tables, for load 
+tests without network access (and without using the quota of a real server).
+
+    python -m benchmarks.server --port 8080 --latency 0.05 --max-cells 100000
+
+    stp.read_all(table_id = '10000', base_url = 'http://127.0.0.1:8080/api/v0')
+
+It answers
+    GET  /api/v0/{lang}/table/?query=phrase     search
+    GET  /api/v0/{lang}/table/                  the list of tables
+    GET  /api/v0/{lang}/table/{id}              metadata
+    POST /api/v0/{lang}/table/{id}              json-stat, json-stat2 or csv
+    GET  /api/v0/dataset?lang={lang}            the premade tables (html)
+    GET  /api/v0/dataset/{id}.json (or .csv)    a premade table (and HEAD)
+
+with an optional latency, the PxWeb limit on cells per query (403) 
+and a request quota (429 with Retry-After). The premade tables have an 
+ETag (304 if it matches If-None-Match), which changes with update(id).
+"""
+
+#%%
+import argparse
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+
+from benchmarks import generate
+
+# the tables of the server, {table_id: sizes of the dimensions}
+TABLES = OrderedDict([('10000', [20, 5, 10]), 
+                      ('10001', [200, 10, 20]), 
+                      ('10002', [1000, 4, 50])])
+
+
+class Server(object):
+    """
+    A PxWeb stand-in server, running in a thread.
+    
+    Example
+    -------
+    
+        server = Server(latency = 0.02, max_cells = 10000, requests = 30, per = 1)
+        base_url = server.start()
+        ...
+        server.stop()
+        server.stats
+    
+    
+    Parameters
+    ----------
+    
+        tables: dict
+            {table_id: sizes of the dimensions}, default TABLES
+            
+        latency: number
+            seconds before each answer
+            
+        max_cells: int
+            queries with more cells are refused (403, as PxWeb)
+            
+        requests, per: number
+            at most requests requests per `per` seconds are answered, 
+            the others get 429 (too many requests) 
+            
+        null_density: number
+            the share of missing values in the tables
+            
+        port: int
+            0: any free port
+            
+        head: bool
+            answer HEAD requests (False: 501, as some servers)
+    """
+    
+    def __init__(self, 
+                 tables = None, 
+                 latency = 0.0, 
+                 max_cells = 800000, 
+                 requests = None, 
+                 per = 1.0, 
+                 null_density = 0.05, 
+                 port = 0, 
+                 head = True):
+        self.tables = OrderedDict()
+        for table_id, sizes in (tables or TABLES).items():
+            variables = generate.variables(sizes)
+            array = generate.values(int(np.prod(sizes)), null_density, 
+                                    seed = int(table_id) % 1000)
+            self.tables[str(table_id)] = (variables, array.reshape(sizes))
+        
+        self.latency = latency
+        self.max_cells = max_cells
+        self.requests = requests
+        self.per = per
+        self.port = port
+        self.head = head
+        self.versions = dict((table_id, 1) for table_id in self.tables)
+        self.stats = {'requests' : 0, 'throttled' : 0, 'refused' : 0, 'cells' : 0}
+        self._answered = deque()
+        self._lock = threading.Lock()
+        self._httpd = None
+    
+    def start(self):
+        """
+        Starts the server and returns its base url.
+        """
+        server = self
+        
+        class Handler(_Handler):
+            pass
+        Handler.server_state = server
+        
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self._httpd.daemon_threads = True
+        thread = threading.Thread(target = self._httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.base_url
+    
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{port}/api/v0'.format(port = self._httpd.server_address[1])
+    
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+    
+    def update(self, table_id):
+        """
+        Marks a table as updated (the premade table gets a new ETag).
+        """
+        with self._lock:
+            self.versions[str(table_id)] += 1
+    
+    def etag(self, table_id):
+        return '"{id}-{version}"'.format(id = table_id, version = self.versions[table_id])
+    
+    def admit(self):
+        """
+        Returns 0 if a request may be answered now, else the seconds until 
+        it may (the request quota).
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.requests is None:
+                return 0
+            now = time.time()
+            while self._answered and self._answered[0] <= now - self.per:
+                self._answered.popleft()
+            if len(self._answered) >= self.requests:
+                self.stats['throttled'] += 1
+                return self._answered[0] + self.per - now
+            self._answered.append(now)
+            return 0
+    
+    def metadata(self, table_id):
+        variables, array = self.tables[table_id]
+        return OrderedDict([('title', '{id}: Synthetic table {id}'.format(id = table_id)), 
+                            ('variables', variables)])
+    
+    def select(self, table_id, query):
+        """
+        Returns the selected variables (with the selected values only) and 
+        the values of the query, or None if a selection is not supported.
+        """
+        variables, array = self.tables[table_id]
+        selections = dict((element['code'], element['selection']) for element in query['query'])
+        
+        selected = []
+        index = []
+        for var in variables:
+            if var['code'] not in selections:
+                # eliminated: the first value (a real server uses a total)
+                index.append([0])
+                continue
+            positions = _positions(selections[var['code']], var['values'])
+            if positions is None:
+                return None, None
+            new = OrderedDict(var)
+            new['values'] = [var['values'][n] for n in positions]
+            new['valueTexts'] = [var['valueTexts'][n] for n in positions]
+            selected.append(new)
+            index.append(positions)
+        return selected, array[np.ix_(*index)].reshape(-1)
+
+
+def _positions(selection, codes):
+    """
+    Returns the positions of the values a selection picks (in the order of 
+    the table), as the server understands the filters, or None if the 
+    filter is not supported or a value is not in the table.
+    
+    Written apart from the library, so the tests do not check the library 
+    against itself.
+    """
+    filt = selection['filter']
+    values = selection['values']
+    
+    if filt == 'item':
+        if not set(values) <= set(codes):
+            return None
+        return [n for n, code in enumerate(codes) if code in values]
+    
+    if filt == 'all':
+        # * is the only wildcard
+        patterns = [re.compile('.*'.join(re.escape(part) for part in value.split('*')) + '$') 
+                    for value in values]
+        return [n for n, code in enumerate(codes) 
+                if any(pattern.match(code) for pattern in patterns)]
+    
+    if filt == 'top':
+        # the latest values are the last ones
+        count = int(values[0])
+        return list(range(max(len(codes) - count, 0), len(codes)))
+    
+    return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    
+    server_state = None
+    protocol_version = 'HTTP/1.1'
+    head = False
+    
+    def log_message(self, *args):
+        pass
+    
+    def send(self, body, status = 200, content_type = 'application/json', headers = None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not self.head:
+            self.wfile.write(body)
+    
+    def begin(self):
+        """
+        Waits (latency) and returns False if the request has been answered 
+        with 429 (the quota is used).
+        """
+        state = self.server_state
+        if state.latency:
+            time.sleep(state.latency)
+        wait = state.admit()
+        if wait:
+            self.send({'error' : 'Too many requests'}, 429, 
+                      headers = {'Retry-After' : str(int(np.ceil(wait)))})
+            return False
+        return True
+    
+    def do_GET(self):
+        if not self.begin():
+            return
+        state = self.server_state
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        path = unquote(url.path).rstrip('/')
+        
+        if path.endswith('/dataset'):
+            rows = ''.join('<tr><td>Synthetic table {id}</td><td>synthetic, table</td>'
+                           '<td>{id}</td></tr>'.format(id = table_id) 
+                           for table_id in state.tables)
+            html = ('<table><tr><th>Title</th><th>Tags</th><th>ID</th></tr>{rows}'
+                    '</table>').format(rows = rows)
+            return self.send(html.encode('utf-8'), content_type = 'text/html')
+        
+        match = re.search(r'/dataset/(\w+)\.(json|csv)$', path)
+        if match:
+            table_id, extension = match.groups()
+            if table_id not in state.tables:
+                return self.send({'error' : 'No such table'}, 404)
+            variables, array = state.tables[table_id]
+            headers = {'ETag' : state.etag(table_id)}
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                return self.send(b'', 304, headers = headers)
+            if extension == 'csv':
+                return self.send(generate.csv_text(variables, array.reshape(-1)).encode('utf-8'), 
+                                 content_type = 'text/csv', headers = headers)
+            return self.send(generate.dataset(variables, array.reshape(-1)), headers = headers)
+        
+        match = re.search(r'/(\w+)/table(?:/(\w+))?$', path)
+        if not match:
+            return self.send({'error' : 'Not found'}, 404)
+        language, table_id = match.groups()
+        
+        if table_id is None and 'query' in params:
+            words = params['query'][0].lower().replace('*', '').split()
+            found = [{'id' : table_id, 
+                      'path' : '/synthetic', 
+                      'title' : state.metadata(table_id)['title'], 
+                      'score' : 1.0, 
+                      'published' : '2016-06-01T08:00:00'} 
+                     for table_id in state.tables 
+                     if all(word in state.metadata(table_id)['title'].lower() for word in words)]
+            return self.send(found)
+        
+        if table_id is None:
+            return self.send([{'id' : table_id, 'type' : 't', 
+                               'text' : state.metadata(table_id)['title'].split(': ', 1)[1], 
+                               'updated' : '2016-06-01T08:00:00'} 
+                              for table_id in state.tables])
+        
+        if table_id not in state.tables:
+            return self.send({'error' : 'No such table'}, 404)
+        return self.send(state.metadata(table_id))
+    
+    def do_HEAD(self):
+        if not self.server_state.head:
+            return self.send_error(501)
+        self.head = True
+        try:
+            self.do_GET()
+        finally:
+            self.head = False
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.begin():
+            return
+        state = self.server_state
+        
+        match = re.search(r'/table/(\w+)/?$', urlparse(self.path).path)
+        if not match or match.group(1) not in state.tables:
+            return self.send({'error' : 'No such table'}, 404)
+        
+        query = json.loads(body)
+        variables, values = state.select(match.group(1), query)
+        if variables is None:
+            return self.send({'error' : 'Unsupported selection'}, 400)
+        if len(values) > state.max_cells:
+            with state._lock:
+                state.stats['refused'] += 1
+            return self.send({'error' : 'Too many values selected'}, 403)
+        
+        with state._lock:
+            state.stats['cells'] += len(values)
+        
+        response_format = query.get('response', {}).get('format', 'json-stat')
+        if response_format == 'csv':
+            return self.send(generate.csv_text(variables, values).encode('utf-8'), 
+                             content_type = 'text/csv')
+        version = 2 if response_format == 'json-stat2' else 1
+        return self.send(generate.dataset(variables, values, version))
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = 'A local PxWeb stand-in server')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds per request')
+    parser.add_argument('--max-cells', type = int, default = 800000, help = 'cells per query')
+    parser.add_argument('--requests', type = int, help = 'request quota (429 above it)')
+    parser.add_argument('--per', type = float, default = 1.0, help = 'seconds of the quota')
+    args = parser.parse_args(args)
+    
+    server = Server(latency = args.latency, 
+                    max_cells = args.max_cells, 
+                    requests = args.requests, 
+                    per = args.per, 
+                    port = args.port)
+    print('Serving {n} tables at {url}'.format(n = len(server.tables), url = server.start()))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
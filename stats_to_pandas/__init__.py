@@ -10,603 +10,4546 @@
 #%% Required modules
 from __future__ import print_function
 
+import numpy as np
 import pandas as pd
 import requests
 import ast
-from pyjstat import pyjstat
+import asyncio
+import bisect
+import codecs
+import contextlib
+import contextvars
+import csv
+import email.utils
+import fnmatch
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import operator
+import os
+import re
+import threading
+import time
+import weakref
 from collections import OrderedDict
-from ipywidgets import widgets
-from IPython.display import display
-# todo: consider using jsonstat instead of pyjstat
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, reduce
+from urllib.parse import quote, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# the widgets (select, get_json, read_box) are in the interactive module, 
+# which is imported when they are first used, so the package can be used 
+# (and imported quickly) without ipywidgets and IPython. pyjstat is only 
+# imported for engine = 'pyjstat'.
+INTERACTIVE = ('select', 'get_json', 'read_box', 'MAX_OPTIONS')
 
-#%% Defaults (not yet implemented)
 
-# This is mainly to make the script flexible for future changes
-# Makes it easier to use the same script for sources other than Statistics Norway
-# The user can set a different source to be the default
-# (note to self: is the extra complexity worth it? 
-# more complex since functions now require defaults to be used easily)
+def __getattr__(name):
+    if name in INTERACTIVE:
+        from . import interactive
+        return getattr(interactive, name)
+    raise AttributeError('module {module!r} has no attribute {name!r}'.format(
+        module = __name__, name = name))
 
-#Statistics_Norway = {'base_url' : ['http://data.ssb.no/api/v0'], 
-#                     'language' : ['en', 'no'], 
-#                     'api_key' : [None]}
 
-# Add more sources here Statistics_Sweden = {...} etc
+def __dir__():
+    return sorted(set(globals()) | set(INTERACTIVE))
 
-# set a default
-#default = Statistics_Norway
 
-# make a list of the different sources
-#sources = ['Statistics_Norway']
+# the maximum number of cells in one query to a server that is not in 
+# sources (larger queries are split into several smaller queries)
+MAX_CELLS = 800000
+
+
+#%% Instrumentation
+
+# the functions called with an event (a dict) at the end of each phase of 
+# a read, see add_hook. Nothing is measured while the list is empty.
+hooks = []
+
+
+def add_hook(hook):
+    """
+    Calls hook(event) at the end of each phase of the work done by the 
+    module. The event is a dict with the phase, the seconds it took and 
+    some of: url, method, status, request_bytes, response_bytes, cells, 
+    requests, engine, format, cache_hit and error.
+    
+    The phases are 
+        query:          building a query: a full query from the metadata, 
+                        a Query or the widgets to a dict, and splitting a 
+                        large query into parts (requests)
+        metadata:       get_metadata (cache_hit)
+        request:        one http request, until the headers have arrived 
+                        (queued: seconds waiting in the scheduler)
+        parse:          json decoding of a response
+        convert:        json-stat to dataframe
+        decode:         response to dataframe in one step (stream, csv)
+        result_cache:   looking up a stored result (cache_hit)
+        write:          writing a part to parquet (to_parquet)
+        read:           a whole read (cells, requests)
+    
+    Example
+    -------
+    
+        stp.add_hook(lambda event: statsd.timing(event['phase'], event['seconds']))
+    """
+    if hook not in hooks:
+        hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+def _emit(phase, seconds, info):
+    event = {'phase' : phase, 'seconds' : seconds}
+    event.update(info)
+    for hook in list(hooks):
+        hook(event)
+
+
+class _Phase(object):
+    """
+    Context manager that measures a phase and sends the event to the 
+    hooks (does nothing if there are no hooks). 
+    
+    Use set() to add information (bytes, cells) to the event.
+    """
+    __slots__ = ('phase', 'info', 'start')
+    
+    def __init__(self, phase, **info):
+        self.phase = phase
+        self.info = info
+        self.start = time.perf_counter() if hooks else None
+    
+    def __enter__(self):
+        return self
+    
+    def set(self, **info):
+        if self.start is not None:
+            self.info.update(info)
+    
+    def __exit__(self, kind, error, traceback):
+        if self.start is not None:
+            if error is not None:
+                self.info['error'] = repr(error)
+            _emit(self.phase, time.perf_counter() - self.start, self.info)
+
+
+class Stats(object):
+    """
+    A hook that adds up the events of each phase: the number of events, 
+    the seconds, the bytes sent and received, the cells, the cache hits 
+    and the errors.
+    
+    Example
+    -------
+    
+        with stp.Stats() as stats:
+            df = stp.read_all(table_id = '10714')
+        stats.frame()
+        
+        stats = stp.add_hook(stp.Stats(keep_events = True))
+    
+    
+    Parameters
+    ----------
+    
+        keep_events: bool
+            also keep a list of all the events (events)
+    """
+    
+    _COUNTERS = ('count', 'seconds', 'request_bytes', 'response_bytes', 
+                 'cells', 'cache_hits', 'errors')
+    
+    def __init__(self, keep_events = False):
+        self.keep_events = keep_events
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.phases = OrderedDict()
+            self.events = []
+    
+    def __call__(self, event):
+        with self._lock:
+            if self.keep_events:
+                self.events.append(event)
+            totals = self.phases.get(event['phase'])
+            if totals is None:
+                totals = self.phases[event['phase']] = OrderedDict.fromkeys(self._COUNTERS, 0)
+            totals['count'] += 1
+            totals['seconds'] += event['seconds']
+            totals['request_bytes'] += event.get('request_bytes') or 0
+            totals['response_bytes'] += event.get('response_bytes') or 0
+            totals['cells'] += event.get('cells') or 0
+            totals['cache_hits'] += bool(event.get('cache_hit'))
+            totals['errors'] += 'error' in event
+    
+    def frame(self):
+        """
+        Returns a dataframe with the totals of each phase.
+        """
+        with self._lock:
+            return pd.DataFrame.from_dict(self.phases, orient = 'index', 
+                                          columns = list(self._COUNTERS))
+    
+    def __enter__(self):
+        return add_hook(self)
+    
+    def __exit__(self, *args):
+        remove_hook(self)
+
+
+#%% Request scheduler
+
+# priority of the lanes (lower is served first)
+LANES = {'interactive' : 0, 'batch' : 1}
+
+_lane = contextvars.ContextVar('stats_to_pandas_lane', default = 'interactive')
+
+
+class _Bucket(object):
+    """
+    A token bucket and a queue of waiting requests for one host.
+    """
+    
+    def __init__(self):
+        self.rate = None            # tokens per second (None: no limit)
+        self.capacity = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = []           # heap of (priority, ticket)
+        self.max_concurrency = None
+        self.active = 0
+        self.requests = 0
+        self.queued = 0.0
+        self.throttled = 0
+    
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class Scheduler(object):
+    """
+    Decides when requests may be sent, so the request quota of a server 
+    is not exceeded. Every request in the module passes through the 
+    scheduler in the module variable scheduler.
+    
+    Each host has a token bucket: at most `requests` requests per `per` 
+    seconds (and short bursts of up to `requests`), and at most 
+    max_concurrency requests at the same time. The limits of the hosts in 
+    sources are set when the source is added. Waiting requests are 
+    served by lane: 'interactive' requests before 'batch' requests, and 
+    in the order they arrived within a lane. When a server answers 429 
+    (too many requests), all requests to it wait (Retry-After seconds if 
+    the server says so).
+    
+    Example
+    -------
+    
+        stp.scheduler.set_limit('data.ssb.no', requests = 30, per = 60)
+        
+        with stp.scheduler.lane('batch'):
+            df = stp.read_all(table_id = '10714')
+        
+        stp.scheduler.stats()
+    
+    
+    Parameters
+    ----------
+    
+        limits: dict
+            {host: (requests, per)}, hosts without a limit are not throttled
+            (except after a 429 response)
+    """
+    
+    def __init__(self, limits = None):
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._tickets = itertools.count()
+        # (event loop, asyncio.Event) of the requests waiting in async_acquire
+        self._async_waiters = set()
+        for host, (requests, per) in (limits or {}).items():
+            self.set_limit(host, requests, per)
+    
+    def _bucket(self, host):
+        if host not in self._buckets:
+            self._buckets[host] = _Bucket()
+        return self._buckets[host]
+    
+    def _notify(self):
+        """
+        Wakes all waiting requests, in threads and in event loops 
+        (call it with the condition held).
+        """
+        self._condition.notify_all()
+        for loop, event in list(self._async_waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the loop is closed
+                self._async_waiters.discard((loop, event))
+    
+    def _enqueue(self, host, lane):
+        priority = LANES[lane or _lane.get()]
+        bucket = self._bucket(host)
+        ticket = (priority, next(self._tickets))
+        heapq.heappush(bucket.waiting, ticket)
+        return bucket, ticket
+    
+    def _wait(self, bucket, ticket):
+        """
+        Returns (ready, seconds): ready is True if the request may be 
+        sent now, otherwise it should wait for seconds (None: until 
+        another request finishes).
+        """
+        now = time.monotonic()
+        bucket.refill(now)
+        wait = bucket.paused_until - now
+        if bucket.rate is not None and bucket.tokens < 1:
+            wait = max(wait, (1 - bucket.tokens) / bucket.rate)
+        full = (bucket.max_concurrency is not None and 
+                bucket.active >= bucket.max_concurrency)
+        if wait <= 0 and not full and bucket.waiting[0] == ticket:
+            return True, 0
+        return False, (wait if wait > 0 else None)
+    
+    def _take(self, bucket, start):
+        """
+        Gives the first waiting request a token and a slot.
+        """
+        heapq.heappop(bucket.waiting)
+        if bucket.rate is not None:
+            bucket.tokens -= 1
+        waited = time.monotonic() - start
+        bucket.active += 1
+        bucket.requests += 1
+        bucket.queued += waited
+        self._notify()
+        return waited
+    
+    def _leave(self, bucket, ticket):
+        """
+        Removes a request that stopped waiting (for instance cancelled).
+        """
+        bucket.waiting.remove(ticket)
+        heapq.heapify(bucket.waiting)
+        self._notify()
+    
+    def set_limit(self, host, requests = None, per = 1.0, max_concurrency = None):
+        """
+        Allows at most requests requests to the host per `per` seconds, 
+        and at most max_concurrency requests at the same time 
+        (None removes the limit).
+        """
+        with self._condition:
+            bucket = self._bucket(host)
+            bucket.refill(time.monotonic())
+            if requests is None:
+                bucket.rate = None
+            else:
+                bucket.rate = float(requests) / per
+                bucket.capacity = requests
+                bucket.tokens = min(bucket.tokens, requests) if bucket.requests else requests
+            bucket.max_concurrency = max_concurrency
+            self._notify()
+    
+    @contextlib.contextmanager
+    def lane(self, name):
+        """
+        Context manager: requests made inside it use the lane 
+        ('interactive' or 'batch').
+        """
+        if name not in LANES:
+            raise ValueError('Unknown lane: {name}, use one of {lanes}'.format(
+                name = name, lanes = list(LANES)))
+        token = _lane.set(name)
+        try:
+            yield
+        finally:
+            _lane.reset(token)
+    
+    def acquire(self, host, lane = None):
+        """
+        Waits until a request to the host may be sent. 
+        Returns the number of seconds waited. 
+        
+        Call release() when the response has arrived.
+        """
+        with self._condition:
+            start = time.monotonic()
+            bucket, ticket = self._enqueue(host, lane)
+            try:
+                while True:
+                    ready, wait = self._wait(bucket, ticket)
+                    if ready:
+                        return self._take(bucket, start)
+                    self._condition.wait(wait)
+            except BaseException:
+                self._leave(bucket, ticket)
+                raise
+    
+    async def async_acquire(self, host, lane = None):
+        """
+        Asyncio version of acquire: waits in the event loop, without 
+        using a thread. If the waiting task is cancelled, it leaves the 
+        queue without taking a slot.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        
+        with self._condition:
+            start = time.monotonic()
+            bucket, ticket = self._enqueue(host, lane)
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                with self._condition:
+                    ready, wait = self._wait(bucket, ticket)
+                    if ready:
+                        return self._take(bucket, start)
+                    event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._condition:
+                self._leave(bucket, ticket)
+            raise
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+    
+    def release(self, host):
+        """
+        Tells the scheduler that a request to the host has finished.
+        """
+        with self._condition:
+            self._bucket(host).active -= 1
+            self._notify()
+    
+    def penalize(self, host, seconds):
+        """
+        Makes all requests to the host wait for (at least) seconds, 
+        for instance after a 429 response.
+        """
+        with self._condition:
+            bucket = self._bucket(host)
+            bucket.paused_until = max(bucket.paused_until, time.monotonic() + seconds)
+            bucket.throttled += 1
+            self._notify()
+    
+    def stats(self):
+        """
+        Returns a dataframe with, for each host, the number of requests, 
+        the seconds requests spent waiting in the queue, the number of 
+        429 responses and the number of requests running and waiting now.
+        """
+        with self._condition:
+            rows = OrderedDict((host, OrderedDict([
+                        ('requests', bucket.requests), 
+                        ('queued_seconds', bucket.queued), 
+                        ('throttled', bucket.throttled), 
+                        ('active', bucket.active), 
+                        ('waiting', len(bucket.waiting))]))
+                    for host, bucket in self._buckets.items())
+        return pd.DataFrame.from_dict(rows, orient = 'index')
+
+
+# the scheduler used by all requests in the module
+scheduler = Scheduler()
+
+
+def _content_length(headers):
+    """
+    Returns the size of the body of a response (None if unknown), 
+    as sent (compressed) by the server.
+    """
+    length = headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def _retry_after(headers, default):
+    """
+    Returns the seconds to wait according to the Retry-After header 
+    (a number of seconds or a date), or default.
+    """
+    value = headers.get('Retry-After')
+    if value is None:
+        return default
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(date.timestamp() - time.time(), 0)
+
+
+#%% HTTP client
+
+class Client(object):
+    """
+    A pooled, keep-alive HTTP client. All functions in the module send 
+    their requests through the client in the module variable client, so 
+    connections to a host are reused instead of being set up for every call.
+    
+    The client may be shared between threads.
+    
+    Example
+    -------
+    
+        stp.client = stp.Client(pool_maxsize = 20, timeout = 60)
+    
+    
+    Parameters
+    ----------
+    
+        pool_connections: int
+            number of hosts to keep connection pools for
+            
+        pool_maxsize: int
+            maximum number of connections kept open to each host 
+            (hosts in sources with a max_concurrency use that instead)
+            
+        timeout: number or tuple
+            seconds to wait for the server, either one number or a 
+            (connect, read) tuple
+            
+        retries: int
+            number of times a request is retried after a connection error 
+            or a response with one of the status codes in status_forcelist
+            
+        backoff_factor: number
+            the wait before retry number n is backoff_factor * 2 ** (n - 1) 
+            seconds (a Retry-After header from the server is respected). 
+            After a 429 response, all requests to the host wait (see Scheduler).
+            
+        status_forcelist: tuple
+            the http status codes that trigger a retry
+            
+        headers: dict
+            extra headers sent with every request
+    """
+    
+    def __init__(self, 
+                 pool_connections = 10, 
+                 pool_maxsize = 10, 
+                 timeout = (10, 300), 
+                 retries = 3, 
+                 backoff_factor = 0.5, 
+                 status_forcelist = (429, 500, 502, 503, 504), 
+                 headers = None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self.headers = headers
+        self._session = None
+        self._lock = threading.Lock()
+    
+    @property
+    def session(self):
+        """
+        The underlying requests.Session (created on first use).
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._make_session()
+        return self._session
+    
+    def _retry(self):
+        # connection errors are retried by the adapter, error responses in 
+        # request() (so the retries also pass through the scheduler)
+        # post is included since the json queries only read data
+        return Retry(total = self.retries, 
+                     status = 0, 
+                     backoff_factor = self.backoff_factor, 
+                     allowed_methods = frozenset(['GET', 'HEAD', 'POST']), 
+                     raise_on_status = False)
+    
+    def _make_session(self):
+        # the connection pools of the adapter are thread safe
+        adapter = HTTPAdapter(pool_connections = self.pool_connections, 
+                              pool_maxsize = self.pool_maxsize, 
+                              max_retries = self._retry())
+        
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        for source in sources.values():
+            self._mount(session, source)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        if self.headers:
+            session.headers.update(self.headers)
+        return session
+    
+    def _mount(self, session, source):
+        """
+        Gives the host of the source a connection pool as large as the 
+        number of requests it allows at the same time.
+        """
+        if source.max_concurrency is None:
+            return
+        adapter = HTTPAdapter(pool_connections = 1, 
+                              pool_maxsize = source.max_concurrency, 
+                              max_retries = self._retry())
+        for scheme in ('http://', 'https://'):
+            session.mount(scheme + source.host + '/', adapter)
+    
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request and returns the response. 
+        Raises requests.HTTPError if the server responds with an error.
+        
+        With stream = True the request keeps its place in the scheduler 
+        until the body has been read and the response is closed (or 
+        garbage collected), so close it when done, eg. with a with block.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).netloc
+        stream = kwargs.get('stream', False)
+        
+        for attempt in range(self.retries + 1):
+            queued = scheduler.acquire(host)
+            try:
+                with _Phase('request', method = method, url = url, attempt = attempt) as phase:
+                    response = self.session.request(method, url, **kwargs)
+                    phase.set(status = response.status_code, 
+                              queued = queued, 
+                              request_bytes = len(response.request.body or b''), 
+                              response_bytes = 0 if method == 'HEAD' else 
+                                               _content_length(response.headers))
+            except BaseException:
+                scheduler.release(host)
+                raise
+            if response.status_code not in self.status_forcelist or attempt == self.retries:
+                break
+            
+            response.close()
+            scheduler.release(host)
+            wait = _retry_after(response.headers, self.backoff_factor * 2 ** attempt)
+            if response.status_code == 429:
+                # slow down all requests to the host, not only this one
+                scheduler.penalize(host, wait)
+            else:
+                time.sleep(wait)
+        
+        if stream and response.ok:
+            _release_on_close(response, scheduler, host)
+        else:
+            # an error is read now, so it can be shown after the release
+            response.content
+            scheduler.release(host)
+        response.raise_for_status()
+        return response
+    
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+    
+    def close(self):
+        """
+        Closes all open connections.
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+def _release_on_close(response, scheduler, host):
+    """
+    Releases the place of a streamed response in the scheduler (once) when 
+    the response is closed or garbage collected.
+    """
+    release = weakref.finalize(response, scheduler.release, host)
+    close = response.close
+    
+    def closing():
+        try:
+            close()
+        finally:
+            release()
+    response.close = closing
+
+
+# the client used by all functions in the module (may be replaced by the user)
+client = Client()
+
+
+#%% Sources
+
+class Source(object):
+    """
+    The profile of a statistics agency with a PxWeb api: where the api is, 
+    the languages and the limits of the server.
+    
+    The functions in the module take a source parameter (the name of a 
+    source in the module variable sources, default: default_source) and 
+    use its base_url unless a base_url is given. The limits are used for 
+    all requests to the host of the source, also when they are made with 
+    a base_url or full_url: queries larger than max_cells are split, and 
+    the scheduler and client keep to the request quota and max_concurrency.
+    
+    Example
+    -------
+    
+        df = stp.read_all(table_id = 'BE/BE0101/BE0101A/BefolkningNy', source = 'scb')
+        
+        stp.add_source(stp.Source('statfin', 
+                                  'https://pxdata.stat.fi/PXWeb/api/v1', 
+                                  languages = ('fi', 'sv', 'en'), 
+                                  database = 'StatFin', 
+                                  max_cells = 100000, 
+                                  requests = 10, per = 10))
+        stp.default_source = 'statfin'
+    
+    
+    Parameters
+    ----------
+    
+        name: string
+            the key of the source in sources
+            
+        base_url: string
+            base url of the api (not including language and table identifiers)
+            
+        languages: tuple
+            the languages of the api, the first is the main language
+            
+        database: string
+            the part of the url between the language and the table id 
+            ('table' at Statistics Norway, 'ssd' at Statistics Sweden, 
+            None if there is nothing)
+            
+        premade_url: string
+            url of the premade tables (None if the source has none)
+            
+        max_cells: int
+            the maximum number of cells the server returns for one query
+            
+        requests, per: number
+            the server allows requests requests per `per` seconds 
+            (requests = None: no limit)
+            
+        max_concurrency: int
+            the maximum number of requests to the server at the same time
+    """
+    
+    def __init__(self, 
+                 name, 
+                 base_url, 
+                 languages = ('en',), 
+                 database = 'table', 
+                 premade_url = None, 
+                 max_cells = MAX_CELLS, 
+                 requests = None, 
+                 per = 1.0, 
+                 max_concurrency = None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.languages = tuple(languages)
+        self.database = database
+        self.premade_url = premade_url
+        self.max_cells = max_cells
+        self.requests = requests
+        self.per = per
+        self.max_concurrency = max_concurrency
+    
+    @property
+    def host(self):
+        return urlparse(self.base_url).netloc
+    
+    def __repr__(self):
+        return 'Source({name!r}, {base_url!r})'.format(name = self.name, 
+                                                       base_url = self.base_url)
+
+
+# the sources, by name (use add_source to add or change one)
+sources = OrderedDict()
+
+# the source used when neither a source nor a base_url is given
+default_source = 'ssb'
+
+
+def add_source(source):
+    """
+    Adds a source (or replaces the one with the same name) and applies 
+    its limits to the requests to its host.
+    """
+    sources[source.name] = source
+    scheduler.set_limit(source.host, 
+                        requests = source.requests, 
+                        per = source.per, 
+                        max_concurrency = source.max_concurrency)
+    with client._lock:
+        if client._session is not None:
+            client._mount(client._session, source)
+    return source
+
+
+def get_source(source = None, url = None):
+    """
+    Returns a Source: the source itself, the source with the name source, 
+    the source of the host of url (None if the host is not in sources) 
+    or the default source.
+    """
+    if isinstance(source, Source):
+        return source
+    
+    if source is not None:
+        if source not in sources:
+            raise ValueError('Unknown source: {source}, use one of {names} '
+                             'or add_source()'.format(source = source, 
+                                                      names = list(sources)))
+        return sources[source]
+    
+    if url is not None:
+        host = urlparse(url).netloc
+        for candidate in sources.values():
+            if candidate.host == host:
+                return candidate
+        return None
+    
+    return get_source(default_source)
+
+
+def _base_url(base_url = None, source = None):
+    """
+    Returns base_url, or the base url of the source if base_url is None.
+    """
+    if base_url is None:
+        base_url = get_source(source).base_url
+    return base_url
+
+
+def _api_url(base_url, language, path = ''):
+    """
+    Returns the url of a table or folder (path) in the api at base_url.
+    """
+    source = get_source(url = base_url)
+    database = 'table' if source is None else source.database
+    parts = [base_url.rstrip('/'), language, database, path]
+    return '/'.join(part for part in parts if part is not None)
+
+
+def _max_cells(url):
+    """
+    Returns the maximum number of cells in one query to the server of url.
+    """
+    source = get_source(url = url)
+    if source is None or source.max_cells is None:
+        return MAX_CELLS
+    return source.max_cells
+
+
+# The limits are from the api documentation of each agency (Statistics 
+# Norway: 800 000 cells and 30 requests a minute, Statistics Sweden: 
+# 150 000 cells and 30 requests in 10 seconds). The limits for the Central 
+# Statistics Office (Ireland) are cautious guesses, change them if needed.
+
+add_source(Source('ssb', 
+                  'http://data.ssb.no/api/v0', 
+                  languages = ('en', 'no'), 
+                  premade_url = 'http://data.ssb.no/api/v0/dataset', 
+                  max_cells = 800000, 
+                  requests = 30, 
+                  per = 60, 
+                  max_concurrency = 4))
+
+add_source(Source('scb', 
+                  'https://api.scb.se/OV0104/v1/doris', 
+                  languages = ('sv', 'en'), 
+                  database = 'ssd', 
+                  max_cells = 150000, 
+                  requests = 30, 
+                  per = 10, 
+                  max_concurrency = 4))
+
+add_source(Source('cso', 
+                  'https://ws.cso.ie/public/api.pxapi/PxStat.Data.Cube_API.PxAPIv1', 
+                  languages = ('en', 'ga'), 
+                  database = None, 
+                  max_cells = 1000000, 
+                  requests = 10, 
+                  per = 1, 
+                  max_concurrency = 4))
+
+
+
+#%% Metadata cache
+
+class MetadataCache(object):
+    """
+    A memoizing store for table metadata (the variables and values of a table).
+    
+    Entries are keyed by (base_url, language, table_id). The cache is shared
+    by all the functions in the module, so the metadata for a table is only 
+    downloaded once even if select, get_json, full_json and read_all all 
+    need it.
+    
+    Example
+    -------
+    
+        stp.metadata_cache.ttl = 600
+        stp.metadata_cache = stp.MetadataCache(maxsize = 1000, path = 'meta')
+    
+    
+    Parameters
+    ----------
+    
+        ttl: number
+            seconds before an entry expires and is downloaded again
+            None: entries never expire
+            
+        maxsize: int
+            maximum number of entries kept in memory. When the cache is 
+            full, the least recently used entry is evicted.
+            
+        path: string
+            optional directory for an on-disk copy of the cache. 
+            Entries found on disk survive restarts of the python session.
+            
+    """
+    
+    def __init__(self, ttl = 3600, maxsize = 256, path = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        
+    def _expired(self, stored):
+        return self.ttl is not None and time.time() - stored > self.ttl
+    
+    def _file(self, key):
+        name = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + '.json')
+        
+    def get(self, key):
+        """
+        Returns the metadata stored under key, or None if there is no 
+        (unexpired) entry.
+        """
+        key = tuple(key)
+        with self._lock:
+            if key in self._entries:
+                stored, value = self._entries[key]
+                if not self._expired(stored):
+                    # mark as recently used
+                    self._entries[key] = self._entries.pop(key)
+                    return value
+                del self._entries[key]
+        
+        if self.path is None:
+            return None
+        
+        try:
+            with open(self._file(key)) as f:
+                entry = json.load(f, object_pairs_hook = OrderedDict)
+        except (IOError, OSError, ValueError):
+            return None
+        
+        if self._expired(entry['stored']):
+            return None
+        
+        self._remember(key, entry['value'], entry['stored'])
+        return entry['value']
+    
+    def set(self, key, value):
+        """
+        Stores the metadata under key (in memory and, if path is set, on disk).
+        """
+        key = tuple(key)
+        stored = time.time()
+        self._remember(key, value, stored)
+        
+        if self.path is not None:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with open(self._file(key), 'w') as f:
+                json.dump({'key' : key, 'stored' : stored, 'value' : value}, f)
+    
+    def _remember(self, key, value, stored):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (stored, value)
+            while self.maxsize is not None and len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+    
+    def delete(self, key):
+        """
+        Removes the entry stored under key (also on disk), so the metadata 
+        is downloaded again the next time it is needed.
+        """
+        key = tuple(key)
+        with self._lock:
+            self._entries.pop(key, None)
+        
+        if self.path is not None:
+            try:
+                os.remove(self._file(key))
+            except (IOError, OSError):
+                pass
+    
+    def clear(self):
+        """
+        Removes all entries (also the entries on disk).
+        """
+        with self._lock:
+            self._entries.clear()
+        
+        if self.path is not None and os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.path, name))
+    
+    def __len__(self):
+        return len(self._entries)
+
+
+# the cache used by all functions in the module (may be replaced by the user)
+metadata_cache = MetadataCache()
+
+
+def _table_url(table_id = None, 
+               language = 'en', 
+               base_url = None, 
+               full_url = None, 
+               source = None):
+    """
+    Returns the full url to a table (full_url wins if it is specified).
+    """
+    if full_url is None:
+        full_url = _api_url(_base_url(base_url, source), language, str(table_id))
+    return full_url
+
+
+def _cache_key(full_url):
+    """
+    Splits a full table url into the (base_url, language, table_id) key 
+    used by the metadata cache.
+    """
+    source = get_source(url = full_url)
+    database = 'table' if source is None else source.database
+    url = full_url.rstrip('/')
+    
+    if database is None:
+        # the table id follows the language (and may contain slashes)
+        head, sep, rest = url.partition(urlparse(source.base_url).path + '/')
+        language, _, table_id = rest.partition('/')
+        if not sep or not table_id:
+            return (full_url, None, None)
+        return (head + sep.rstrip('/'), language, table_id)
+    
+    head, sep, table_id = url.rpartition('/' + database + '/')
+    if not sep:
+        return (full_url, None, None)
+    base_url, _, language = head.rpartition('/')
+    return (base_url, language, table_id)
+
+
+def get_metadata(table_id = None, 
+                 language = 'en', 
+                 base_url = None, 
+                 full_url = None, 
+                 source = None):
+    """
+    Returns the metadata for a table as a dictionary with the title of the
+    table and a list of its variables.
+    
+    The metadata is read from the metadata cache (metadata_cache) and 
+    is only downloaded if it is not already there.
+    
+    Example
+    -------
+    
+        meta = get_metadata(table_id = '10714')
+        meta['title']
+    
+    
+    Parameters
+    ----------
+    
+        table_id: string
+            the unique table_id number, a string including leading zeros.
+            
+        language: string
+            default 'en' (default, English) 
+            optional: 'no' (Norwegian)
+        
+        base_url: string
+            base url locating the table (not including table identifier)
+            default: the base url of the source
+        
+        full_url: string 
+            The full url to the table.
+            If full_url is specified, other paramaters are ignored.
+        
+        source: string
+            the name of a source in sources (default: default_source)
+    """
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+    key = _cache_key(full_url)
+    
+    with _Phase('metadata', url = full_url) as phase:
+        metadata = metadata_cache.get(key)
+        phase.set(cache_hit = metadata is not None)
+        if metadata is None:
+            metadata = client.get(full_url).json(object_pairs_hook = OrderedDict)
+            metadata_cache.set(key, metadata)
+    return metadata
+
+
+#%% Result cache
+
+def _has_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def _write_frame(df, path):
+    """
+    Writes a dataframe to a parquet file, or a pickle if the file 
+    does not end with .parquet. A pyarrow Table is written to a parquet 
+    file, or an arrow file if the file ends with .arrow. The file is 
+    replaced in one step.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    
+    temp = '{path}.{pid}.tmp'.format(path = path, pid = os.getpid())
+    if not isinstance(df, pd.DataFrame):
+        # a pyarrow Table
+        import pyarrow as pa
+        if path.endswith('.arrow'):
+            with pa.OSFile(temp, 'wb') as sink:
+                with pa.ipc.new_file(sink, df.schema) as writer:
+                    writer.write_table(df)
+        else:
+            import pyarrow.parquet as pq
+            pq.write_table(df, temp)
+    elif path.endswith('.parquet'):
+        df.to_parquet(temp)
+    else:
+        df.to_pickle(temp)
+    os.replace(temp, path)
+
+
+def _read_frame(path):
+    """
+    Reads a dataframe written by _write_frame.
+    """
+    if path.endswith('.arrow'):
+        # memory mapped, the table is not copied into memory
+        import pyarrow as pa
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+class ResultCache(object):
+    """
+    An on-disk cache of downloaded tables. 
+    
+    A table is stored under a hash of the url and the query (the order of 
+    the variables and values in the query does not matter). Before a stored 
+    table is used, it is checked that the table has not been updated 
+    on the server since it was stored: for table queries the time the 
+    table was updated (from the metadata or the search), for premade 
+    tables the ETag/Last-Modified of the file. 
+    
+    Tables are stored as parquet files (if pyarrow is installed) or pickles, 
+    and pyarrow Tables (output = 'arrow') as arrow files.
+    
+    Example
+    -------
+    
+        stp.result_cache = stp.ResultCache('tables')   # use for all reads
+        
+        df = read_all(table_id = '10714', cache = stp.ResultCache('tables'))
+    
+    
+    Parameters
+    ----------
+    
+        path: string
+            the directory where the tables are stored
+            
+        max_age: number
+            seconds a stored table is used without checking the server.
+            None (default): always check.
+    """
+    
+    def __init__(self, path = 'stats_to_pandas_cache', max_age = None):
+        self.path = path
+        self.max_age = max_age
+        self.format = 'parquet' if _has_pyarrow() else 'pkl'
+    
+    def key(self, url, query = None, options = None):
+        """
+        Returns the key (a hash) of the url, query and decoding options.
+        """
+        if query is not None:
+            elements = []
+            for element in sorted(query['query'], key = lambda element: element['code']):
+                selection = dict(element['selection'])
+                if selection['filter'] == 'item':
+                    selection['values'] = sorted(selection['values'])
+                elements.append({'code' : element['code'], 'selection' : selection})
+            query = dict(query, query = elements)
+        
+        canonical = json.dumps({'url' : url, 'query' : query, 'options' : options}, 
+                               sort_keys = True, default = str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def _file(self, key, extension):
+        return os.path.join(self.path, '{key}.{extension}'.format(
+            key = key, extension = extension))
+    
+    def info(self, key):
+        """
+        Returns the information stored with a table (when it was stored, 
+        when it was updated, etag ...) or None if the table is not stored.
+        """
+        try:
+            with open(self._file(key, 'json')) as f:
+                info = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not os.path.exists(self._file(key, info['format'])):
+            return None
+        return info
+    
+    def fresh(self, info):
+        """
+        True if the table was stored less than max_age seconds ago.
+        """
+        return self.max_age is not None and time.time() - info['stored'] < self.max_age
+    
+    def load(self, key, info):
+        return _read_frame(self._file(key, info['format']))
+    
+    def store(self, key, df, **info):
+        """
+        Stores a table with some information about it 
+        (for instance updated, etag and last_modified).
+        """
+        info['stored'] = time.time()
+        info['format'] = self.format if isinstance(df, pd.DataFrame) else 'arrow'
+        _write_frame(df, self._file(key, info['format']))
+        self._write_info(key, info)
+    
+    def touch(self, key, info):
+        """
+        Marks a stored table as checked now (the server says it has not 
+        changed), so it is used for max_age seconds again without asking.
+        """
+        info = dict(info, stored = time.time())
+        self._write_info(key, info)
+    
+    def _write_info(self, key, info):
+        with open(self._file(key, 'json'), 'w') as f:
+            json.dump(info, f)
+    
+    def clear(self):
+        """
+        Removes all stored tables.
+        """
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith(('.json', '.parquet', '.pkl', '.arrow')):
+                    os.remove(os.path.join(self.path, name))
+
+
+def _cache_options(options):
+    """
+    Returns the options that make a stored result different.
+    """
+    key = [options.get('categorical'), options.get('value_dtype')]
+    if options.get('output', 'pandas') != 'pandas':
+        key.append(options['output'])
+    return key
+
+
+# the result cache used when the cache option is not given (None: no cache)
+result_cache = None
+
+
+def _result_cache(cache):
+    """
+    Returns the result cache to use for the cache option of a function 
+    (True: a cache in the default directory).
+    """
+    if cache is None:
+        return result_cache
+    if cache is False:
+        return None
+    if cache is True:
+        return ResultCache()
+    if isinstance(cache, ResultCache):
+        return cache
+    if not isinstance(cache, (str, os.PathLike)):
+        raise TypeError('cache must be a ResultCache, a directory, True or False, '
+                        'not {cache!r}'.format(cache = cache))
+    return ResultCache(path = cache)
+
+
+def _table_updated(full_url):
+    """
+    Returns when the table was last updated on the server 
+    (or None if this is not available).
+    
+    Uses the metadata if it has this information, otherwise the search.
+    """
+    metadata = get_metadata(full_url = full_url)
+    if 'updated' in metadata:
+        return metadata['updated']
+    return _search_updated(full_url)
+
+
+def _search_updated(full_url):
+    """
+    Returns when the table was last updated according to the search 
+    (or None if it is not found).
+    """
+    base_url, language, table_id = _cache_key(full_url)
+    if table_id is None:
+        return None
+    
+    try:
+        records = client.get(_search_url(table_id, language, base_url)).json()
+    except (requests.RequestException, ValueError):
+        return None
+    
+    for record in records:
+        if str(record.get('id')) == table_id:
+            return record.get('updated') or record.get('published')
+    return None
+
+
+#%%
+
+def search(phrase, 
+           language = 'en', 
+           base_url = None, 
+           catalog = None, 
+           source = None):
+    """
+        Search for tables that contain the phrase in Statistics Norway.
+        Returns a pandas dataframe with the results.
+            
+        Example
+        -------
+        
+            df = search("income")
+        
+        
+        Parameters
+        ----------
+        
+        phrase: string
+            The phrase can contain several words (space separated): 
+                search("export Norwegian parrot")
+            
+            It also supports trucation: 
+                search("pharma*")
+                
+            Not case sensitive.
+            Language sensitive (specified in the language option)
+            
+        language: string 
+            default in Statistics Norway: 'en' (Search for English words) 
+            optional in Statistics Norway: 'no' (Search for Norwegian words)
+                   
+        base_url: string
+            default: the base url of the source
+            
+        catalog: Catalog
+            search in a local catalog instead of on the server (no network).
+            Default: the module search_catalog (None: search on the server)
+            
+        source: string
+            the name of the source to search in (default: default_source)
+       
+        """
+    
+    if catalog is None:
+        catalog = search_catalog
+    if catalog is not None:
+        return catalog.search(phrase, language = language)
+    
+    search_str = _search_url(phrase, language, _base_url(base_url, source))
+    return _search_results(client.get(search_str).json())
+
+
+def _search_url(phrase, language, base_url):
+    """
+    Returns the url that searches for the phrase.
+    """
+    # todo: make converter part of the default specification only for statistics norway
+    convert = {'æ' : '%C3%A6', 'Æ' : '%C3%86', 'ø' : '%C3%B8', 'Ø' : '%C3%98', 
+             'å' : '%C3%A5', 'Å' : '%C3%85',
+             '"' : '%22', '(' : '%28', ')' : '%29', ' ' : '%20'}
+
+    search_str = '{url}?query={phrase}'.format(
+        url = _api_url(base_url, language), 
+        phrase = phrase)
+    
+    for k, v in convert.items():
+        search_str = search_str.replace(k, v)
+    
+    return search_str
+
+
+def _search_results(records):
+    """
+    Returns a (more readable) dataframe of the search results.
+    """
+    df = pd.DataFrame(records)
+    
+    if len(df) == 0:
+        print("No match")
+        return df
+    
+    # make the dataframe more readable
+    # (is it worth it? increases vulnerability. formats may differ and change)
+    # todo: make search and format conditional on the database being searched    
+       
+    # split the table name into table id and table text
+  
+    df['table_id'] = df['title'].str.split(':').str.get(0)
+    df['table_title'] = df['title'].str.split(':').str.get(1)
+    del df['title']
+    
+    # make table_id the index, visually more intuitive with id as first column
+    df = df.set_index('table_id')
+    
+    # change order of columns to make it more intuitive (table_title is first) 
+    cols = df.columns.tolist()
+    cols.sort(reverse = True)
+    df = df[cols[:-2]]
+
+    return df
+
+
+#%% 
+
+def get_variables(
+        table_id = None,
+        source = None, 
+        language = 'en',
+        base_url = None,
+        full_url = None):
+    """
+        Returns a list. 
+        
+        Each element of the list is a dictionary that provides more 
+        information about a variable. 
+        
+        For instance, one variable may contain information about the
+        different years that are available.
+        
+        
+        Parameters
+        ----------
+    
+            table_id: string
+                the unique table_id number, a string including leading zeros.
+                                
+            language: string
+                default 'en' (default, English) 
+                optional: 'no' (Norwegian)
+            
+            base_url: string
+                base url locating the table (not including table identifier)
+                default: the base url of the source
+            
+            full_url: string 
+                The full url to the table.
+                If full_url is specified, other paramaters are ignored.
+                
+            source: string
+                the name of a source in sources (default: default_source)
+                
+    """
+    
+    metadata = get_metadata(table_id = table_id, 
+                            language = language, 
+                            base_url = base_url, 
+                            full_url = full_url, 
+                            source = source)
+    
+    # copies, so that changes made by the user do not end up in the cache
+    variables = [dict(values) for values in metadata['variables']]
+    
+    return variables
+
+
+#%% Query builder
+
+class Query(object):
+    """
+    A json-stat query for a table, built as a dictionary.
+    
+    Besides lists of values ('item'), the query can use the filters of 
+    the PxWeb api that are resolved on the server: all values matching a 
+    pattern ('all'), the latest n values ('top') and aggregations ('agg'). 
+    A query for everything in a table is then a few hundred bytes, 
+    instead of a list of every value.
+    
+    The query can be used wherever a json query (dict) is used.
+    
+    Example
+    -------
+    
+        query = (Query()
+                 .item('Region', ['0', '01'])
+                 .all('ContentsCode')
+                 .top('Tid', 5))
+        
+        df = read_with_json(table_id = '10714', query = query)
+        
+        query.to_dict()
+        query.to_json()
+    
+    
+    Parameters
+    ----------
+    
+        response_format: string
+            the format of the response, default 'json-stat' 
+            (see FORMATS: 'json-stat2', 'csv' or 'auto' give the same dataframe)
+    """
+    
+    def __init__(self, response_format = 'json-stat'):
+        self.response_format = response_format
+        self.selections = OrderedDict()
+    
+    def select(self, code, filter, values):
+        """
+        Selects values of the variable code with a filter 
+        ('item', 'all', 'top', 'agg:<aggregation>' or 'vs:<value set>').
+        A variable can only be selected once, the last selection is used.
+        """
+        self.selections[code] = {'filter' : filter, 'values' : [str(value) for value in values]}
+        return self
+    
+    def item(self, code, values):
+        """
+        Selects a list of values (codes) of the variable.
+        """
+        if isinstance(values, str):
+            values = [values]
+        return self.select(code, 'item', values)
+    
+    def all(self, code, pattern = '*'):
+        """
+        Selects all values of the variable, or the values matching a 
+        pattern (* is a wildcard, for instance '01*').
+        """
+        return self.select(code, 'all', [pattern])
+    
+    def top(self, code, n):
+        """
+        Selects the latest n values of the variable (usually time).
+        """
+        return self.select(code, 'top', [n])
+    
+    def agg(self, code, aggregation, values):
+        """
+        Selects groups of values made by an aggregation on the server, 
+        for instance agg('Region', 'Fylker', ['01', '02']).
+        """
+        return self.select(code, 'agg:' + aggregation, values)
+    
+    def to_dict(self):
+        """
+        Returns the query as a dictionary.
+        """
+        return {'query' : [{'code' : code, 'selection' : dict(selection)} 
+                           for code, selection in self.selections.items()], 
+                'response' : {'format' : self.response_format}}
+    
+    def to_json(self, **kwargs):
+        """
+        Returns the query as a json string (kwargs are passed to json.dumps).
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+    
+    @classmethod
+    def from_dict(cls, query):
+        """
+        Returns a Query made from a json query (dict).
+        """
+        new = cls(response_format = query.get('response', {}).get('format', 'json-stat'))
+        for element in query['query']:
+            selection = element['selection']
+            new.select(element['code'], selection['filter'], selection['values'])
+        return new
+    
+    def __repr__(self):
+        return 'Query({query})'.format(query = self.to_json())
+
+
+def _query_dict(query):
+    """
+    Returns a query as a dictionary (a Query, a dict or a json string, 
+    see to_dict).
+    """
+    if isinstance(query, Query):
+        with _Phase('query'):
+            return query.to_dict()
+    if isinstance(query, str):
+        with _Phase('query'):
+            return to_dict(query)
+    return query
+
+
+#%%
+
+def to_dict(json_str):
+    """
+        Transforms a string to a dictionary.
+        
+        Note: Will fail if string is not correctly specified.
+    """
+    # OK, really unnecessary func, but a concession to less experienced users
+    try:
+        query = json.loads(json_str)
+    except ValueError:
+        # python style (single quotes), for instance str(query)
+        query = ast.literal_eval(json_str)
+    return query
+    
+
+#%% json-stat decoding
+
+# the engine used to make dataframes from json-stat
+# 'native': the (fast) decoder below, 'pyjstat': pyjstat.from_json_stat
+# 'stream': decode the response while it is downloaded (low peak memory)
+ENGINES = ('native', 'pyjstat', 'stream')
+
+# 'pandas': a pandas dataframe, 'arrow': a pyarrow Table (see to_arrow)
+OUTPUTS = ('pandas', 'arrow')
+
+
+def _read_json_stat(content, 
+                    engine = 'native', 
+                    categorical = False, 
+                    value_dtype = None, 
+                    output = 'pandas'):
+    """
+    Returns a pandas dataframe (or a pyarrow Table, see OUTPUTS) from the 
+    raw json-stat content of a response.
+    """
+    if output == 'arrow':
+        if engine != 'native':
+            return _arrow_from_frame(_read_json_stat(content, engine, True, value_dtype), 
+                                     value_dtype)
+        with _Phase('parse', engine = engine, response_bytes = len(content)):
+            data = json.loads(content)
+        with _Phase('convert', engine = engine, output = output) as phase:
+            table = to_arrow(data, value_dtype = value_dtype)
+            phase.set(cells = len(table))
+        return table
+    if output != 'pandas':
+        raise ValueError('Unknown output: {output}, use one of {outputs}'.format(
+            output = output, outputs = OUTPUTS))
+    
+    if engine == 'native':
+        with _Phase('parse', engine = engine, response_bytes = len(content)):
+            data = json.loads(content)
+        with _Phase('convert', engine = engine) as phase:
+            df = from_json_stat(data, 
+                                categorical = categorical, 
+                                value_dtype = value_dtype)
+            phase.set(cells = len(df))
+        return df
+    
+    if engine == 'stream':
+        chunks = (content[start:start + CHUNK_SIZE] 
+                  for start in range(0, len(content), CHUNK_SIZE))
+        with _Phase('decode', engine = engine, response_bytes = len(content)) as phase:
+            df = stream_json_stat(chunks, 
+                                  categorical = categorical, 
+                                  value_dtype = value_dtype)
+            phase.set(cells = len(df))
+        return df
+    
+    if engine == 'pyjstat':
+        # todo: consider using jsonstat instead of pyjstat
+        from pyjstat import pyjstat
+        
+        with _Phase('parse', engine = engine, response_bytes = len(content)):
+            data = json.loads(content, object_pairs_hook = OrderedDict)
+        with _Phase('convert', engine = engine) as phase:
+            df = pyjstat.from_json_stat(data)[0]
+            phase.set(cells = len(df))
+        
+        if categorical:
+            for i, (dim, label, codes, texts) in enumerate(_dimensions(_dataset(data))):
+                categories = list(OrderedDict.fromkeys(texts))
+                df.isetitem(i, pd.Categorical(df.iloc[:, i], categories = categories))
+        if value_dtype is not None:
+            df.isetitem(len(df.columns) - 1, df.iloc[:, -1].astype(value_dtype))
+        return df
+    
+    raise ValueError('Unknown engine: {engine}, use one of {engines}'.format(
+        engine = engine, engines = ENGINES))
+
+
+def _read_response(response, 
+                   engine = 'native', 
+                   categorical = False, 
+                   value_dtype = None, 
+                   output = 'pandas'):
+    """
+    Returns a pandas dataframe (or a pyarrow Table) from a json-stat response 
+    (the response must be requested with stream = True for engine = 'stream').
+    """
+    if engine == 'stream':
+        # the download is part of this phase, the size is the one sent 
+        # (the response is closed afterwards, which releases the scheduler)
+        with response, _Phase('decode', engine = engine, 
+                              response_bytes = _content_length(response.headers)) as phase:
+            df = stream_json_stat(response.iter_content(chunk_size = CHUNK_SIZE), 
+                                  categorical = categorical or output == 'arrow', 
+                                  value_dtype = value_dtype)
+            phase.set(cells = len(df))
+        if output == 'arrow':
+            return _arrow_from_frame(df, value_dtype)
+        return df
+    return _read_json_stat(response.content, engine, categorical, value_dtype, output)
+
+
+def _dataset(data):
+    """
+    Returns the (first) dataset in json-stat data, 
+    both for version 1 (a bundle of datasets) and version 2.
+    """
+    if data.get('class') == 'dataset':
+        return data
+    return next(iter(data.values()))
+
+
+def _dimensions(dataset):
+    """
+    Returns a list with the id, the label, the category ids and the category 
+    labels of each dimension, in the order used by the value array.
+    """
+    if float(dataset.get('version', 1)) >= 2 and 'id' in dataset:
+        ids = dataset['id']
+    else:
+        ids = dataset['dimension']['id']
+    
+    dimensions = []
+    for dim in ids:
+        info = dataset['dimension'][dim]
+        category = info.get('category', {})
+        index = category.get('index')
+        labels = category.get('label')
+        
+        if index is None:
+            # only one category
+            codes = [next(iter(labels))]
+        elif isinstance(index, list):
+            codes = list(index)
+        else:
+            codes = sorted(index, key = index.get)
+        
+        if labels is None:
+            texts = codes
+        else:
+            texts = [labels.get(code, code) for code in codes]
+        
+        dimensions.append((dim, info.get('label') or dim, codes, texts))
+    return dimensions
+
+
+def _positions(sizes, dtype = None):
+    """
+    Returns, for each dimension, an array with the position of the 
+    category of each cell (the value array is in row-major order, 
+    the last dimension changes fastest). The arrays have the given dtype, 
+    or the smallest unsigned one for the dimension.
+    """
+    positions = []
+    for i, size in enumerate(sizes):
+        kind = dtype or np.min_scalar_type(max(size - 1, 0))
+        inner = np.repeat(np.arange(size, dtype = kind), _product(sizes[i + 1:]))
+        positions.append(np.tile(inner, _product(sizes[:i])))
+    return positions
+
+
+def _values(dataset, ncells):
+    """
+    Returns the values of a dataset as an array with the dtype pandas would 
+    infer for them.
+    """
+    values = dataset['value']
+    if isinstance(values, dict):
+        # sparse values, {position: value}
+        full = [None] * ncells
+        for position, value in values.items():
+            full[int(position)] = value
+        values = full
+    
+    array = np.array(values)
+    if array.dtype.kind in 'biuf':
+        return array
+    
+    # missing values or text, let pandas decide
+    return pd.Series(values).values
+
+
+def _categorical(texts, positions):
+    """
+    Returns a pandas Categorical with the texts as categories.
+    """
+    categories = list(OrderedDict.fromkeys(texts))
+    if len(categories) < len(texts):
+        # the same label is used for several categories
+        lookup = dict((text, n) for n, text in enumerate(categories))
+        positions = np.array([lookup[text] for text in texts])[positions]
+    return pd.Categorical.from_codes(positions, categories = categories)
+
+
+def from_json_stat(data, 
+                   naming = 'label', 
+                   value = 'value', 
+                   categorical = False, 
+                   value_dtype = None):
+    """
+    Returns a pandas dataframe from json-stat data (already decoded from 
+    json to a dict). Version 1 and version 2 of json-stat are supported.
+    
+    Gives the same dataframe as pyjstat.from_json_stat(data)[0], but the 
+    dimension columns are made with numpy (repeat/tile) instead of a 
+    python loop over every cell, which is much faster for large tables.
+    
+    With categorical = True and a smaller value_dtype, the dataframe 
+    uses much less memory (the text of a category is stored once, 
+    not once for every row).
+    
+    
+    Parameters
+    ----------
+    
+        data: dict
+            json-stat data, for instance requests.get(url).json()
+        
+        naming: string
+            'label' (default): use labels for columns and categories
+            'id': use the ids
+            
+        value: string
+            the name of the value column
+            
+        categorical: bool
+            True: the dimension columns are pandas Categoricals, with the 
+            categories in the same order as in the table
+            
+        value_dtype: string or dtype
+            the dtype of the value column, for instance 'float32' or 
+            'Int32' (integers with missing values)
+            default: None (float64 or int64, as pyjstat)
+    """
+    dataset = _dataset(data)
+    return _frame(dataset, None, naming, value, categorical, value_dtype)
+
+
+def _frame(dataset, 
+           values = None, 
+           naming = 'label', 
+           value = 'value', 
+           categorical = False, 
+           value_dtype = None):
+    """
+    Returns the dataframe of a json-stat dataset. 
+    
+    values: an array with the values (if they are not in the dataset)
+    """
+    dimensions = _dimensions(dataset)
+    sizes = [len(codes) for dim, label, codes, texts in dimensions]
+    ncells = _product(sizes)
+    
+    columns = OrderedDict()
+    names = []
+    for (dim, label, codes, texts), positions in zip(dimensions, _positions(sizes)):
+        if naming == 'id':
+            name, texts = dim, codes
+        else:
+            name = label
+        if categorical:
+            columns[len(names)] = _categorical(texts, positions)
+        else:
+            categories = np.array(texts, dtype = object)
+            columns[len(names)] = categories[positions]
+        names.append(name)
+    
+    if values is None:
+        values = _values(dataset, ncells)
+    if value_dtype is not None:
+        values = pd.Series(values).astype(value_dtype).array
+    columns[len(names)] = values
+    
+    df = pd.DataFrame(columns)
+    df.columns = names + [value]
+    return df
+
+
+#%% Arrow output
+
+def to_arrow(data, 
+             naming = 'label', 
+             value = 'value', 
+             value_dtype = None):
+    """
+    Returns a pyarrow Table from json-stat data (already decoded from 
+    json to a dict), without making a pandas dataframe first. 
+    
+    The dimension columns are dictionary encoded (the text of a category 
+    is stored once, and each row has a small integer), and the value 
+    column is made directly from the json-stat values, with missing 
+    values as nulls. 
+    
+    All the read functions give the same schema with output = 'arrow', 
+    whatever the engine or response format: dictionary<int32, string> 
+    dimension columns and a float64 value column (or value_dtype), so 
+    the parts of a split query can be concatenated.
+    
+    Requires pyarrow. The table can be used by DuckDB and Polars without 
+    copying, and table.to_pandas() gives a dataframe with categorical 
+    dimension columns.
+    
+    
+    Parameters
+    ----------
+    
+        data: dict
+            json-stat data, for instance requests.get(url).json()
+        
+        naming: string
+            'label' (default): use labels for columns and categories
+            'id': use the ids
+            
+        value: string
+            the name of the value column
+            
+        value_dtype: string or pyarrow DataType
+            the type of the value column, for instance 'float32'
+            default: None (float64)
+    """
+    return _arrow_table(_dataset(data), None, naming, value, value_dtype)
+
+
+def _arrow_table(dataset, 
+                 values = None, 
+                 naming = 'label', 
+                 value = 'value', 
+                 value_dtype = None):
+    """
+    Returns the pyarrow Table of a json-stat dataset (see _frame).
+    """
+    import pyarrow as pa
+    
+    dimensions = _dimensions(dataset)
+    sizes = [len(codes) for dim, label, codes, texts in dimensions]
+    ncells = _product(sizes)
+    
+    columns = []
+    names = []
+    for (dim, label, codes, texts), positions in zip(dimensions, _positions(sizes, np.int32)):
+        if naming == 'id':
+            name, texts = dim, codes
+        else:
+            name = label
+        categories = list(OrderedDict.fromkeys(texts))
+        if len(categories) < len(texts):
+            # the same label is used for several categories
+            lookup = dict((text, n) for n, text in enumerate(categories))
+            positions = np.array([lookup[text] for text in texts], 
+                                 dtype = positions.dtype)[positions]
+        columns.append(pa.DictionaryArray.from_arrays(
+            positions, pa.array(categories, type = pa.string())))
+        names.append(name)
+    
+    if values is None:
+        values = dataset['value']
+        if isinstance(values, dict):
+            # sparse values, {position: value}
+            full = [None] * ncells
+            for position, number in values.items():
+                full[int(position)] = number
+            values = full
+    
+    columns.append(pa.array(values, type = _arrow_type(value_dtype or 'float64')))
+    
+    return pa.Table.from_arrays(columns, names = names + [value])
+
+
+def _arrow_type(dtype):
+    """
+    Returns the pyarrow type of a dtype ('float32', numpy dtype or pyarrow type).
+    """
+    import pyarrow as pa
+    
+    if isinstance(dtype, pa.DataType):
+        return dtype
+    if isinstance(dtype, str):
+        try:
+            return pa.type_for_alias(dtype.lower())
+        except ValueError:
+            pass
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+def _arrow_from_frame(df, value_dtype = None):
+    """
+    Returns a pyarrow Table of a dataframe from the other decoders, with 
+    the schema of to_arrow (the dimension columns are dictionary encoded).
+    """
+    import pyarrow as pa
+    
+    for i in range(len(df.columns) - 1):
+        if not isinstance(df.iloc[:, i].dtype, pd.CategoricalDtype):
+            df.isetitem(i, df.iloc[:, i].astype('category'))
+    table = pa.Table.from_pandas(df, preserve_index = False).replace_schema_metadata(None)
+    
+    # the same types as to_arrow gives (pandas may give other index types, 
+    # large strings and integer values)
+    names = table.schema.names
+    fields = [pa.field(name, pa.dictionary(pa.int32(), pa.string())) for name in names[:-1]]
+    fields.append(pa.field(names[-1], _arrow_type(value_dtype or 'float64')))
+    return table.cast(pa.schema(fields))
+
+
+#%% Streaming json-stat decoding
+
+# bytes read from a response at a time
+CHUNK_SIZE = 1 << 16
+
+_SPECIAL = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'(?:[^"\\]|\\.)*"')
+
+# keys in a json-stat version 2 dataset that may hold objects with a "value"
+_NOT_DATASET = ('dimension', 'extension', 'link', 'note', 'role', 'error')
+
+
+def _parse_numbers(text):
+    """
+    Returns an array with the numbers in a piece of the value array 
+    (a comma separated string, missing values are null).
+    """
+    if not text.strip():
+        return np.empty(0)
+    
+    numbers = np.fromstring(text.replace('null', 'nan'), sep = ',')
+    if len(numbers) != text.count(',') + 1:
+        raise ValueError('Unable to stream the values (not numbers), '
+                         'use another engine')
+    return numbers
+
+
+def stream_json_stat(chunks, 
+                     naming = 'label', 
+                     value = 'value', 
+                     categorical = False, 
+                     value_dtype = None):
+    """
+    Returns a pandas dataframe from json-stat data that arrives in pieces 
+    (chunks of bytes), for instance response.iter_content().
+    
+    Unlike from_json_stat, the json is never decoded to one large 
+    dictionary. The metadata (dimensions) is read first, and the value 
+    array is parsed piece by piece straight into a numpy array (allocated 
+    once if the size of the table is known when the values start).
+    The peak memory is a small multiple of the size of the result.
+    
+    The number of bytes held by the decoder at its peak is stored in 
+    df.attrs['peak_memory'].
+    
+    Gives the same dataframe as from_json_stat, the other parameters 
+    are the same as in from_json_stat.
+    
+    Example
+    -------
+    
+        response = requests.get(url, stream = True)
+        df = stream_json_stat(response.iter_content(chunk_size = 65536))
+    """
+    decode = codecs.getincrementaldecoder('utf-8')().decode
+    chunks = iter(chunks)
+    
+    # 1. read until the value array of the dataset starts
+    head = ''
+    pos = 0
+    stack = []          # the keys of the open objects and arrays
+    key = None          # the last string read (a key if followed by :)
+    key_end = 0
+    start = None
+    
+    for chunk in chunks:
+        head += decode(chunk)
+        while start is None:
+            match = _SPECIAL.search(head, pos)
+            if match is None:
+                pos = len(head)
+                break
+            char, at = match.group(), match.start()
+            
+            if char == '"':
+                end = _STRING_END.match(head, at + 1)
+                if end is None:
+                    # the rest of the string is in the next chunk
+                    pos = at
+                    break
+                key, key_end, pos = head[at + 1:end.end() - 1], end.end(), end.end()
+            elif char in '{[':
+                is_key = key is not None and head[key_end:at].strip() == ':'
+                in_dataset = len(stack) == 1 or (len(stack) == 2 and 
+                                                 stack[1] not in _NOT_DATASET)
+                if char == '[' and is_key and key == 'value' and in_dataset:
+                    start = at
+                else:
+                    stack.append(key if is_key else None)
+                    key, pos = None, at + 1
+            else:
+                stack.pop()
+                key, pos = None, at + 1
+        if start is not None:
+            break
+    
+    if start is None:
+        # no value array (eg. sparse values), decode it all at once
+        head += decode(b'', True)
+        df = _frame(_dataset(json.loads(head)), None, naming, value, 
+                    categorical, value_dtype)
+        df.attrs['peak_memory'] = 2 * len(head)
+        return df
+    
+    text = head[start + 1:]
+    head = head[:start]
+    
+    # allocate the values if the size of the table is already known
+    try:
+        dataset = _dataset(json.loads(head + '[]' + '}' * len(stack)))
+        sizes = dataset['size'] if 'size' in dataset else dataset['dimension']['size']
+        values = np.empty(_product(sizes))
+    except (ValueError, KeyError, TypeError, StopIteration):
+        values = None
+    parts = []
+    
+    filled = 0
+    nulls = False
+    decimals = False
+    peak = 0
+    
+    # 2. parse the value array piece by piece
+    while True:
+        end = text.find(']')
+        cut = end if end >= 0 else text.rfind(',')
+        
+        if cut >= 0:
+            piece = text[:cut]
+            numbers = _parse_numbers(piece)
+            nulls = nulls or 'null' in piece
+            decimals = decimals or '.' in piece or 'e' in piece or 'E' in piece
+            
+            if values is not None:
+                if filled + len(numbers) > len(values):
+                    raise ValueError('More values than cells in the json-stat response')
+                values[filled:filled + len(numbers)] = numbers
+            else:
+                parts.append(numbers)
+            filled += len(numbers)
+            
+            held = values.nbytes if values is not None else 8 * filled
+            peak = max(peak, len(head) + len(text) + held)
+            text = text[cut + 1:]
+        
+        if end >= 0:
+            break
+        
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError('The json-stat response ended in the value array')
+        text += decode(chunk)
+    
+    # 3. the rest of the dataset after the values
+    tail = text + ''.join(decode(chunk) for chunk in chunks) + decode(b'', True)
+    dataset = _dataset(json.loads(head + '[]' + tail))
+    
+    if values is None:
+        values = np.concatenate(parts) if parts else np.empty(0)
+    elif filled != len(values):
+        raise ValueError('Fewer values than cells in the json-stat response')
+    
+    # same dtype as pandas would infer from the json values
+    if nulls and len(values) and np.isnan(values).all():
+        values = pd.Series([None] * len(values)).values
+    elif not nulls and not decimals:
+        values = values.astype(np.int64)
+    
+    df = _frame(dataset, values, naming, value, categorical, value_dtype)
+    df.attrs['peak_memory'] = peak
+    return df
+
+
+#%% Response formats
+
+# the formats a query can ask the server for ('auto' picks json-stat or csv)
+FORMATS = ('json-stat', 'json-stat2', 'csv', 'auto')
+
+# in the 'auto' format, queries with at least this many cells are read as 
+# csv (the csv decoder is multithreaded, but it needs the metadata)
+AUTO_CSV_CELLS = 100000
+
+# the filters a csv response can be decoded for (the others, agg: and vs:, 
+# give groups that are not in the metadata)
+CSV_FILTERS = ('item', 'all', 'top')
+
+# the texts used for missing values in csv responses
+MISSING = ['', '.', '..', '...', '....', ':', '-']
+
+
+def _query_format(query):
+    return query.get('response', {}).get('format', 'json-stat')
+
+
+def _with_format(query, response_format):
+    """
+    Returns a copy of the query that asks for the response format.
+    """
+    if response_format not in FORMATS:
+        raise ValueError('Unknown response format: {name}, use one of {formats}'.format(
+            name = response_format, formats = FORMATS))
+    if _query_format(query) == response_format:
+        return query
+    query = OrderedDict(query)
+    query['response'] = {'format' : response_format}
+    return query
+
+
+def _auto_format(query, variables = None):
+    """
+    Returns the format to ask the server for: the format of the query, 
+    or for 'auto' the fastest format that gives the same dataframe 
+    (None if the metadata (variables) is needed to decide).
+    """
+    response_format = _query_format(query)
+    if response_format != 'auto':
+        return response_format
+    
+    filters = set(element['selection']['filter'] for element in query['query'])
+    if not _has_pyarrow() or not filters <= set(CSV_FILTERS):
+        return 'json-stat'
+    
+    cells = _count_cells(query, variables)
+    if cells is None:
+        return None
+    if cells >= AUTO_CSV_CELLS:
+        return 'csv'
+    return 'json-stat'
+
+
+def _check_csv(query):
+    """
+    Raises a ValueError if a csv response to the query cannot be decoded.
+    """
+    for element in query['query']:
+        if element['selection']['filter'] not in CSV_FILTERS:
+            raise ValueError('The csv format only supports item, all and top '
+                             'selections, not {filter} ({code}), use json-stat'.format(
+                                 filter = element['selection']['filter'], 
+                                 code = element['code']))
+
+
+def _csv_dataset(query, variables):
+    """
+    Returns a json-stat (version 2) dataset without values, with the 
+    dimensions the server uses for its response to the query.
+    """
+    _check_csv(query)
+    selections = dict((element['code'], element['selection']) for element in query['query'])
+    
+    dataset = OrderedDict([('version', '2.0'), ('class', 'dataset'), 
+                           ('id', []), ('size', []), ('dimension', OrderedDict())])
+    
+    # the variables that are not in the query are eliminated, 
+    # the others are in the order of the table
+    for var in variables:
+        if var['code'] not in selections:
+            continue
+        codes = _selected_codes(selections[var['code']], var['values'])
+        texts = dict(zip(var['values'], var.get('valueTexts', var['values'])))
+        dataset['id'].append(var['code'])
+        dataset['size'].append(len(codes))
+        dataset['dimension'][var['code']] = {
+                'label' : var['text'], 
+                'category' : {'index' : codes, 
+                              'label' : dict((code, texts.get(code, code)) for code in codes)}}
+    return dataset
+
+
+def _csv_layout(header, sizes, labels):
+    """
+    Returns the number of label columns (the variables in the rows) of 
+    a csv response. The other variables make up the columns: one column 
+    for each combination of their values.
+    """
+    layouts = [k for k in range(len(sizes) + 1) 
+               if k + _product(sizes[k:]) == len(header)]
+    if not layouts:
+        raise ValueError('The csv response does not have the variables of '
+                         'the query, use json-stat')
+    
+    # several layouts are possible if variables have only one or two values 
+    # selected, use the one with the labels of the variables as names
+    for k in reversed(layouts):
+        names = [name.strip().lower() for name in header[:k]]
+        if names == [label.lower() for label in labels[:k]]:
+            return k
+    return layouts[-1]
+
+
+def _read_csv(content, query, variables, categorical = False, value_dtype = None, 
+              output = 'pandas'):
+    """
+    _decode_csv, measured as the decode phase (see add_hook).
+    """
+    with _Phase('decode', format = 'csv', response_bytes = len(content)) as phase:
+        df = _decode_csv(content, query, variables, 
+                         categorical or output == 'arrow', value_dtype)
+        phase.set(cells = len(df))
+    if output == 'arrow':
+        return _arrow_from_frame(df, value_dtype)
+    return df
+
+
+def _decode_csv(content, query, variables, categorical = False, value_dtype = None):
+    """
+    Returns a pandas dataframe from a csv response to the query, the same 
+    as the json-stat response gives.
+    
+    Only the numbers are parsed (with pyarrow, in several threads, if it is 
+    installed). The dimensions come from the metadata (variables) and the 
+    rows of the csv are in the same order as the values in json-stat.
+    """
+    dataset = _csv_dataset(query, variables)
+    sizes = dataset['size']
+    ncells = _product(sizes)
+    
+    end = content.find(b'\n')
+    first_line = content[:end if end >= 0 else len(content)].decode('utf-8', 'replace')
+    first_line = first_line.lstrip('\ufeff').rstrip('\r')
+    
+    # the separator is the most common character between the names
+    unquoted = re.sub(r'"[^"]*"', '', first_line)
+    sep = max([',', ';', '\t'], key = unquoted.count)
+    header = next(csv.reader([first_line], delimiter = sep))
+    
+    labels = [dataset['dimension'][dim]['label'] for dim in dataset['id']]
+    nlabels = _csv_layout(header, sizes, labels)
+    ncolumns = len(header)
+    
+    # a decimal comma, if the numbers are not separated by commas
+    decimal = '.'
+    if sep != ',' and re.search(rb'\d,\d', content[end:end + CHUNK_SIZE]):
+        decimal = ','
+    
+    if _has_pyarrow():
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+        
+        names = ['column{n}'.format(n = n) for n in range(ncolumns)]
+        numbers = names[nlabels:]
+        table = pa_csv.read_csv(
+            pa.py_buffer(content), 
+            read_options = pa_csv.ReadOptions(column_names = names, skip_rows = 1), 
+            parse_options = pa_csv.ParseOptions(delimiter = sep), 
+            convert_options = pa_csv.ConvertOptions(
+                include_columns = numbers, 
+                column_types = dict((name, pa.float64()) for name in numbers), 
+                null_values = MISSING, 
+                decimal_point = decimal))
+        block = np.column_stack([table.column(name).to_numpy() for name in numbers])
+    else:
+        block = pd.read_csv(io.BytesIO(content), 
+                            sep = sep, 
+                            header = None, 
+                            skiprows = 1, 
+                            usecols = range(nlabels, ncolumns), 
+                            dtype = np.float64, 
+                            na_values = MISSING, 
+                            keep_default_na = False, 
+                            decimal = decimal, 
+                            encoding = 'latin-1').values
+    
+    # row by row, the last variable changes fastest (as in json-stat)
+    values = np.ascontiguousarray(block).reshape(-1)
+    if len(values) != ncells:
+        raise ValueError('The csv response has {n} values, expected {cells}'.format(
+            n = len(values), cells = ncells))
+    
+    # same dtype as pandas would infer from the json-stat values
+    missing = np.isnan(values)
+    if len(values) and missing.all():
+        values = pd.Series([None] * len(values)).values
+    elif not missing.any() and np.array_equal(values, np.trunc(values)):
+        values = values.astype(np.int64)
+    
+    return _frame(dataset, values, categorical = categorical, value_dtype = value_dtype)
+
+
+#%% Query splitting
+
+def _product(numbers):
+    return reduce(operator.mul, numbers, 1)
+
+
+def _selected_codes(selection, codes = None):
+    """
+    Returns the list of value codes a selection picks from a variable 
+    (in the order of the table), or None if the selection cannot be 
+    resolved to a list of codes.
+    
+    codes is the list of all the values of the variable (from the metadata).
+    Without it, only 'item' selections and aggregations can be resolved.
+    """
+    filt = selection['filter']
+    values = selection['values']
+    
+    if filt == 'item':
+        if codes is None:
+            return list(OrderedDict.fromkeys(values))
+        wanted = set(values)
+        ordered = [code for code in codes if code in wanted]
+        # keep codes that are unknown to the metadata (the server decides)
+        return ordered + [code for code in values if code not in set(ordered)]
+    
+    if filt.startswith('agg') or filt.startswith('vs'):
+        return list(values)
+    
+    if codes is None:
+        return None
+    
+    if filt == 'all':
+        return [code for code in codes 
+                if any(fnmatch.fnmatchcase(code, pattern) for pattern in values)]
+    
+    if filt == 'top':
+        n = int(values[0])
+        return list(codes[-n:]) if n > 0 else []
+    
+    return None
+
+
+def _count_cells(query, variables = None):
+    """
+    Returns the number of cells a query will return, or None if the 
+    number cannot be found without the metadata (variables).
+    """
+    if variables is not None:
+        codes = dict((var['code'], var['values']) for var in variables)
+    else:
+        codes = {}
+    
+    counts = []
+    for element in query['query']:
+        selected = _selected_codes(element['selection'], codes.get(element['code']))
+        if selected is None:
+            return None
+        counts.append(len(selected))
+    return _product(counts)
+
+
+def _split_query(query, variables, max_cells):
+    """
+    Splits a query into a list of smaller queries that each return 
+    at most max_cells cells.
+    
+    The variables are split in the order of the table, so the results of 
+    the smaller queries, concatenated in order, are identical to the result
+    of the original query.
+    """
+    position = dict((var['code'], n) for n, var in enumerate(variables))
+    codes = dict((var['code'], var['values']) for var in variables)
+    
+    elements = sorted(query['query'], 
+                      key = lambda element: position.get(element['code'], len(position)))
+    selected = [_selected_codes(element['selection'], codes.get(element['code'])) 
+                for element in elements]
+    
+    if None in selected:
+        raise ValueError('Unable to split the query, unknown filter: {filters}'.format(
+            filters = [element['selection']['filter'] for element in elements]))
+        
+    counts = [len(values) for values in selected]
+    
+    def parts(i):
+        # split variable i in chunks if that is enough, 
+        # otherwise take one value at a time and split the next variable
+        rest = _product(counts[i + 1:])
+        if i == len(counts) or counts[i] * rest <= max_cells:
+            yield {}
+        elif rest <= max_cells:
+            step = max_cells // rest
+            for start in range(0, counts[i], step):
+                yield {i : selected[i][start:start + step]}
+        else:
+            for value in selected[i]:
+                for part in parts(i + 1):
+                    part[i] = [value]
+                    yield part
+    
+    queries = []
+    for part in parts(0):
+        sub_query = OrderedDict(query)
+        sub_query['query'] = []
+        for i, element in enumerate(elements):
+            if i in part:
+                filt = element['selection']['filter']
+                if filt in ('all', 'top'):
+                    filt = 'item'
+                selection = OrderedDict(element['selection'])
+                selection['filter'] = filt
+                selection['values'] = part[i]
+                element = OrderedDict(element)
+                element['selection'] = selection
+            sub_query['query'].append(element)
+        queries.append(sub_query)
+    return queries
+
+
+def _sub_queries(query, max_cells = None, variables = None):
+    """
+    Returns the list of queries to post to get the result of query 
+    (the query itself, or smaller parts of it if it exceeds max_cells).
+    
+    Returns None if the metadata (variables) is needed to decide.
+    """
+    if max_cells is None:
+        max_cells = MAX_CELLS
+    
+    with _Phase('query') as phase:
+        cells = _count_cells(query, variables)
+        if cells is not None and cells <= max_cells:
+            queries = [query]
+        elif variables is None:
+            return None
+        elif cells is None:
+            # unknown filters, leave it to the server
+            queries = [query]
+        else:
+            queries = _split_query(query, variables, max_cells)
+        phase.set(cells = cells, requests = len(queries))
+    return queries
+
+
+def _concat(frames):
+    """
+    Concatenates the results of the parts of a split query.
+    """
+    if len(frames) == 1:
+        return frames[0]
+    
+    if not isinstance(frames[0], pd.DataFrame):
+        # pyarrow Tables, the parts may have other dictionaries and types
+        import pyarrow as pa
+        return pa.concat_tables(frames, promote_options = 'permissive').unify_dictionaries()
+    
+    df = pd.concat(frames, ignore_index = True)
+    
+    # the parts have different categories, combine them (in table order)
+    for i, column in enumerate(frames[0].columns):
+        if isinstance(frames[0].iloc[:, i].dtype, pd.CategoricalDtype):
+            df.isetitem(i, pd.api.types.union_categoricals(
+                [frame.iloc[:, i] for frame in frames]))
+    
+    # a part may get another dtype than the whole table would (eg. object 
+    # if all its values are missing), so the dtype is inferred again
+    if len(set(frame.iloc[:, -1].dtype for frame in frames)) > 1:
+        df[df.columns[-1]] = pd.Series(df.iloc[:, -1].tolist())
+    
+    if 'peak_memory' in frames[0].attrs:
+        df.attrs['peak_memory'] = max(frame.attrs['peak_memory'] for frame in frames)
+    return df
+
+
+def _post_query(full_url, query, max_cells = None, cache = None, **options):
+    """
+    Posts a json-stat query and returns the result as a pandas dataframe.
+    
+    Queries that are larger than max_cells are split into several 
+    smaller queries and the results are concatenated.
+    
+    The response format is options['response_format'] (if given) or the 
+    format in the query, see FORMATS.
+    
+    If the result is in the cache, and the table has not been updated 
+    since it was stored, the stored result is used.
+    """
+    response_format = options.pop('response_format', None)
+    if response_format is not None:
+        query = _with_format(query, response_format)
+    
+    cache = _result_cache(cache)
+    if cache is not None:
+        key = cache.key(full_url, query, _cache_options(options))
+        with _Phase('result_cache', url = full_url) as phase:
+            info = cache.info(key)
+            hit = info is not None and cache.fresh(info)
+            updated = None
+            if not hit:
+                updated = _table_updated(full_url)
+                hit = info is not None and updated is not None and info['updated'] == updated
+                if hit:
+                    # checked now, so it is fresh for max_age seconds again
+                    cache.touch(key, info)
+            phase.set(cache_hit = hit)
+        if hit:
+            return cache.load(key, info)
+        
+        df = _post_query(full_url, query, max_cells, cache = False, **options)
+        cache.store(key, df, url = full_url, updated = updated)
+        return df
+    
+    if max_cells is None:
+        max_cells = _max_cells(full_url)
+    
+    # only download the metadata if the size cannot be found from the 
+    # query (or it is needed to read csv)
+    response_format = _auto_format(query)
+    variables = None
+    queries = _sub_queries(query, max_cells)
+    if queries is None or response_format in (None, 'csv'):
+        variables = get_variables(full_url = full_url)
+        queries = _sub_queries(query, max_cells, variables)
+    if response_format is None:
+        response_format = _auto_format(query, variables)
+    
+    with _Phase('read', url = full_url, format = response_format, 
+                requests = len(queries)) as phase:
+        df = _concat(list(_read_parts(full_url, queries, response_format, 
+                                      variables, **options)))
+        phase.set(cells = len(df))
+    return df
+
+
+def _read_parts(full_url, queries, response_format, variables = None, **options):
+    """
+    Posts the queries one at a time and yields the result of each 
+    as a pandas dataframe (variables are needed for csv).
+    """
+    stream = response_format != 'csv' and options.get('engine') == 'stream'
+    if response_format == 'csv':
+        # before anything is downloaded
+        for sub_query in queries:
+            _check_csv(sub_query)
+    
+    for sub_query in queries:
+        sub_query = _with_format(sub_query, response_format)
+        data = client.post(full_url, json = sub_query, stream = stream)
+        if response_format == 'csv':
+            yield _read_csv(data.content, sub_query, variables, 
+                            categorical = options.get('categorical', False), 
+                            value_dtype = options.get('value_dtype'), 
+                            output = options.get('output', 'pandas'))
+        else:
+            yield _read_response(data, **options)
+
+
+#%% Writing to parquet
+
+def _partitions(query, variables, partition_by = None):
+    """
+    Returns a list of (value, query) pairs: one query for each value of 
+    the variable with the code partition_by (all of query if None).
+    """
+    if partition_by is None:
+        return [(None, query)]
+    
+    codes = dict((var['code'], var['values']) for var in variables)
+    elements = [element for element in query['query'] if element['code'] == partition_by]
+    if partition_by not in codes or not elements:
+        raise ValueError('Unable to partition by {code}, use one of: {codes}'.format(
+            code = partition_by, 
+            codes = [element['code'] for element in query['query']]))
+    
+    values = _selected_codes(elements[0]['selection'], codes[partition_by])
+    if values is None:
+        raise ValueError('Unable to partition by {code}, unknown filter: {filter}'.format(
+            code = partition_by, filter = elements[0]['selection']['filter']))
+    
+    partitions = []
+    for value in values:
+        part = OrderedDict(query)
+        part['query'] = []
+        for element in query['query']:
+            if element['code'] == partition_by:
+                element = OrderedDict(element)
+                element['selection'] = OrderedDict([('filter', 'item'), 
+                                                    ('values', [value])])
+            part['query'].append(element)
+        partitions.append((value, part))
+    return partitions
+
+
+def _write_parquet(full_url, query, path, 
+                   max_cells = None, 
+                   partition_by = None, 
+                   **options):
+    """
+    Downloads the result of a query in parts (at most max_cells cells 
+    each, and one part for each value of the variable partition_by) and 
+    writes each part to a parquet file in the directory path as soon as it 
+    is decoded, so only one part is in memory at a time.
+    
+    With partition_by (a variable code, eg. 'Tid') the files are in hive 
+    style sub directories, path/Tid=2016/part-00000.parquet. Each file 
+    keeps all the columns (also the label column of the variable, eg. 
+    time), so the files can be read one by one. Reading the directory 
+    adds the partition column Tid, with the type pyarrow infers from the 
+    codes (unless partitioning = None).
+    
+    The values are stored as float64 (unless options['value_dtype'] is 
+    given), so all the files have the same schema.
+    
+    Returns the path. The dataset is read with pd.read_parquet(path).
+    """
+    if not _has_pyarrow():
+        raise ImportError('Writing to parquet requires pyarrow')
+    if os.path.isdir(path) and os.listdir(path):
+        raise FileExistsError('The directory is not empty: {path}'.format(path = path))
+    
+    response_format = options.pop('response_format', None)
+    if response_format is not None:
+        query = _with_format(query, response_format)
+    if max_cells is None:
+        max_cells = _max_cells(full_url)
+    if options.get('value_dtype') is None:
+        options['value_dtype'] = 'float64'
+    
+    variables = get_variables(full_url = full_url)
+    response_format = _auto_format(query, variables)
+    
+    number = 0
+    for value, part in _partitions(query, variables, partition_by):
+        directory = path
+        if partition_by is not None:
+            directory = os.path.join(path, '{code}={value}'.format(
+                code = partition_by, value = quote(value, safe = '')))
+        queries = _sub_queries(part, max_cells, variables)
+        for df in _read_parts(full_url, queries, response_format, variables, **options):
+            with _Phase('write', url = full_url, cells = len(df)):
+                _write_frame(df, os.path.join(directory, 'part-{number:05d}.parquet'.format(
+                    number = number)))
+            number += 1
+    return path
+
+
+#%% Query planner
+
+# approximate number of characters per value in a json-stat response
+# (digits, decimals and the comma)
+BYTES_PER_VALUE = 8
+
+
+def _string_bytes():
+    """
+    Returns the (approximate) bytes a string column uses per row, 
+    not counting the characters.
+    """
+    if getattr(pd.Series(['a']).dtype, 'storage', None) == 'pyarrow':
+        return 8            # offset
+    return 8 + 49           # pointer and python string object
+
+
+def explain(table_id = None, 
+            query = None, 
+            language = 'en', 
+            base_url = None, 
+            full_url = None, 
+            source = None, 
+            box = None, 
+            max_cells = None, 
+            categorical = False, 
+            value_dtype = None):
+    """
+    Returns the plan for reading a table, without downloading it: the 
+    number of cells, the estimated size of the response and of the 
+    dataframe, the number of requests and whether the query is larger 
+    than the limits of the server.
+    
+    Only the metadata of the table is used (from the metadata cache, 
+    it is downloaded if it is not there).
+    
+    Example
+    -------
+    
+        explain(table_id = '10714')                     # as read_all
+        explain(table_id = '10714', query = json_query) # as read_with_json
+        explain(box = box)                              # as read_box
+    
+    
+    Parameters
+    ----------
+    
+        table_id, language, base_url, full_url, source:
+            the table, as in read_with_json
+            
+        query: dict, Query or string
+            the json-stat query, a json string is read with to_dict 
+            (default: all values of all variables, as in read_all)
+            
+        box: widget container
+            a box made by select (instead of table_id and query)
+            
+        max_cells, categorical, value_dtype:
+            as in read_with_json
+    
+    
+    Returns
+    -------
+    
+        a pandas series with
+        
+        url:                the url of the table
+        cells:              the number of cells (rows) in the result
+        shape:              the number of values selected in each variable
+        max_cells:          the maximum number of cells in one query
+        exceeds_max_cells:  True if the query is split in several parts
+        requests:           the number of data requests
+        quota_seconds:      the least time the request quota of the source 
+                            allows the requests to take
+        exceeds_quota:      True if the requests are more than the quota 
+                            allows at once (they will be throttled)
+        response_bytes:     estimated size of the responses (not compressed)
+        memory_bytes:       estimated memory of the dataframe
+    """
+    if box is not None:
+        from .interactive import get_json
+        query = get_json(box)
+        full_url = box.children[3].value
+    else:
+        full_url = _table_url(table_id, language, base_url, full_url, source)
+    
+    variables = get_variables(full_url = full_url)
+    if query is None:
+        query = _full_query(variables, wildcard = True)
+    query = _query_dict(query)
+    
+    if max_cells is None:
+        max_cells = _max_cells(full_url)
+    
+    cells = _count_cells(query, variables)
+    queries = _sub_queries(query, max_cells, variables)
+    
+    # the dataframe: one column for each variable in the query and the values
+    by_code = dict((var['code'], var) for var in variables)
+    shape = OrderedDict()
+    dimension_bytes = 0
+    row_bytes = np.dtype(value_dtype or 'float64').itemsize
+    category_bytes = 0
+    
+    for element in query['query']:
+        var = by_code.get(element['code'], {})
+        codes = var.get('values', [])
+        texts = dict(zip(codes, var.get('valueTexts', codes)))
+        selected = _selected_codes(element['selection'], codes or None) or []
+        shape[element['code']] = len(selected)
+        
+        lengths = [len(texts.get(code, code).encode('utf-8')) for code in selected]
+        dimension_bytes += sum(len(code) + length + 12 for code, length in zip(selected, lengths))
+        if not lengths:
+            continue
+        if categorical:
+            row_bytes += np.min_scalar_type(-len(lengths)).itemsize
+            category_bytes += sum(lengths) + len(lengths) * _string_bytes()
+        else:
+            row_bytes += _string_bytes() + float(sum(lengths)) / len(lengths)
+    
+    profile = get_source(url = full_url)
+    requests = len(queries)
+    bucket_size = getattr(profile, 'requests', None)
+    if bucket_size:
+        quota_seconds = max(requests - bucket_size, 0) * float(profile.per) / bucket_size
+    else:
+        quota_seconds = 0.0
+    
+    plan = OrderedDict()
+    plan['url'] = full_url
+    plan['cells'] = cells
+    plan['shape'] = dict(shape)
+    plan['max_cells'] = max_cells
+    plan['exceeds_max_cells'] = cells is not None and cells > max_cells
+    plan['requests'] = requests
+    plan['quota_seconds'] = quota_seconds
+    plan['exceeds_quota'] = bool(bucket_size) and requests > bucket_size
+    if cells is None:
+        plan['response_bytes'] = None
+        plan['memory_bytes'] = None
+    else:
+        plan['response_bytes'] = int(cells * BYTES_PER_VALUE + requests * dimension_bytes)
+        plan['memory_bytes'] = int(cells * row_bytes + category_bytes)
+    return pd.Series(plan, name = 'plan', dtype = object)
+
+
+#%% 
+
+def read_with_json(table_id = None, 
+              query = None, 
+              language = 'en', 
+              base_url = None, 
+              full_url = None, 
+              source = None, 
+              max_cells = None, 
+              engine = 'native', 
+              categorical = False, 
+              value_dtype = None, 
+              response_format = None, 
+              cache = None, 
+              to_parquet = None, 
+              partition_by = None, 
+              output = 'pandas'):
+    """
+    Returns a pandas dataframe with the values for the table specified by 
+    table_id and an explicit json string (in json-stat format).
+    
+    Useful if 
+        - you know exactly what you are looking for and
+        - can specify the json yourself (as a dictionary)
+        - you do not want to use the notebook/widgets/box to specify the json query
+        
+    Queries that return more than max_cells cells (default: the max_cells 
+    of the source) are split into several smaller queries and the results 
+    are combined. The table is in the source (default: default_source) 
+    unless a base_url or full_url is given.
+    
+    The engine ('native', 'pyjstat' or 'stream' for a low peak memory) 
+    decides how the json-stat result is turned into a dataframe. Use 
+    categorical = True and a value_dtype (eg. 'float32') for a compact 
+    dataframe (see from_json_stat).
+    
+    cache: a ResultCache (or a directory) to store the result in, so the 
+    table is only downloaded again if it has been updated on the server. 
+    None (default) uses the module result_cache, which is not set unless 
+    you set it. True is a ResultCache in the default directory, and False 
+    downloads the table even if result_cache is set.
+    
+    response_format: the format the server is asked for, 'json-stat', 
+    'json-stat2', 'csv' or 'auto' (default: the format in the query). 
+    They give the same dataframe. csv is the fastest to decode for large 
+    tables (it is parsed in several threads with pyarrow, using the 
+    metadata for the dimensions), and 'auto' uses csv for large queries.
+    
+    output: 'pandas' (default) or 'arrow' for a pyarrow Table, made 
+    directly from the json-stat values with dictionary encoded dimension 
+    columns (see to_arrow), for DuckDB, Polars and other Arrow tools.
+    
+    to_parquet: a directory to write the result to (as a parquet dataset, 
+    in parts of at most max_cells cells) instead of returning a dataframe. 
+    Only one part is in memory at a time, so the table can be larger than 
+    the memory. Returns the directory, read it with pd.read_parquet. 
+    Requires pyarrow, and the directory must be new or empty.
+    
+    partition_by: the code of a variable (eg. 'Tid') to partition the 
+    parquet dataset by, one sub directory (Tid=2016) for each value. The 
+    files keep all the columns, so pd.read_parquet(path) adds the code as 
+    an extra (partition) column; use partitioning = None to leave it out.
+    
+    Hints
+    -----
+        - use full_json(table_id = '10714', out = 'string') to get a query string and edit it
+        - use to_dict(str) to get a dict from an edited json string
+        - use Query() to build a query, also with wildcards and the latest values
+        - use explain(table_id = '10714', query = json_query) to see the size of 
+          the result and the number of requests before reading
+            
+    Example
+    -------
+    json_query = {'response': {'format': 'json-stat'}, 
+        'query': [
+        {'selection': {'values': ['0'], 'filter': 'item'}, 'code': 'Region'}, 
+        {'selection': {'values': ['KufjolsIAlt'], 'filter': 'item'}, 'code': 'ContentsCode'}, 
+        {'selection': {'values': ['1999', '2013'], 'filter': 'item'}, 'code': 'Tid'}]}
+        }
+    
+    df = read_with_json(table_id = '10714', query = json_query)
+    
+    """
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+    if to_parquet is not None:
+        return _write_parquet(full_url, _query_dict(query), to_parquet, 
+                              max_cells = max_cells, 
+                              partition_by = partition_by, 
+                              engine = engine, 
+                              output = output, 
+                              categorical = categorical, 
+                              value_dtype = value_dtype, 
+                              response_format = response_format)
+    return _post_query(full_url, _query_dict(query), 
+                       max_cells = max_cells, 
+                       cache = cache, 
+                       engine = engine, 
+                       output = output, 
+                       categorical = categorical, 
+                       value_dtype = value_dtype, 
+                       response_format = response_format)
+
+
+
+#%%
+
+def read_url(full_url = None, 
+             table_format = 'json', 
+             engine = 'native', 
+             categorical = False, 
+             value_dtype = None, 
+             cache = None, 
+             output = 'pandas'):
+    """
+    Returns a pandas dataframe of the premade table indicated by the premade 
+    table_id or the full_url.
+    
+    Note: The premade table id may be different from the normal table id.
+    
+    engine, categorical, value_dtype, cache and output are as in 
+    read_with_json (they are used for json-stat tables, and cache and 
+    output also for csv tables).
+    """
+      
+    return _get_table(full_url, table_format, cache, 
+                      engine = engine, 
+                      output = output, 
+                      categorical = categorical, 
+                      value_dtype = value_dtype)
+
+
+
+def _get_table(full_url, table_format = 'json', cache = None, **options):
+    """
+    Downloads a table (json-stat or csv) and returns it as a pandas dataframe.
+    
+    If the table is in the cache, the server is asked if it has changed 
+    (ETag/Last-Modified) and the stored table is used if it has not.
+    """
+    if table_format not in ('json', 'csv'):
+        print("""Table_format is incorrectly specified. 
+              It must be 'json-stat' or 'csv'""")
+        return None
+    
+    cache = _result_cache(cache)
+    headers = {}
+    if cache is not None:
+        key = cache.key(full_url, None, _cache_options(options))
+        with _Phase('result_cache', url = full_url) as phase:
+            info = cache.info(key)
+            hit = info is not None and cache.fresh(info)
+            phase.set(cache_hit = hit)
+        if hit:
+            return cache.load(key, info)
+        if info is not None:
+            if info.get('etag'):
+                headers['If-None-Match'] = info['etag']
+            if info.get('last_modified'):
+                headers['If-Modified-Since'] = info['last_modified']
+    
+    stream = table_format == 'json' and options.get('engine') == 'stream'
+    with _Phase('read', url = full_url, format = table_format, requests = 1) as phase:
+        data = client.get(full_url, headers = headers, stream = stream)
+        
+        if data.status_code == 304:
+            data.close()
+            phase.set(cache_hit = True)
+            # checked now, so it is fresh for max_age seconds again
+            cache.touch(key, info)
+            return cache.load(key, info)
+        
+        if table_format == 'json':
+            df = _read_response(data, **options)
+        elif options.get('output') == 'arrow':
+            from pyarrow import csv as pa_csv
+            df = pa_csv.read_csv(io.BytesIO(data.content))
+        else:
+            df = pd.read_csv(io.BytesIO(data.content))
+        phase.set(cells = len(df))
+    
+    if cache is not None:
+        cache.store(key, df, 
+                    url = full_url, 
+                    etag = data.headers.get('ETag'), 
+                    last_modified = data.headers.get('Last-Modified'))
+    return df
+
+
+#%%
+
+def search_premade(phrase = '*',
+                   language = 'en',
+                   url = None, 
+                   catalog = None, 
+                   source = None):
+    
+    """
+    Returns a pandas dataframe with the tables matching the tags specified in the search.
+    
+    Note that the function does not search in the headline of the tables, but in the tags.
+    
+    The search is exact, so it may be better to get a list of all tables 
+    (use phrase = '*' or just leave it unspecified)
+    
+    The ID column contains a special table id for premade tables 
+    (use this is when specifying the table to be downloaded)
+    
+    With a catalog (default: the module search_catalog, if it is set) the 
+    search is done in the local catalog, without network access.
+    
+    The url of the list of premade tables is the premade_url of the 
+    source (default: default_source) unless url is given.
+    
+    Example:
+        
+        tables = search_url_tables('population')
+    
+    
+    """
+    if catalog is None:
+        catalog = search_catalog
+    if catalog is not None:
+        return catalog.search_premade(phrase, language = language)
+    
+    df = _premade_listing(language, _premade_url(url, source))
+    phrase = phrase.lower()
+    
+    if phrase != '*':
+        df = df[(df.iloc[:,0].str.lower().str.contains(phrase)) | 
+                (df.iloc[:,1].str.lower().str.contains(phrase)) ]
+    return df
+
+# to do: merge the two search functions?
+# make premade an bool arg in the search. 
+# also allow full_url
+
+
+def _premade_table_url(premade_id, language = 'en', base_url = None, 
+                       table_format = 'json', source = None):
+    """
+    Returns the url of a premade table.
+    """
+    return '{base_url}/{premade_id}.{table_format}?lang={language}'.format(
+            base_url = _premade_url(base_url, source),
+            premade_id = str(premade_id), 
+            language = language,
+            table_format = table_format)
+
+
+def _premade_url(url = None, source = None):
+    """
+    Returns url, or the url of the premade tables of the source.
+    """
+    if url is None:
+        source = get_source(source)
+        url = source.premade_url
+        if url is None:
+            raise ValueError('The source {name} has no premade tables'.format(name = source.name))
+    return url
+
+
+def _premade_listing(language, url):
+    """
+    Returns a dataframe with all premade tables (id, title and tags).
+    """
+    url = '{url}?lang={language}'.format(
+        url = url,
+        language = language)
+    
+    df = pd.read_html(io.StringIO(client.get(url).text))
+    df = df[0]
+    df.index = df['ID']
+    df = df.iloc[:,[0,1]]
+    df = df.sort_index()
+    return df
+
+
+#%% Offline catalog
+
+def _tokens(text):
+    """
+    Returns the (lower case) words in a text.
+    """
+    return re.findall(r'\w+', str(text).lower())
+
+
+def _list_tables(language, base_url, max_workers = 8):
+    """
+    Returns a list with all tables (id, title, updated, path) found by 
+    walking the folders of the api, in the same form as search results.
+    """
+    root = _api_url(base_url, language)
+    tables = []
+    
+    def visit(path):
+        folders = []
+        # many requests, behind the ones of the user (the executor threads 
+        # do not inherit the lane of the caller)
+        with scheduler.lane('batch'):
+            nodes = client.get(root + path).json()
+        for node in nodes:
+            if node.get('type') == 't':
+                tables.append({'id' : node['id'], 
+                               'path' : '/' + path, 
+                               'published' : node.get('updated'), 
+                               'title' : '{id}: {text}'.format(id = node['id'], 
+                                                               text = node.get('text'))})
+            elif node.get('type') == 'l':
+                folders.append(path + node['id'] + '/')
+        return folders
+    
+    level = ['']
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        while level:
+            level = [folder for folders in executor.map(visit, level) for folder in folders]
+    
+    return sorted(tables, key = lambda table: table['id'])
+
+
+class _Index(object):
+    """
+    An inverted index: for each word, the positions of the records it occurs in.
+    """
+    
+    def __init__(self, texts):
+        self.postings = {}
+        self.lengths = []
+        for position, text in enumerate(texts):
+            tokens = _tokens(text)
+            self.lengths.append(len(tokens))
+            for token in tokens:
+                self.postings.setdefault(token, set()).add(position)
+        self.words = sorted(self.postings)
+    
+    def find(self, phrase, truncate = False):
+        """
+        Returns the positions of the records with all the words in the phrase 
+        (a word ending with * matches all words beginning with it).
+        """
+        found = None
+        for word in phrase.lower().split():
+            prefix = truncate or word.endswith('*')
+            for token in _tokens(word):
+                if prefix:
+                    start = bisect.bisect_left(self.words, token)
+                    stop = bisect.bisect_left(self.words, token + u'\uffff')
+                    matches = set()
+                    for match in self.words[start:stop]:
+                        matches |= self.postings[match]
+                else:
+                    matches = self.postings.get(token, set())
+                found = matches if found is None else found & matches
+        return found or set()
+
+
+class Catalog(object):
+    """
+    A local catalog of all tables and premade tables, with an index of the 
+    words in the ids, titles and tags. search and search_premade can use it 
+    to answer in milliseconds without network access.
+    
+    The catalog is downloaded with refresh() (in the background if wanted) 
+    and stored in a file, so it can be used again later.
+    
+    Example
+    -------
+    
+        cat = Catalog('catalog.json')
+        cat.refresh(background = True)
+        
+        cat.search('pharma*')
+        cat.search_premade('population', language = 'no')
+        
+        stp.search_catalog = cat     # search and search_premade use it
+    
+    
+    Parameters
+    ----------
+    
+        path: string
+            file to store the catalog in (optional)
+            
+        languages: tuple
+            the languages to download the catalog in
+            
+        base_url: string
+            base url of the api
+            
+        premade_url: string
+            url of the list of premade tables
+            
+        source: string
+            the name of the source the catalog is for (default: default_source), 
+            which gives the languages and urls that are not specified
+    """
+    
+    def __init__(self, 
+                 path = None, 
+                 languages = None, 
+                 base_url = None, 
+                 premade_url = None, 
+                 source = None):
+        profile = get_source(source)
+        self.path = path
+        self.languages = languages or profile.languages
+        self.base_url = base_url or profile.base_url
+        self.premade_url = premade_url or profile.premade_url
+        self.refreshed = None
+        self._tables = {}
+        self._premade = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+        
+        if path is not None and os.path.exists(path):
+            self.load()
+    
+    def refresh(self, background = False):
+        """
+        Downloads the list of tables and premade tables. 
+        With background = True, this is done in a thread (which is returned), 
+        and the old catalog is used until the new one is ready.
+        """
+        if background:
+            thread = threading.Thread(target = self.refresh)
+            thread.daemon = True
+            thread.start()
+            return thread
+        
+        tables = {}
+        premade = {}
+        with scheduler.lane('batch'):
+            for language in self.languages:
+                tables[language] = _list_tables(language, self.base_url)
+                if self.premade_url is None:
+                    continue
+                listing = _premade_listing(language, self.premade_url)
+                premade[language] = {'columns' : [str(column) for column in listing.columns], 
+                                     'index' : listing.index.tolist(), 
+                                     'rows' : listing.values.tolist()}
+        
+        self._set(tables, premade, time.time())
+        if self.path is not None:
+            self.save()
+    
+    def _set(self, tables, premade, refreshed):
+        indexes = {}
+        for language, records in tables.items():
+            indexes['table', language] = _Index(record['title'] for record in records)
+        for language, listing in premade.items():
+            indexes['premade', language] = _Index(
+                ' '.join(str(field) for field in [id] + row) 
+                for id, row in zip(listing['index'], listing['rows']))
+        
+        with self._lock:
+            self._tables = tables
+            self._premade = premade
+            self._indexes = indexes
+            self.refreshed = refreshed
+    
+    def save(self, path = None):
+        """
+        Stores the catalog in a (json) file.
+        """
+        path = path or self.path
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({'refreshed' : self.refreshed, 
+                       'tables' : self._tables, 
+                       'premade' : self._premade}, f)
+        os.replace(temp, path)
+    
+    def load(self, path = None):
+        """
+        Reads a catalog stored with save().
+        """
+        with open(path or self.path) as f:
+            stored = json.load(f)
+        self._set(stored['tables'], stored['premade'], stored['refreshed'])
+    
+    def _index(self, kind, language):
+        with self._lock:
+            if (kind, language) not in self._indexes:
+                raise ValueError('The catalog has no {kind} tables in language {language}, '
+                                 'use refresh()'.format(kind = kind, language = language))
+            return self._indexes[kind, language]
+    
+    def search(self, phrase, language = 'en'):
+        """
+        Returns a dataframe with the tables that have all the words in the 
+        phrase in their id or title (in the same form as search()).
+        Supports truncation: 'pharma*'.
+        """
+        index = self._index('table', language)
+        records = self._tables[language]
+        
+        words = len(phrase.split())
+        results = []
+        for position in index.find(phrase.replace('"', ' ')):
+            record = dict(records[position])
+            record['score'] = float(words) / max(index.lengths[position], 1)
+            results.append(record)
+        results.sort(key = lambda record: (-record['score'], record['id']))
+        
+        return _search_results(results)
+    
+    def search_premade(self, phrase = '*', language = 'en'):
+        """
+        Returns a dataframe with the premade tables that have all the words 
+        (or beginnings of words) in the phrase in their id, title or tags 
+        (in the same form as search_premade()).
+        """
+        index = self._index('premade', language)
+        listing = self._premade[language]
+        
+        df = pd.DataFrame(listing['rows'], 
+                          index = pd.Index(listing['index'], name = 'ID'), 
+                          columns = listing['columns'])
+        if phrase.strip() != '*':
+            df = df.iloc[sorted(index.find(phrase, truncate = True))]
+        return df
+
+
+# the catalog used by search and search_premade (None: search on the server)
+search_catalog = None
 
 
 
 #%%
 
-def search(phrase, 
-           language = 'en', 
-           base_url = 'http://data.ssb.no/api/v0'):
+def read_premade(premade_id = None, 
+            language = 'en', 
+            base_url = None, 
+            full_url = None, 
+            table_format = 'json', 
+            engine = 'native', 
+            categorical = False, 
+            value_dtype = None, 
+            cache = None, 
+            source = None, 
+            output = 'pandas'):
     """
-        Search for tables that contain the phrase in Statistics Norway.
-        Returns a pandas dataframe with the results.
-            
-        Example
-        -------
+    Returns a pandas dataframe of the premade table indicated by the premade 
+    table_id or the full_url.
+    
+    Note: The premade table id may be different from the normal table id.
+    
+    base_url is the url of the premade tables (default: the premade_url of 
+    the source).
+    
+    engine, categorical, value_dtype, cache and output are as in 
+    read_with_json (they are used for json-stat tables, and cache and 
+    output also for csv tables).
+    """
+    
+    if full_url is None:
+        full_url = _premade_table_url(premade_id, language, base_url, table_format, source)
+    #print(full_url)
+    
+    return _get_table(full_url, table_format, cache, 
+                      engine = engine, 
+                      output = output, 
+                      categorical = categorical, 
+                      value_dtype = value_dtype)
+
+
+#%%
+
+def full_json(table_id = None, 
+              out = 'dict', 
+              language = 'en', 
+              full_url = None, 
+              wildcard = False, 
+              base_url = None, 
+              source = None):
+    """
+    Returns the json query for getting all the values for all options for a table.
+    Useful if
+        - you do not want to use the widgets/notebook to build the query
+        - but want a starting point to revise and specify a the query instead of building it from the ground.
+    
+    Note
+        - The json is a dictionary. You may want to edit the content of the dictionary directly,
+        or make it a string, edit it as a string, and retransform it to a dictionary.
         
-            df = search("income")
+        To transform a string to a dict, use the function:
         
+            query = to_dict(json_str)
         
-        Parameters
-        ----------
+        - With wildcard = True, each variable selects all values with an 
+        'all' filter instead of listing every value (a much smaller query).
         
-        phrase: string
-            The phrase can contain several words (space separated): 
-                search("export Norwegian parrot")
-            
-            It also supports trucation: 
-                search("pharma*")
-                
-            Not case sensitive.
-            Language sensitive (specified in the language option)
-            
-        language: string 
-            default in Statistics Norway: 'en' (Search for English words) 
-            optional in Statistics Norway: 'no' (Search for Norwegian words)
-                   
-        url: string
-            default in Statistics Norway: 'http://data.ssb.no/api/v0'
-            different defaults can be specified
-       
-        """
+    Example
+    -------
     
-    # todo: make converter part of the default specification only for statistics norway
-    convert = {'æ' : '%C3%A6', 'Æ' : '%C3%86', 'ø' : '%C3%B8', 'Ø' : '%C3%98', 
-             'å' : '%C3%A5', 'Å' : '%C3%85',
-             '"' : '%22', '(' : '%28', ')' : '%29', ' ' : '%20'}
+    query = full_json(table_id = '10714', out = 'string')
+    
+    """
+    
+    variables = get_variables(table_id, 
+                              language = language, 
+                              base_url = base_url, 
+                              full_url = full_url, 
+                              source = source)
+    return _full_query(variables, out = out, wildcard = wildcard)
 
-    search_str = '{base_url}/{language}/table/?query={phrase}'.format(
-        base_url = base_url, 
-        language = language, 
-        phrase = phrase)
+
+def _full_query(variables, out = 'dict', wildcard = False):
+    """
+    Returns the query for all the values of the variables.
+    """
+    with _Phase('query'):
+        query = Query()
+        for var in variables:
+            if wildcard:
+                query.all(var['code'])
+            else:
+                query.item(var['code'], var['values'])
+        
+        if out == 'dict':
+            return query.to_dict()
+        return query.to_json()
+
+
+#%%
+
+def read_all(table_id = None, 
+             language = 'en',
+             base_url = None, 
+             full_url = None, 
+             source = None, 
+             max_cells = None, 
+             engine = 'native', 
+             categorical = False, 
+             value_dtype = None, 
+             response_format = None, 
+             cache = None, 
+             to_parquet = None, 
+             partition_by = None, 
+             output = 'pandas'):
+    """
+    Returns a pandas dataframe with all values for all options 
+    for the table specified by table_id
     
-    for k, v in convert.items():
-        search_str = search_str.replace(k, v)
+    Warning: The table may be large. Tables with more than max_cells cells 
+    (default: the max_cells of the source) are downloaded in several parts. 
+    The table is in the source (default: default_source) unless a base_url 
+    or full_url is given.
     
-    #print(search_str)    
+    engine, categorical, value_dtype, cache, response_format, output, 
+    to_parquet and partition_by are as in read_with_json.
     
-    df = pd.read_json(search_str)
+    Useful if 
+        - you know exactly what you are looking for and
+        - you do not want to use the notebook/widgets/box to specify the json query)
     
-    if len(df) == 0:
-        print("No match")
-        return df
+    Example
     
-    # make the dataframe more readable
-    # (is it worth it? increases vulnerability. formats may differ and change)
-    # todo: make search and format conditional on the database being searched    
-       
-    # split the table name into table id and table text
-  
-    df['table_id'] = df['title'].str.split(':').str.get(0)
-    df['table_title'] = df['title'].str.split(':').str.get(1)
-    del df['title']
+    df = read_all(table_id = '10714')
+    read_all(table_id = '10714', to_parquet = 'cows', partition_by = 'Tid')
     
-    # make table_id the index, visually more intuitive with id as first column
-    df = df.set_index('table_id')
+    """
     
-    # change order of columns to make it more intuitive (table_title is first) 
-    cols = df.columns.tolist()
-    cols.sort(reverse = True)
-    df = df[cols[:-2]]
+     
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+        
+    # select everything with wildcards, instead of listing all values
+    query = full_json(full_url = full_url, wildcard = True)
+    if to_parquet is not None:
+        return _write_parquet(full_url, query, to_parquet, 
+                              max_cells = max_cells, 
+                              partition_by = partition_by, 
+                              engine = engine, 
+                              output = output, 
+                              categorical = categorical, 
+                              value_dtype = value_dtype, 
+                              response_format = response_format)
+    results = _post_query(full_url, query, 
+                          max_cells = max_cells, 
+                          cache = cache, 
+                          engine = engine, 
+                          output = output, 
+                          categorical = categorical, 
+                          value_dtype = value_dtype, 
+                          response_format = response_format)
+    
+    # maybe this need not be its own function, 
+    # but an option in read_json? json = 'all'
+    
+    # other functions(options include: read_recent to get only the 
+    # most recent values (defined as x), json = 'recent')
+    
+    return results
+
+
+
+#%%
 
+def _time_variable(variables, time_code = None):
+    """
+    Returns the time variable of a table (the one marked as time in the 
+    metadata, or the one with the code time_code, or 'Tid').
+    """
+    for var in variables:
+        if time_code is None and var.get('time'):
+            return var
+    
+    time_code = time_code or 'Tid'
+    for var in variables:
+        if var['code'] == time_code:
+            return var
+    raise ValueError('The table has no time variable {code}'.format(code = time_code))
+
+
+def refresh(table_id = None, 
+            path = None, 
+            query = None, 
+            time_code = None, 
+            latest = None, 
+            language = 'en', 
+            base_url = None, 
+            full_url = None, 
+            source = None, 
+            max_cells = None, 
+            engine = 'native', 
+            categorical = False, 
+            value_dtype = None, 
+            response_format = None):
+    """
+    Updates a table stored on disk with the time periods that have been 
+    added on the server since it was stored, and returns the whole table.
+    
+    Only the new periods are downloaded (they are found by comparing the 
+    time values in the metadata with the values in the stored table) and 
+    appended to the stored table. The first time, the whole table 
+    (or query) is downloaded and stored.
+    
+    Example
+    -------
+    
+        df = refresh(table_id = '10714', path = 'cows.parquet')
+    
+    
+    Parameters
+    ----------
+    
+        table_id: string
+            the id of the table
+        
+        path: string
+            the file the table is stored in (.parquet, anything else is 
+            stored as a pickle), required
+            
+        query: dict
+            a json-stat query selecting the other variables 
+            (default: all values of all variables). The selection of 
+            the time variable in the query is replaced.
+            
+        time_code: string
+            the code of the time variable (default: the variable marked as 
+            time in the metadata, or 'Tid')
+            
+        latest: int
+            if given, ask the server for the latest periods only (a 'top' 
+            filter) and keep the ones that are not stored. Useful if only 
+            the last few periods can be new.
+            
+        Other parameters as in read_all.
+    """
+    if path is None:
+        raise TypeError("refresh() missing required argument: 'path'")
+    
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+    # new periods are only in fresh metadata, not in the cached copy
+    metadata_cache.delete(_cache_key(full_url))
+    variables = get_variables(full_url = full_url)
+    
+    if query is None:
+        query = _full_query(variables, wildcard = True)
+    query = _query_dict(query)
+    
+    if not os.path.exists(path):
+        df = _post_query(full_url, query, 
+                         max_cells = max_cells, 
+                         engine = engine, 
+                         categorical = categorical, 
+                         value_dtype = value_dtype, 
+                         response_format = response_format)
+        _write_frame(df, path)
+        return df
+    
+    stored = _read_frame(path)
+    
+    time_var = _time_variable(variables, time_code)
+    column = time_var['text']
+    if column not in stored.columns:
+        raise ValueError('The stored table has no column {column}'.format(column = column))
+    
+    present = set(stored[column].astype(str))
+    missing = [code for code, text in zip(time_var['values'], time_var['valueTexts']) 
+               if text not in present]
+    
+    if not missing:
+        return stored
+    
+    if latest is not None:
+        selection = {'filter' : 'top', 'values' : [str(latest)]}
+    else:
+        selection = {'filter' : 'item', 'values' : missing}
+    
+    new_query = OrderedDict(query)
+    new_query['query'] = [element for element in query['query'] 
+                          if element['code'] != time_var['code']]
+    new_query['query'].append({'code' : time_var['code'], 'selection' : selection})
+    
+    new = _post_query(full_url, new_query, 
+                      max_cells = max_cells, 
+                      engine = engine, 
+                      categorical = categorical, 
+                      value_dtype = value_dtype, 
+                      response_format = response_format)
+    
+    new = new[~new[column].astype(str).isin(present)]
+    if len(new) == 0:
+        return stored
+    
+    df = _concat([stored, new.reset_index(drop = True)])
+    _write_frame(df, path)
     return df
 
 
-#%% 
 
-def get_variables(
-        table_id = None,
-        source = None, 
-        language = 'en',
-        base_url = 'http://data.ssb.no/api/v0',
-        full_url = None):
+
+
+#%% Table handle
+
+class Table(object):
     """
-        Returns a list. 
+    A table that is only downloaded when it is read (to_pandas). 
+    
+    sel and latest select values like in pandas, but the selection is 
+    made on the server (it is put in the query), so only the selected 
+    cells are downloaded and decoded. They return a new Table, the 
+    metadata is downloaded once (and cached).
+    
+    Variables that are not selected are read in full.
+    
+    Example
+    -------
+    
+        table = Table('10714')
+        cows = (table
+                .sel(Region = ['0', '03'], Tid = slice('2010', '2016'))
+                .sel(ContentsCode = 'Kufjols*'))
+        cows.cells
+        cows.explain()
+        df = cows.to_pandas()
         
-        Each element of the list is a dictionary that provides more 
-        information about a variable. 
+        df = Table('10714').latest(3).to_pandas(response_format = 'auto')
+    
+    
+    Parameters
+    ----------
+    
+        table_id: string
+            the id of the table
         
-        For instance, one variable may contain information about the
-        different years that are available.
+        language: string
+            language for table, 'en' (default) or 'no'
         
+        base_url: string
+            base url locating the table (not including table_id)
         
-        Parameters
-        ----------
-    
-            table_id: string
-                the unique table_id number, a string including leading zeros.
-                                
-            language: string
-                default 'en' (default, English) 
-                optional: 'no' (Norwegian)
-            
-            base_url: string
-                base url locating the table (not including table identifier)
-            
-            full_url: string 
-                The full url to the table.
-                If full_url is specified, other paramaters are ignored.
-                
+        full_url: string
+            the full url to the table
+        
+        source: string
+            the name of a source in sources (default: default_source)
     """
     
-    if full_url is None:
-          full_url = '{base_url}/{language}/table/{table_id}'.format(
-            base_url = base_url, language = language, table_id = table_id)
+    def __init__(self, 
+                 table_id = None, 
+                 language = 'en', 
+                 base_url = None, 
+                 full_url = None, 
+                 source = None):
+        self.full_url = _table_url(table_id, language, base_url, full_url, source)
+        self.variables = get_variables(full_url = self.full_url)
+        self.query = Query()
+    
+    @property
+    def title(self):
+        return get_metadata(full_url = self.full_url)['title']
+    
+    def _variable(self, name):
+        """
+        Returns the variable with the code (or label) name.
+        """
+        for var in self.variables:
+            if var['code'] == name:
+                return var
+        for var in self.variables:
+            if var['text'] == name:
+                return var
+        raise ValueError('Unknown variable: {name}, use one of {codes}'.format(
+            name = name, codes = [var['code'] for var in self.variables]))
+    
+    def _copy(self):
+        new = object.__new__(type(self))
+        new.full_url = self.full_url
+        new.variables = self.variables
+        new.query = Query.from_dict(self.query.to_dict())
+        return new
+    
+    def sel(self, **selections):
+        """
+        Returns a new Table with a selection of values of some variables 
+        (by code, or by label if the label is a valid name): 
+        
+            a value or a list of values (codes or value labels)
+            slice(start, stop): the values from start to stop (both included)
+            a pattern with * or ? (eg. '03*'): the matching codes
+        """
+        new = self._copy()
+        for name, values in selections.items():
+            var = self._variable(name)
+            if isinstance(values, str) and ('*' in values or '?' in values):
+                new.query.all(var['code'], values)
+            elif isinstance(values, slice):
+                new.query.item(var['code'], _slice_values(var, values))
+            else:
+                if isinstance(values, (str, int)):
+                    values = [values]
+                new.query.item(var['code'], [_value_code(var, value) for value in values])
+        return new
+    
+    def latest(self, n = 1, time_code = None):
+        """
+        Returns a new Table with only the n latest periods of the time variable.
+        """
+        new = self._copy()
+        new.query.top(_time_variable(self.variables, time_code)['code'], n)
+        return new
+    
+    def to_query(self):
+        """
+        Returns the query for the selection (a Query).
+        """
+        query = Query()
+        for var in self.variables:
+            selection = self.query.selections.get(var['code'])
+            if selection is None:
+                query.all(var['code'])
+            else:
+                query.select(var['code'], selection['filter'], selection['values'])
+        return query
+    
+    @property
+    def cells(self):
+        """
+        The number of cells in the selection.
+        """
+        return _count_cells(self.to_query().to_dict(), self.variables)
+    
+    def explain(self, **options):
+        """
+        Returns the plan for reading the selection, see explain.
+        """
+        return explain(full_url = self.full_url, query = self.to_query(), **options)
+    
+    def to_pandas(self, **options):
+        """
+        Downloads the selection and returns it as a pandas dataframe. 
+        
+        The options (engine, categorical, value_dtype, response_format, 
+        cache, max_cells, to_parquet, partition_by) are passed to read_with_json.
+        """
+        return read_with_json(full_url = self.full_url, query = self.to_query(), **options)
+    
+    def to_arrow(self, **options):
+        """
+        Downloads the selection and returns it as a pyarrow Table (see to_arrow).
+        """
+        return self.to_pandas(output = 'arrow', **options)
+    
+    def __repr__(self):
+        return 'Table({title!r}, cells = {cells}, query = {query})'.format(
+            title = self.title, cells = self.cells, query = self.query.to_json())
+
+
+def _value_code(var, value):
+    """
+    Returns the code of a value of a variable (value is a code or a label).
+    """
+    value = str(value)
+    if value in var['values']:
+        return value
+    texts = var.get('valueTexts', [])
+    if value in texts:
+        return var['values'][texts.index(value)]
+    raise ValueError('{code} has no value {value}'.format(code = var['code'], value = value))
+
+
+def _slice_values(var, selection):
+    """
+    Returns the codes of a variable from selection.start to selection.stop 
+    (both included, in the order of the table). A bound that is not a 
+    value is compared with the codes, which must then be sorted (as time 
+    periods are), as a prefix: slice('2015', '2016') includes 2016M12.
+    """
+    codes = var['values']
     
-    df = pd.read_json(full_url)
-    variables = [dict(values) for values in df.iloc[:,1]]
+    def position(value, side):
+        try:
+            return codes.index(_value_code(var, value)) + (side == 'right')
+        except ValueError:
+            if codes != sorted(codes):
+                raise
+            if side == 'right':
+                # after all the codes starting with the value
+                return bisect.bisect_right(codes, str(value) + '\uffff')
+            return bisect.bisect_left(codes, str(value))
     
-    return variables
+    start = 0 if selection.start is None else position(selection.start, 'left')
+    stop = len(codes) if selection.stop is None else position(selection.stop, 'right')
+    return codes[start:stop:selection.step]
 
 
 #%%
 
-def select(table_id = None, 
-           language = 'en', 
-           base_url = 'http://data.ssb.no/api/v0', 
-           full_url = None):
+def read_many(tables, 
+              premade = False, 
+              language = 'en', 
+              base_url = None, 
+              max_workers = 8, 
+              lane = 'batch', 
+              engine = 'native', 
+              categorical = False, 
+              value_dtype = None, 
+              source = None):
     """
-    Selects a table based on the table_id and returns a widget container 
-    in which the user can select the set of variables and values to be 
-    included in the final table.
-    
+    Reads several tables at the same time and returns two dictionaries: 
+    one with the dataframes and one with the errors for the tables that 
+    could not be read. One failed table does not stop the others.
     
     Example
-    --------
-    box = select(table_id = '10714')
-    
-    
-    Parameters
-    ----------    
+    -------
     
-        table_id : string 
-            the id of the desired table
-         
-        language: string
-            language for table
-            'en' (default, English) 
-            'no' (Norwegian): 
-            language for table
+        frames, errors = read_many(['10714', '05803'])
         
-        base_url: string.
-            base url locating the table (not including table_id)
+        frames, errors = read_many([('10714', json_query), '05803'])
         
-        full_url: string
-            the full url to the table
-    """
+        frames, errors = read_many({'cows' : '10714', 'pop' : '05803'})
         
-    # get table_id not full url was specified 
-    if full_url is None:
-        full_url = '{base_url}/{language}/table/{table_id}'.format(
-                    base_url = base_url, 
-                    language = language, 
-                    table_id = table_id)
+        frames, errors = read_many(['1052', '1086'], premade = True)
         
-    table_info = pd.read_json(full_url)
-    table_title = table_info.iloc[0,0]
-
-    # get a list with dictionaries containing information about each variable
-    variables = get_variables(table_id = table_id, 
-                              language = language,
-                              base_url = base_url,
-                              full_url = full_url)
+        frames, errors = read_many({
+            'no' : '05803', 
+            'se' : {'table_id' : 'BE/BE0101/BE0101A/BefolkningNy', 'source' : 'scb'}})
     
-    # get number of variables (ok, childish approach, can be simplified!)
-    nvars = len(variables)
-    var_list = list(range(nvars))
     
-    # a list of dictionaries of the values available for each variable
-    option_list = [OrderedDict(zip(variables[var]['valueTexts'], 
-                                   variables[var]['values'])) 
-                   for var in var_list]
+    Parameters
+    ----------
     
-    # create a selection widget for each variable
-    # todo: skip widget or make it invisible if there is only one option?
-    # todo: make first alternative a default selection initially for all tables?
-    # todo: add buttons for selecting "all", "latest" , "first" and "none"
-                         
-    selection_widgets = [widgets.widget_selection.SelectMultiple(
-                            options = option_list[var], 
-                            height = 400, 
-                            width = 500) 
-                         for var in var_list]
+        tables: list or dict
+            a list of table ids (all values are read, as in read_all), 
+            (table_id, query) pairs (read as in read_with_json), dicts 
+            with the arguments of read_all, read_with_json or read_premade 
+            (for instance table_id, query and source, to read from several 
+            sources, or premade_id) or, with premade = True, premade ids 
+            (read as in read_premade). 
+            
+            Each source is read as fast as its limits allow (see Source), 
+            so tables from different sources do not wait for each other.
+            
+            The dictionaries returned use the table id as key. 
+            Use a dict {name: table} to choose the keys yourself.
+            
+        premade: bool
+            True if the ids are premade table ids
+            
+        language: string
+            default 'en' (default, English) 
+            optional: 'no' (Norwegian)
+            
+        base_url: string
+            base url locating the tables (not including the table identifiers)
+            default: the base url of the source
+            
+        max_workers: int
+            the maximum number of tables read at the same time
+            
+        lane: string
+            the scheduler lane of the requests, default 'batch' 
+            (interactive requests made at the same time go first)
+            
+        engine, categorical, value_dtype:
+            how the tables are decoded, see from_json_stat
+            
+        source: string
+            the name of the source of the tables (default: default_source)
+    """
     
-    # put all the widgets in a container
-    variables_container = widgets.Tab(selection_widgets)
-
-    # label each container with the variable label 
-    for var in var_list:
-        title = str(variables[var]['text'])
-        variables_container.set_title(var, title)
+    if isinstance(tables, dict):
+        items = list(tables.items())
+    else:
+        items = []
+        for table in tables:
+            if isinstance(table, tuple):
+                name = table[0]
+            elif isinstance(table, dict):
+                name = table.get('table_id', table.get('premade_id'))
+            else:
+                name = table
+            items.append((name, table))
+        
+        names = [name for name, table in items]
+        if len(set(names)) < len(names):
+            raise ValueError('The same table id occurs more than once, '
+                             'use a dict to give each table a unique name')
     
-    # build widgets and put in one widget container
-    headline = widgets.Label(value = table_title, color = 'blue')
+    def read(table):
+        with scheduler.lane(lane):
+            return read_one(table)
     
-    endline = widgets.Label(value = '''Select category and click on elements 
-        to be included in the table (CTRL-A selects "all")''')
+    def read_one(table):
+        if premade:
+            return read_premade(premade_id = table, 
+                                language = language, 
+                                base_url = None if base_url is None else base_url + '/dataset', 
+                                engine = engine, 
+                                categorical = categorical, 
+                                value_dtype = value_dtype, 
+                                source = source)
+        
+        if isinstance(table, dict):
+            options = dict(language = language, 
+                           base_url = base_url, 
+                           engine = engine, 
+                           categorical = categorical, 
+                           value_dtype = value_dtype, 
+                           source = source)
+            options.update(table)
+            if 'premade_id' in options:
+                return read_premade(**options)
+            if options.get('query') is None:
+                options.pop('query', None)
+                return read_all(**options)
+            return read_with_json(**options)
+        
+        if isinstance(table, tuple):
+            table_id, query = table
+        else:
+            table_id, query = table, None
+        
+        if query is None:
+            return read_all(table_id = table_id, 
+                            language = language, 
+                            base_url = base_url, 
+                            engine = engine, 
+                            categorical = categorical, 
+                            value_dtype = value_dtype, 
+                            source = source)
+        return read_with_json(table_id = table_id, 
+                              query = query, 
+                              language = language, 
+                              base_url = base_url, 
+                              engine = engine, 
+                              categorical = categorical, 
+                              value_dtype = value_dtype, 
+                              source = source)
     
-    url_text = widgets.Label(value = full_url)
+    frames = OrderedDict()
+    errors = OrderedDict()
     
-    selection_container = widgets.VBox([headline, 
-                                        endline, 
-                                        variables_container, 
-                                        url_text])
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [(name, executor.submit(read, table)) for name, table in items]
+        for name, future in futures:
+            try:
+                frames[name] = future.result()
+            except Exception as error:
+                errors[name] = error
     
-    selection_container.layout.border = '3px grey solid'
-    # may include a "click here when finished" just to make it more intuitive?
-    return selection_container
+    return frames, errors
 
 
 
-#%% 
-def get_json(box=None, 
-             out = 'dict', 
-             language = 'en'):
+#%% Watching for updated tables
+
+class Watcher(object):
     """
-    Takes a widget container as input (where the user has selected varables) 
-    and returns a json dictionary or string that will fetch these variables. 
+    Finds the tables that have been updated on the server since they were 
+    last read, so only these are downloaded again.
     
-    The json follows the json-stat format.
+    The server is asked cheaply: the updated (or published) time of a 
+    table is found with a search for its id, and a premade table is 
+    asked for with a HEAD request with its ETag or Last-Modified (or a 
+    conditional GET, if the server has no HEAD, so the table is only 
+    downloaded if it has changed). When a table was last seen is 
+    stored in a json file.
     
-    Parameters
-    ----------
+    A table is also reported as updated if its update time cannot be 
+    found (not in the search and not in the metadata).
     
-    box : widget container 
-        name of widget box with the selected variables
+    Example
+    -------
     
-    out : string 
-        default: 'dict', options: 'str'
+        watcher = Watcher('watched.json')
+        watcher.watch(table_id = '10714')
+        watcher.watch('prices', premade_id = '1086')
+        watcher.watch('se', table_id = 'BE/BE0101/BE0101A/BefolkningNy', source = 'scb')
         
-        The json can be returned as a dictionary or a string.
-        The final end query should use a dict, but some may find it useful to
-        get the string and revise it before transforming it back to a dict.
-    
+        jobs = watcher.check()                    # {name: job} of updated tables
+        frames, errors = read_many(jobs)
+        watcher.done(frames)                      # remember them as seen
+        
+        frames, errors = watcher.read_updated()   # the same
     
-    Example
-    -------
     
-    json_query = get_json(box)
+    Parameters
+    ----------
     
+        path: string
+            the json file with when the tables were last seen
+            
+        max_workers: int
+            the maximum number of tables checked at the same time
     """
-        
-    table_url = box.children[3].value
-    variables = get_variables(full_url = table_url)
-    nvars = len(box.children[2].children)
-    var_list = list(range(nvars))
-    query_element = {}
     
-    # create a dict of strings, one for each variable that specifies 
-    # the json-stat that selects the variables/values
+    def __init__(self, path, max_workers = 8):
+        self.path = path
+        self.max_workers = max_workers
+        self.jobs = OrderedDict()
+        self.seen = {}
+        self.errors = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.seen = json.load(f)['seen']
+    
+    def watch(self, name = None, **job):
+        """
+        Adds a table to the watched tables. The job is the arguments 
+        used to read it: table_id (and query, source, language, ...) 
+        as in read_all and read_with_json, or premade_id as in read_premade. 
+        The name (default: the id) is the key in the jobs and the results.
+        """
+        if 'table_id' not in job and 'premade_id' not in job and 'full_url' not in job:
+            raise ValueError('A table_id, premade_id or full_url is needed to watch a table')
+        if name is None:
+            name = job.get('table_id', job.get('premade_id', job.get('full_url')))
+        self.jobs[name] = job
+        return self
     
-    for x in var_list:
-        value_list = str(list(box.children[2].children[x].value))
-        query_element[x] = '{{"code": "{code}", "selection": {{"filter": "item", "values": {values} }}}}'.format(
-            code = variables[x]['code'], 
-            values = value_list)
-        query_element[x] = query_element[x].replace("\'", '"')
+    def unwatch(self, name):
+        self.jobs.pop(name, None)
+        with self._lock:
+            self._pending.pop(name, None)
+            self.seen.pop(name, None)
     
-    all_elements = str(list(query_element.values()))
-    all_elements = all_elements.replace("\'", "")
-
-    query = '{{"query": {all_elements} , "response": {{"format": "json-stat" }}}}'.format(all_elements = all_elements)
+    def _stamp(self, name, job):
+        """
+        Returns when the table was last updated on the server, or the 
+        stamp already seen if the server says it has not changed.
+        """
+        if 'premade_id' in job:
+            url = job.get('full_url') or _premade_table_url(
+                job['premade_id'], 
+                job.get('language', 'en'), 
+                job.get('base_url'), 
+                job.get('table_format', 'json'), 
+                job.get('source'))
+            seen = self.seen.get(name)
+            headers = {}
+            if seen and seen.startswith('etag:'):
+                headers['If-None-Match'] = seen[len('etag:'):]
+            elif seen and seen.startswith('modified:'):
+                headers['If-Modified-Since'] = seen[len('modified:'):]
+            
+            # only the headers are asked for, the table is not downloaded
+            try:
+                response = client.request('HEAD', url, headers = headers)
+            except requests.HTTPError as error:
+                if error.response is None or error.response.status_code not in (405, 501):
+                    raise
+                # HEAD is not supported: a conditional GET (which has no 
+                # body if the table has not changed)
+                response = client.get(url, headers = headers)
+            
+            if response.status_code == 304:
+                return seen
+            if response.headers.get('ETag'):
+                return 'etag:' + response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                return 'modified:' + response.headers['Last-Modified']
+            return None
+        
+        full_url = _table_url(job.get('table_id'), 
+                              job.get('language', 'en'), 
+                              job.get('base_url'), 
+                              job.get('full_url'), 
+                              job.get('source'))
+        updated = _search_updated(full_url)
+        if updated is None:
+            # not in the search, ask for the metadata (past the cache)
+            updated = client.get(full_url).json().get('updated')
+        return updated
+    
+    def check(self, names = None):
+        """
+        Returns the jobs {name: job} of the watched tables that have been 
+        updated since they were marked as done (all of them the first time). 
+        
+        Tables that could not be checked are in errors, and not returned.
+        """
+        names = list(self.jobs) if names is None else list(names)
+        
+        def stamp(name):
+            with scheduler.lane('batch'):
+                return self._stamp(name, self.jobs[name])
+        
+        updated = OrderedDict()
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            futures = [(name, executor.submit(stamp, name)) for name in names]
+            for name, future in futures:
+                try:
+                    value = future.result()
+                except Exception as error:
+                    self.errors[name] = error
+                    continue
+                self.errors.pop(name, None)
+                if value is None or value != self.seen.get(name):
+                    updated[name] = self.jobs[name]
+                    with self._lock:
+                        self._pending[name] = value
+        return updated
     
-    if out == 'dict':
-        query = ast.literal_eval(query)
+    def done(self, names = None):
+        """
+        Marks tables returned by check as read (default: all of them), 
+        so they are only returned again when they are updated, and stores 
+        the stamps in the file.
+        """
+        with self._lock:
+            names = list(self._pending) if names is None else list(names)
+            for name in names:
+                if name in self._pending:
+                    self.seen[name] = self._pending.pop(name)
+            self.save()
     
-  
-    # todo: build it as a dictionary to start with (and not a string that is made into a dict as now)
-    # todo: add error message if required variables are not selected
-    # todo: avoid repeat downloading of same information 
-    # eg. get_variables is sometimes used three times before a table is downloaded
+    def save(self, path = None):
+        """
+        Stores when the tables were last seen in a (json) file.
+        """
+        path = path or self.path
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({'seen' : self.seen}, f)
+        os.replace(temp, path)
     
-    return query
+    def read_updated(self, **options):
+        """
+        Reads the tables that have been updated (see check) with read_many 
+        (options are passed to it), and marks the tables that were read 
+        as done. Returns the frames and the errors, as read_many.
+        """
+        frames, errors = read_many(self.check(), **options)
+        self.done(frames)
+        return frames, errors
 
 
-#%%
+#%% Asyncio versions of the functions
+#
+# Same as the functions above, but they do not block the event loop.
+# Requires aiohttp. All calls in an event loop share one connection pool,
+# configured from the module client (pool size, timeout, retries).
 
-def to_dict(json_str):
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+def _async_session():
     """
-        Transforms a string to a dictionary.
-        
-        Note: Will fail if string is not correctly specified.
+    Returns the aiohttp session (the connection pool) of the running event loop.
     """
-    # OK, really unnecessary func, but a concession to less experienced users
-    # todo: use json module instead, json.dumps()
-    query = ast.literal_eval(json_str)
-    return query
+    import aiohttp
+    
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
     
+    if session is None or session.closed:
+        if isinstance(client.timeout, tuple):
+            connect, read = client.timeout
+        else:
+            connect = read = client.timeout
+        
+        connector = aiohttp.TCPConnector(
+            limit = client.pool_connections * client.pool_maxsize, 
+            limit_per_host = client.pool_maxsize)
+        
+        session = aiohttp.ClientSession(
+            connector = connector, 
+            timeout = aiohttp.ClientTimeout(sock_connect = connect, sock_read = read), 
+            headers = {'Accept-Encoding' : 'gzip, deflate'})
+        _async_sessions[loop] = session
+    
+    return session
 
-#%%
 
-def read_box(from_box):
+async def _async_request(method, url, **kwargs):
     """
-    Takes a widget container as input (where the user has selected varables) 
-    and returns a pandas dataframe with the values for the selected variables.
-    
-    Example
-    -------
+    Sends a request without blocking the event loop and returns the 
+    content of the response (bytes). Retries like the module client.
+    """
+    session = _async_session()
+    host = urlparse(url).netloc
+    lane = _lane.get()
     
-    df = read_box(box)
+    if 'json' in kwargs:
+        # encoded here, so the size sent is known (as in Client.request)
+        kwargs['data'] = json.dumps(kwargs.pop('json')).encode('utf-8')
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, 
+                                 **{'Content-Type' : 'application/json'})
+    body = kwargs.get('data')
+    request_bytes = len(body) if isinstance(body, bytes) else 0
     
+    for attempt in range(client.retries + 1):
+        # waits in the event loop (not in a thread of the executor, which 
+        # also resolves host names), and takes no slot if cancelled
+        queued = await scheduler.async_acquire(host, lane)
+        try:
+            phase = _Phase('request', method = method, url = url, attempt = attempt, 
+                           queued = queued, request_bytes = request_bytes)
+            with phase:
+                async with session.request(method, url, **kwargs) as response:
+                    phase.set(status = response.status, 
+                              response_bytes = _content_length(response.headers))
+                    if response.status not in client.status_forcelist or attempt == client.retries:
+                        response.raise_for_status()
+                        return await response.read()
+                    
+                    status = response.status
+                    wait = _retry_after(response.headers, client.backoff_factor * 2 ** attempt)
+        finally:
+            scheduler.release(host)
+        
+        if status == 429:
+            scheduler.penalize(host, wait)
+        else:
+            await asyncio.sleep(wait)
+
+
+async def _in_thread(func, *args):
+    """
+    Runs func (eg. json decoding) in a thread, so it does not block the event loop.
     """
-    query = get_json(from_box)
-    url = from_box.children[3].value
-    data = requests.post(url, json = query)
-    results = pyjstat.from_json_stat(data.json(object_pairs_hook=OrderedDict))
-    return results[0]
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
 
 
-#%% 
+async def async_close():
+    """
+    Closes the connection pool of the running event loop.
+    """
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
 
-def read_with_json(table_id = None, 
-              query = None, 
-              language = 'en', 
-              base_url = 'http://data.ssb.no/api/v0', 
-              full_url = None):
+
+async def async_search(phrase, 
+                       language = 'en', 
+                       base_url = None, 
+                       source = None):
     """
-    Returns a pandas dataframe with the values for the table specified by 
-    table_id and an explicit json string (in json-stat format).
+    Asyncio version of search.
     
-    Useful if 
-        - you know exactly what you are looking for and
-        - can specify the json yourself (as a dictionary)
-        - you do not want to use the notebook/widgets/box to specify the json query
-        
-    Hints
-    -----
-        - use full_json(table_id = '10714', out = 'string') to get a query string and edit it
-        - use to_dict(str) to get a dict from an edited json string
-            
     Example
     -------
-    json_query = {'response': {'format': 'json-stat'}, 
-        'query': [
-        {'selection': {'values': ['0'], 'filter': 'item'}, 'code': 'Region'}, 
-        {'selection': {'values': ['KufjolsIAlt'], 'filter': 'item'}, 'code': 'ContentsCode'}, 
-        {'selection': {'values': ['1999', '2013'], 'filter': 'item'}, 'code': 'Tid'}]}
-        }
-    
-    df = read_with_json(table_id = '10714', query = json_query)
     
+        df = await async_search("income")
     """
-    if full_url is None:
-        
-        full_url = '{base_url}/{language}/table/{table_id}'.format(
-            base_url = base_url, 
-            language = language, 
-            table_id = table_id)
-        
-    data = requests.post(full_url, json = query)
-    results = pyjstat.from_json_stat(data.json(object_pairs_hook=OrderedDict))
-    return results[0]
-
-
+    search_str = _search_url(phrase, language, _base_url(base_url, source))
+    content = await _async_request('GET', search_str)
+    records = await _in_thread(json.loads, content)
+    return _search_results(records)
 
-#%%
 
-def read_url(full_url = None, 
-             table_format = 'json'):
+async def async_get_metadata(table_id = None, 
+                             language = 'en', 
+                             base_url = None, 
+                             full_url = None, 
+                             source = None):
     """
-    Returns a pandas dataframe of the premade table indicated by the premade 
-    table_id or the full_url.
-    
-    Note: The premade table id may be different from the normal table id.
+    Asyncio version of get_metadata (uses the same metadata cache).
     """
-      
-    if table_format == 'json':
-        data = requests.get(full_url)
-        df = pyjstat.from_json_stat(data.json(object_pairs_hook=OrderedDict))
-        df = df[0]
-        
-    elif table_format == 'csv':
-        df = pd.read_csv(full_url)
-    else:
-        print("""Table_format is incorrectly specified. 
-              It must be 'json-stat' or 'csv'""")
-        df = None
-    return df
-
-
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+    key = _cache_key(full_url)
+    
+    with _Phase('metadata', url = full_url) as phase:
+        metadata = metadata_cache.get(key)
+        phase.set(cache_hit = metadata is not None)
+        if metadata is None:
+            content = await _async_request('GET', full_url)
+            metadata = await _in_thread(partial(json.loads, content, 
+                                                object_pairs_hook = OrderedDict))
+            metadata_cache.set(key, metadata)
+    return metadata
 
-#%%
 
-def search_premade(phrase = '*',
-                   language = 'en',
-                   url = 'http://data.ssb.no/api/v0/dataset'):
-    
+async def async_get_variables(table_id = None, 
+                              language = 'en', 
+                              base_url = None, 
+                              full_url = None, 
+                              source = None):
     """
-    Returns a pandas dataframe with the tables matching the tags specified in the search.
-    
-    Note that the function does not search in the headline of the tables, but in the tags.
-    
-    The search is exact, so it may be better to get a list of all tables 
-    (use phrase = '*' or just leave it unspecified)
-    
-    The ID column contains a special table id for premade tables 
-    (use this is when specifying the table to be downloaded)
-    
-    Example:
-        
-        tables = search_url_tables('population')
+    Asyncio version of get_variables.
     
+    Example
+    -------
     
+        variables = await async_get_variables(table_id = '10714')
     """
-    url = '{url}?lang={language}'.format(
-        url = url,
-        language = language)
-    
-    df = pd.read_html(url)
-    df = df[0]
-    df.index = df['ID']
-    df = df.iloc[:,[0,1]]
-    df = df.sort_index()
-    phrase = phrase.lower()
-    
-    if phrase != '*':
-        df = df[(df.iloc[:,0].str.lower().str.contains(phrase)) | 
-                (df.iloc[:,1].str.lower().str.contains(phrase)) ]
-    return df
-
-# to do: merge the two search functions?
-# make premade an bool arg in the search. 
-# also allow full_url
+    metadata = await async_get_metadata(table_id = table_id, 
+                                        language = language, 
+                                        base_url = base_url, 
+                                        full_url = full_url, 
+                                        source = source)
+    return [dict(values) for values in metadata['variables']]
 
 
-
-#%%
-
-def read_premade(premade_id = None, 
-            language = 'en', 
-            base_url = 'http://data.ssb.no/api/v0/dataset', 
-            full_url = None, 
-            table_format = 'json'):
+async def _async_post_query(full_url, query, max_cells = None, **options):
     """
-    Returns a pandas dataframe of the premade table indicated by the premade 
-    table_id or the full_url.
-    
-    Note: The premade table id may be different from the normal table id.
+    Asyncio version of _post_query. The parts of a split query are 
+    downloaded at the same time.
     """
+    response_format = options.pop('response_format', None)
+    if response_format is not None:
+        query = _with_format(query, response_format)
     
-    if full_url is None:
-        full_url = '{base_url}/{premade_id}.{table_format}?lang={language}'.format(
-                base_url = base_url,
-                premade_id = str(premade_id), 
-                language = language,
-                table_format = table_format)
-    #print(full_url)
+    if max_cells is None:
+        max_cells = _max_cells(full_url)
     
-    if table_format == 'json':
-        data = requests.get(full_url)
-        df = pyjstat.from_json_stat(data.json(object_pairs_hook=OrderedDict))
-        df = df[0]
+    response_format = _auto_format(query)
+    variables = None
+    queries = _sub_queries(query, max_cells)
+    if queries is None or response_format in (None, 'csv'):
+        variables = await async_get_variables(full_url = full_url)
+        queries = _sub_queries(query, max_cells, variables)
+    if response_format is None:
+        response_format = _auto_format(query, variables)
+    
+    queries = [_with_format(sub_query, response_format) for sub_query in queries]
+    if response_format == 'csv':
+        for sub_query in queries:
+            _check_csv(sub_query)
+    with _Phase('read', url = full_url, format = response_format, 
+                requests = len(queries)) as phase:
+        contents = await asyncio.gather(*[_async_request('POST', full_url, json = sub_query) 
+                                          for sub_query in queries])
         
-    elif table_format == 'csv':
-        df = pd.read_csv(full_url)
-    else:
-        print("""Table_format is incorrectly specified. 
-              It must be 'json-stat' or 'csv'""")
-        df = None
+        if response_format == 'csv':
+            decode = [partial(_read_csv, content, sub_query, variables, 
+                              categorical = options.get('categorical', False), 
+                              value_dtype = options.get('value_dtype'), 
+                              output = options.get('output', 'pandas')) 
+                      for content, sub_query in zip(contents, queries)]
+        else:
+            decode = [partial(_read_json_stat, content, **options) for content in contents]
+        frames = [await _in_thread(function) for function in decode]
+        df = _concat(frames)
+        phase.set(cells = len(df))
     return df
 
 
-#%%
-
-def full_json(table_id = None, 
-              out = 'dict', 
-              language = 'en', 
-              full_url = None):
+async def async_read_with_json(table_id = None, 
+                               query = None, 
+                               language = 'en', 
+                               base_url = None, 
+                               full_url = None, 
+                               source = None, 
+                               max_cells = None, 
+                               engine = 'native', 
+                               categorical = False, 
+                               value_dtype = None, 
+                               response_format = None, 
+                               output = 'pandas'):
     """
-    Returns the json query for getting all the values for all options for a table.
-    Useful if
-        - you do not want to use the widgets/notebook to build the query
-        - but want a starting point to revise and specify a the query instead of building it from the ground.
+    Asyncio version of read_with_json.
     
-    Note
-        - The json is a dictionary. You may want to edit the content of the dictionary directly,
-        or make it a string, edit it as a string, and retransform it to a dictionary.
-        
-        To transform a string to a dict, use the function:
-        
-            query = to_dict(json_str)
-        
     Example
     -------
     
-    query = full_json(table_id = '10714', out = 'string')
-    
+        df = await async_read_with_json(table_id = '10714', query = json_query)
     """
-    
-    variables = get_variables(table_id, language = language, full_url = full_url)
-    nvars = len(variables)
-    var_list = list(range(nvars))
-    
-    query_element = {}
-    
-    for x in var_list:
-        query_element[x] ='{{"code": "{code}", "selection": {{"filter": "item", "values": {values} }}}}'.format(
-                code = variables[x]['code'], 
-                values = variables[x]['values']) 
-        query_element[x] = query_element[x].replace("\'", '"')
-    all_elements = str(list(query_element.values()))
-    all_elements = all_elements.replace("\'", "")
-    
-    query = '{{"query": {all_elements} , "response": {{"format": "json-stat" }}}}'.format(all_elements = all_elements)
-    
-    if out == 'dict':
-        query = ast.literal_eval(query)
-    
-    return query
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+    return await _async_post_query(full_url, _query_dict(query), 
+                                   max_cells = max_cells, 
+                                   engine = engine, 
+                                   output = output, 
+                                   categorical = categorical, 
+                                   value_dtype = value_dtype, 
+                                   response_format = response_format)
 
 
-#%%
-
-def read_all(table_id = None, 
-             language = 'en',
-             base_url = 'http://data.ssb.no/api/v0', 
-             full_url = None):
+async def async_read_all(table_id = None, 
+                         language = 'en', 
+                         base_url = None, 
+                         full_url = None, 
+                         source = None, 
+                         max_cells = None, 
+                         engine = 'native', 
+                         categorical = False, 
+                         value_dtype = None, 
+                         response_format = None, 
+                         output = 'pandas'):
     """
-    Returns a pandas dataframe with all values for all options 
-    for the table specified by table_id
-    
-    Warning: The table may be large
-    
-    Useful if 
-        - you know exactly what you are looking for and
-        - you do not want to use the notebook/widgets/box to specify the json query)
+    Asyncio version of read_all.
     
     Example
+    -------
     
-    df = read_all(table_id = '10714')
-    
+        df = await async_read_all(table_id = '10714')
     """
-    
-     
-    if full_url is None:        
-        full_url = '{base_url}/{language}/table/{table_id}'.format(
-            base_url = base_url,
-            language = language, 
-            table_id = table_id)
-        
-    query = full_json(full_url = full_url)
-    data = requests.post(full_url, json = query)
-    results = pyjstat.from_json_stat(data.json(object_pairs_hook=OrderedDict))
-    
-    # maybe this need not be its own function, 
-    # but an option in read_json? json = 'all'
-    
-    # other functions(options include: read_recent to get only the 
-    # most recent values (defined as x), json = 'recent')
-    
-    return results[0]
-
-
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+    variables = await async_get_variables(full_url = full_url)
+    query = _full_query(variables, wildcard = True)
+    return await _async_post_query(full_url, query, 
+                                   max_cells = max_cells, 
+                                   engine = engine, 
+                                   output = output, 
+                                   categorical = categorical, 
+                                   value_dtype = value_dtype, 
+                                   response_format = response_format)
@@ -0,0 +1,329 @@
+# coding: utf-8
+
+# # stats-to-pandas: widgets
+
+# The interactive part of stats_to_pandas: select a table's variables and 
+# values in Jupyter widgets, and read the selection. Imported when first 
+# used (stp.select), so the rest of the package does not need ipywidgets.
+
+#%% Required modules
+from collections import OrderedDict
+from ipywidgets import widgets
+
+from . import (Query, 
+               _Phase, 
+               _count_cells, 
+               _max_cells, 
+               _post_query, 
+               _table_url, 
+               get_metadata, 
+               get_variables)
+
+
+# the most values shown at once in a selection widget 
+# (use the search box to find the others)
+MAX_OPTIONS = 500
+
+
+class _VariableSelector(object):
+    """
+    The widgets for selecting the values of one variable in select: 
+    a search box, a list of (at most MAX_OPTIONS) matching values and 
+    buttons to select all values or the latest n values (which become 
+    'all' and 'top' filters in the query).
+    
+    on_change(selector) is called when the selection changes.
+    """
+    
+    def __init__(self, var, on_change):
+        self.var = var
+        self.on_change = on_change
+        self.texts = OrderedDict(zip(var['values'], var.get('valueTexts', var['values'])))
+        self.filter = 'item'
+        self.selected = OrderedDict()       # selected codes, with the 'item' filter
+        self.latest = 1
+        self.loaded = False
+        self._updating = False
+        self.panel = widgets.VBox([])
+    
+    def load(self):
+        """
+        Makes the widgets (the first time the tab is opened).
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        
+        self.search = widgets.Text(placeholder = 'Search')
+        self.options = widgets.SelectMultiple(layout = widgets.Layout(height = '300px', 
+                                                                      width = '500px'))
+        self.status = widgets.Label()
+        all_button = widgets.Button(description = 'All')
+        latest_button = widgets.Button(description = 'Latest')
+        self.latest_n = widgets.BoundedIntText(value = self.latest, 
+                                               min = 1, 
+                                               max = max(len(self.texts), 1), 
+                                               layout = widgets.Layout(width = '80px'))
+        clear_button = widgets.Button(description = 'None')
+        
+        self.search.observe(lambda change: self.show(), names = 'value')
+        self.options.observe(self.picked, names = 'value')
+        all_button.on_click(lambda button: self.set_filter('all'))
+        latest_button.on_click(lambda button: self.set_filter('top'))
+        clear_button.on_click(lambda button: self.clear())
+        
+        buttons = widgets.HBox([all_button, latest_button, self.latest_n, clear_button])
+        self.panel.children = [self.search, self.options, buttons, self.status]
+        self.show()
+    
+    def matches(self):
+        """
+        Returns the codes whose text contains the search phrase.
+        """
+        phrase = self.search.value.strip().lower()
+        if not phrase:
+            return list(self.texts)
+        return [code for code, text in self.texts.items() if phrase in str(text).lower()]
+    
+    def show(self):
+        """
+        Shows the (first MAX_OPTIONS) values matching the search.
+        """
+        codes = self.matches()
+        shown = codes[:MAX_OPTIONS]
+        
+        # changing the options resets the value, which is not a new selection
+        self._updating = True
+        try:
+            self.options.options = [(str(self.texts[code]), code) for code in shown]
+            self.options.value = tuple(code for code in shown if code in self.selected)
+        finally:
+            self._updating = False
+        self.describe(len(codes), len(shown))
+    
+    def describe(self, matches = None, shown = None):
+        if self.filter == 'all':
+            text = 'All {n} values'.format(n = len(self.texts))
+        elif self.filter == 'top':
+            text = 'The latest {n} values'.format(n = self.latest)
+        else:
+            text = '{n} of {total} values selected'.format(n = len(self.selected), 
+                                                        total = len(self.texts))
+        if shown is not None and shown < matches:
+            text += ', showing {shown} of {matches} matches (search to find the others)'.format(
+                shown = shown, matches = matches)
+        self.status.value = text
+    
+    def picked(self, change):
+        if self._updating:
+            return
+        shown = set(code for label, code in self.options.options)
+        for code in shown - set(change['new']):
+            self.selected.pop(code, None)
+        for code in change['new']:
+            self.selected[code] = True
+        self.filter = 'item'
+        self.changed()
+    
+    def set_filter(self, filt):
+        self.filter = filt
+        self.latest = self.latest_n.value
+        self.changed()
+    
+    def clear(self):
+        self.filter = 'item'
+        self.selected.clear()
+        self.show()
+        self.changed()
+    
+    def changed(self):
+        if self.loaded:
+            self.describe()
+        self.on_change(self)
+    
+    def add_to(self, query):
+        """
+        Puts the selection in the query.
+        """
+        code = self.var['code']
+        if self.filter == 'all':
+            query.all(code)
+        elif self.filter == 'top':
+            query.top(code, self.latest)
+        else:
+            # in the order of the table
+            query.item(code, [value for value in self.texts if value in self.selected])
+        return query
+
+
+def select(table_id = None, 
+           language = 'en', 
+           base_url = None, 
+           full_url = None, 
+           source = None):
+    """
+    Selects a table based on the table_id and returns a widget container 
+    in which the user can select the set of variables and values to be 
+    included in the final table.
+    
+    
+    Example
+    --------
+    box = select(table_id = '10714')
+    
+    
+    Parameters
+    ----------    
+    
+        table_id : string 
+            the id of the desired table
+         
+        language: string
+            language for table
+            'en' (default, English) 
+            'no' (Norwegian): 
+            language for table
+        
+        base_url: string.
+            base url locating the table (not including table_id)
+        
+        full_url: string
+            the full url to the table
+        
+        source: string
+            the name of a source in sources (default: default_source)
+    """
+        
+    # get table_id not full url was specified 
+    full_url = _table_url(table_id, language, base_url, full_url, source)
+        
+    # title and variables come from the same (cached) metadata download
+    table_title = get_metadata(full_url = full_url)['title']
+
+    # get a list with dictionaries containing information about each variable
+    variables = get_variables(full_url = full_url)
+    
+    # the query is updated whenever the selection changes (get_json reads it)
+    query = Query()
+    max_cells = _max_cells(full_url)
+    cells_text = widgets.Label()
+    
+    def update(selector):
+        selector.add_to(query)
+        cells = _count_cells(query.to_dict(), variables)
+        if cells is not None and cells > max_cells:
+            cells_text.value = ('Cells: {cells:,} (more than {max_cells:,}, '
+                                'read in several parts)'.format(cells = cells, 
+                                                                max_cells = max_cells))
+        else:
+            cells_text.value = 'Cells: {cells:,}'.format(cells = cells or 0)
+    
+    # one tab for each variable, the values are only put in the widgets 
+    # when the tab is opened (tables may have thousands of regions)
+    selectors = [_VariableSelector(var, update) for var in variables]
+    for selector in selectors:
+        selector.add_to(query)
+    update(selectors[0])
+    
+    variables_container = widgets.Tab([selector.panel for selector in selectors])
+    for number, var in enumerate(variables):
+        variables_container.set_title(number, str(var['text']))
+    
+    def opened(change):
+        if change['new'] is not None:
+            selectors[change['new']].load()
+    
+    variables_container.observe(opened, names = 'selected_index')
+    selectors[0].load()
+    
+    # build widgets and put in one widget container
+    headline = widgets.Label(value = table_title, color = 'blue')
+    
+    endline = widgets.Label(value = '''Select category and click on elements 
+        to be included in the table (CTRL-A selects all values shown)''')
+    
+    url_text = widgets.Label(value = full_url)
+    
+    selection_container = widgets.VBox([headline, 
+                                        endline, 
+                                        variables_container, 
+                                        url_text, 
+                                        cells_text])
+    selection_container.query = query
+    
+    selection_container.layout.border = '3px grey solid'
+    # may include a "click here when finished" just to make it more intuitive?
+    return selection_container
+
+
+#%% 
+def get_json(box=None, 
+             out = 'dict', 
+             language = 'en'):
+    """
+    Takes a widget container as input (where the user has selected varables) 
+    and returns a json dictionary or string that will fetch these variables. 
+    
+    The json follows the json-stat format.
+    
+    Parameters
+    ----------
+    
+    box : widget container 
+        name of widget box with the selected variables
+    
+    out : string 
+        default: 'dict', options: 'str'
+        
+        The json can be returned as a dictionary or a string.
+        The final end query should use a dict, but some may find it useful to
+        get the string and revise it before transforming it back to a dict.
+    
+    
+    Example
+    -------
+    
+    json_query = get_json(box)
+    
+    """
+        
+    # the box keeps the query up to date as the user selects values 
+    # (including the 'all' and 'latest' buttons)
+    query = box.query
+    
+    # todo: add error message if required variables are not selected
+    with _Phase('query'):
+        if out == 'dict':
+            return query.to_dict()
+        return query.to_json()
+
+
+#%%
+
+def read_box(from_box, 
+             engine = 'native', 
+             categorical = False, 
+             value_dtype = None, 
+             response_format = None, 
+             cache = None):
+    """
+    Takes a widget container as input (where the user has selected varables) 
+    and returns a pandas dataframe with the values for the selected variables.
+    
+    engine, categorical, value_dtype, response_format and cache are as in 
+    read_with_json.
+    
+    Example
+    -------
+    
+    df = read_box(box)
+    
+    """
+    query = get_json(from_box)
+    url = from_box.children[3].value
+    return _post_query(url, query, 
+                       cache = cache, 
+                       engine = engine, 
+                       categorical = categorical, 
+                       value_dtype = value_dtype, 
+                       response_format = response_format)
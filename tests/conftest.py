@@ -0,0 +1,37 @@
+# coding: utf-8
+
+"""
+Fixtures for the tests against the local PxWeb stand-in server 
+(benchmarks/server.py).
+"""
+
+import pytest
+
+import stats_to_pandas as stp
+from benchmarks.server import Server
+
+
+@pytest.fixture(scope = 'module')
+def server():
+    server = Server(latency = 0.01, max_cells = 5000)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def source(server, monkeypatch):
+    """
+    A source on the server, reached by host name (as the real sources), 
+    with a new client, scheduler and metadata cache for each test.
+    """
+    monkeypatch.setattr(stp, 'client', stp.Client())
+    monkeypatch.setattr(stp, 'scheduler', stp.Scheduler())
+    monkeypatch.setattr(stp, 'metadata_cache', stp.MetadataCache())
+    monkeypatch.setattr(stp, 'sources', stp.OrderedDict(stp.sources))
+    source = stp.Source('local', server.base_url.replace('127.0.0.1', 'localhost'), 
+                        max_cells = server.max_cells, 
+                        max_concurrency = 4)
+    stp.add_source(source)
+    yield source
+    stp.client.close()
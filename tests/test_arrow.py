@@ -0,0 +1,42 @@
+# coding: utf-8
+
+"""
+Tests of output = 'arrow' against the local PxWeb stand-in server 
+(benchmarks/server.py).
+"""
+
+import pytest
+
+import stats_to_pandas as stp
+
+pa = pytest.importorskip('pyarrow')
+
+
+def test_split_query(source):
+    # 40000 cells, read in parts of at most 5000 cells
+    table = stp.read_all(table_id = '10001', source = 'local', output = 'arrow')
+    df = stp.read_all(table_id = '10001', source = 'local')
+    
+    assert table.num_rows == len(df) == 200 * 10 * 20
+    assert table.column('variable 0').type == pa.dictionary(pa.int32(), pa.string())
+    assert table.to_pandas().astype({name : str for name in df.columns[:-1]}).equals(
+        df.astype({name : str for name in df.columns[:-1]}))
+
+
+@pytest.mark.parametrize('options', [{'engine' : 'stream'}, 
+                                     {'engine' : 'pyjstat'}, 
+                                     {'response_format' : 'csv'}, 
+                                     {'response_format' : 'json-stat2'}])
+def test_same_schema_for_all_engines(source, options):
+    native = stp.read_all(table_id = '10000', source = 'local', output = 'arrow')
+    table = stp.read_all(table_id = '10000', source = 'local', output = 'arrow', **options)
+    
+    assert native.schema == table.schema
+    assert native.schema.field('value').type == pa.float64()
+    assert table.equals(native)
+
+
+def test_value_dtype(source):
+    table = stp.read_all(table_id = '10000', source = 'local', output = 'arrow', 
+                         engine = 'stream', value_dtype = 'float32')
+    assert table.schema.field('value').type == pa.float32()
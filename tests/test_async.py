@@ -0,0 +1,104 @@
+# coding: utf-8
+
+"""
+Tests of the asyncio functions against the local PxWeb stand-in server 
+(benchmarks/server.py), no network access is needed.
+
+    python -m pytest tests
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import stats_to_pandas as stp
+
+
+def run(coroutine, executor_threads = None):
+    """
+    Runs a coroutine in a new event loop (optionally with a small default 
+    executor) and closes the connections of the loop afterwards. 
+    Fails if it takes more than 30 seconds.
+    """
+    async def main():
+        try:
+            return await asyncio.wait_for(coroutine, 30)
+        finally:
+            await stp.async_close()
+    
+    # not asyncio.run, which waits for the executor threads (forever, if 
+    # they are stuck)
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers = executor_threads)
+    loop.set_default_executor(executor)
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        executor.shutdown(wait = False, cancel_futures = True)
+        loop.close()
+
+
+def active(source):
+    stats = stp.scheduler.stats()
+    return stats.loc[source.host, ['active', 'waiting']].tolist()
+
+
+def test_async_get_variables(source):
+    variables = run(stp.async_get_variables(table_id = '10000', source = 'local'))
+    assert [var['code'] for var in variables] == [var['code'] for var in 
+                                                   stp.get_variables(table_id = '10000', 
+                                                                     source = 'local')]
+    assert len(variables[0]['values']) == 20
+
+
+def test_async_search(source):
+    df = run(stp.async_search('synthetic', source = 'local'))
+    assert sorted(df.index.str.strip()) == ['10000', '10001', '10002']
+
+
+def test_async_read_all(source):
+    df = run(stp.async_read_all(table_id = '10000', source = 'local'))
+    pd.testing.assert_frame_equal(df, stp.read_all(table_id = '10000', source = 'local'))
+    assert len(df) == 1000
+
+
+def test_async_read_with_json_split(source, server):
+    query = stp.Query().all('Var0').all('Var1').top('Tid', 15)
+    with stp.Stats() as stats:
+        df = run(stp.async_read_with_json(table_id = '10001', query = query, source = 'local'))
+    
+    # 200 * 10 * 15 cells are more than max_cells, so the query is split
+    assert len(df) == 200 * 10 * 15 > server.max_cells
+    assert stats.phases['read']['count'] == 1
+    assert stats.phases['request']['count'] > 2
+    pd.testing.assert_frame_equal(
+        df, stp.read_with_json(table_id = '10001', query = query, source = 'local'))
+
+
+def test_fan_out_does_not_use_the_executor(source):
+    # more requests than slots and executor threads: the waiting requests 
+    # must not take the threads the running ones need (host name lookup)
+    async def fan_out():
+        return await asyncio.gather(*[stp.async_search('synthetic', source = 'local') 
+                                      for _ in range(15)])
+    
+    results = run(fan_out(), executor_threads = 2)
+    assert len(results) == 15
+    assert active(source) == [0, 0]
+
+
+def test_cancelled_requests_release_their_slots(source):
+    async def cancel():
+        tasks = [asyncio.ensure_future(stp.async_search('synthetic', source = 'local')) 
+                 for _ in range(10)]
+        await asyncio.sleep(0.005)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+    
+    run(cancel())
+    assert active(source) == [0, 0]
+    
+    # the source is still usable, also without asyncio
+    assert len(stp.search('synthetic', source = 'local')) == 3
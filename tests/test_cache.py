@@ -0,0 +1,50 @@
+# coding: utf-8
+
+"""
+Tests of the result cache against the local PxWeb stand-in server 
+(benchmarks/server.py).
+"""
+
+import os
+
+import stats_to_pandas as stp
+
+
+def test_unchanged_premade_table_is_fresh_again(server, source, tmp_path):
+    cache = stp.ResultCache(str(tmp_path / 'tables'), max_age = 60)
+    url = source.base_url + '/dataset/10000.json'
+    df = stp.read_premade(full_url = url, cache = cache)
+    
+    # stored long ago: the server is asked, and answers 304
+    key, = [name[:-len('.json')] for name in os.listdir(cache.path) if name.endswith('.json')]
+    cache._write_info(key, dict(cache.info(key), stored = 0))
+    requests = server.stats['requests']
+    assert stp.read_premade(full_url = url, cache = cache).equals(df)
+    assert server.stats['requests'] == requests + 1
+    assert cache.fresh(cache.info(key))
+    
+    # so it is used without asking until max_age has passed
+    assert stp.read_premade(full_url = url, cache = cache).equals(df)
+    assert server.stats['requests'] == requests + 1
+
+
+def test_unchanged_table_is_fresh_again(server, source, tmp_path):
+    cache = stp.ResultCache(str(tmp_path / 'tables'), max_age = 60)
+    df = stp.read_all(table_id = '10000', source = 'local', cache = cache)
+    
+    # stored long ago: the update time is checked, and has not changed
+    key, = [name[:-len('.json')] for name in os.listdir(cache.path) if name.endswith('.json')]
+    cache._write_info(key, dict(cache.info(key), stored = 0))
+    assert stp.read_all(table_id = '10000', source = 'local', cache = cache).equals(df)
+    assert cache.fresh(cache.info(key))
+    
+    # so it is used without asking until max_age has passed
+    requests = server.stats['requests']
+    assert stp.read_all(table_id = '10000', source = 'local', cache = cache).equals(df)
+    assert server.stats['requests'] == requests
+
+
+def test_cache_true_uses_the_default_directory(source, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stp.read_premade(full_url = source.base_url + '/dataset/10000.json', cache = True)
+    assert os.listdir(str(tmp_path / 'stats_to_pandas_cache'))
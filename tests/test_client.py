@@ -0,0 +1,66 @@
+# coding: utf-8
+
+"""
+Tests of the client and the scheduler against the local PxWeb stand-in 
+server (benchmarks/server.py).
+"""
+
+import gc
+
+import pytest
+import requests
+
+import stats_to_pandas as stp
+
+
+def active(source):
+    stats = stp.scheduler.stats()
+    return stats.loc[source.host, ['active', 'waiting']].tolist()
+
+
+def test_streamed_response_holds_its_place_until_closed(source):
+    url = source.base_url + '/dataset/10000.json'
+    with stp.client.get(url, stream = True) as response:
+        assert active(source) == [1, 0]
+        response.content
+        assert active(source) == [1, 0]
+    assert active(source) == [0, 0]
+    
+    # closing twice releases once
+    response.close()
+    assert active(source) == [0, 0]
+
+
+def test_streamed_response_is_released_when_collected(source):
+    response = stp.client.get(source.base_url + '/dataset/10000.json', stream = True)
+    assert active(source) == [1, 0]
+    del response
+    gc.collect()
+    assert active(source) == [0, 0]
+
+
+def test_streamed_error_is_released(source):
+    with pytest.raises(requests.HTTPError):
+        stp.client.get(source.base_url + '/dataset/99999.json', stream = True)
+    assert active(source) == [0, 0]
+
+
+def test_stream_engine_closes_the_response(source):
+    df = stp.read_all(table_id = '10000', source = 'local', engine = 'stream')
+    assert len(df) == 20 * 5 * 10
+    assert active(source) == [0, 0]
+
+
+def test_catalog_is_read_in_the_batch_lane(source, monkeypatch):
+    lanes = []
+    acquire = stp.scheduler.acquire
+    
+    def recording(host, lane = None):
+        lanes.append(lane or stp._lane.get())
+        return acquire(host, lane)
+    monkeypatch.setattr(stp.scheduler, 'acquire', recording)
+    
+    catalog = stp.Catalog(source = 'local')
+    catalog.refresh(background = True).join()
+    assert lanes and set(lanes) == {'batch'}
+    assert len(catalog.search('synthetic')) == 3
@@ -0,0 +1,36 @@
+# coding: utf-8
+
+"""
+Tests of csv responses against the local PxWeb stand-in server 
+(benchmarks/server.py).
+"""
+
+import pytest
+
+import stats_to_pandas as stp
+
+pytest.importorskip('pyarrow')
+
+
+def test_csv_gives_the_json_stat_dataframe(source):
+    query = stp.Query().all('Var0').top('Tid', 3)
+    csv = stp.read_with_json(table_id = '10000', source = 'local', query = query, 
+                             response_format = 'csv')
+    assert csv.equals(stp.read_with_json(table_id = '10000', source = 'local', query = query))
+
+
+@pytest.mark.parametrize('selection', [{'filter' : 'agg:groups', 'values' : ['A']}, 
+                                       {'filter' : 'vs:other', 'values' : ['00000']}])
+def test_csv_refuses_groupings(source, selection):
+    query = {'query' : [{'code' : 'Var0', 'selection' : selection}], 
+             'response' : {'format' : 'csv'}}
+    methods = []
+    hook = stp.add_hook(lambda event: 
+                        methods.append(event['method']) if event['phase'] == 'request' else None)
+    try:
+        with pytest.raises(ValueError, match = 'only supports item, all and top'):
+            stp.read_with_json(table_id = '10000', source = 'local', query = query)
+    finally:
+        stp.remove_hook(hook)
+    # refused before the query is sent
+    assert 'POST' not in methods
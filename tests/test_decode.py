@@ -0,0 +1,52 @@
+# coding: utf-8
+
+"""
+Tests that the json-stat decoders give the same dataframe as pyjstat, on 
+synthetic tables (benchmarks/generate.py).
+"""
+
+import json
+from collections import OrderedDict
+
+import pandas as pd
+import pytest
+
+import stats_to_pandas as stp
+from benchmarks import generate
+
+pyjstat = pytest.importorskip('pyjstat.pyjstat')
+
+# pyjstat.from_json_stat is deprecated (but still what users compare with)
+pytestmark = pytest.mark.filterwarnings('ignore::DeprecationWarning')
+
+TABLES = [{'null_density' : 0.0}, 
+          {'null_density' : 0.2}, 
+          {'null_density' : 0.1, 'decimals' : 2}, 
+          {'null_density' : 1.0}]
+
+
+def _stream(content, size = 100):
+    # small pieces, so the numbers and strings are cut in many places
+    df = stp.stream_json_stat(content[start:start + size] 
+                              for start in range(0, len(content), size))
+    df.attrs.clear()
+    return df
+
+
+@pytest.mark.parametrize('options', TABLES)
+def test_same_as_pyjstat(options):
+    content = generate.json_stat_bytes([4, 3, 5], **options)
+    expected = pyjstat.from_json_stat(json.loads(content, object_pairs_hook = OrderedDict))[0]
+    
+    pd.testing.assert_frame_equal(stp.from_json_stat(json.loads(content)), expected)
+    pd.testing.assert_frame_equal(_stream(content), expected)
+
+
+@pytest.mark.parametrize('options', TABLES)
+def test_json_stat2(options):
+    content = generate.json_stat_bytes([4, 3, 5], version = 2, **options)
+    native = stp.from_json_stat(json.loads(content))
+    
+    pd.testing.assert_frame_equal(_stream(content), native)
+    pd.testing.assert_frame_equal(
+        native, stp.from_json_stat(json.loads(generate.json_stat_bytes([4, 3, 5], **options))))
@@ -0,0 +1,17 @@
+# coding: utf-8
+
+"""
+Tests of explain against the local PxWeb stand-in server 
+(benchmarks/server.py).
+"""
+
+import stats_to_pandas as stp
+
+
+def test_query_as_dict_query_or_string(source):
+    query = stp.Query().all('Var0').top('Tid', 3)
+    plans = [stp.explain(table_id = '10000', source = 'local', query = form) 
+             for form in (query, query.to_dict(), query.to_json(), str(query.to_dict()))]
+    for plan in plans:
+        assert plan['cells'] == 20 * 3
+        assert plan.equals(plans[0])
@@ -0,0 +1,33 @@
+# coding: utf-8
+
+"""
+Tests of the instrumentation (add_hook, Stats) against the local PxWeb 
+stand-in server (benchmarks/server.py).
+"""
+
+import json
+
+import stats_to_pandas as stp
+
+from .test_async import run
+
+
+def test_phases_of_a_read(source):
+    with stp.Stats() as stats:
+        stp.read_all(table_id = '10001', source = 'local')
+    frame = stats.frame()
+    
+    assert {'query', 'metadata', 'request', 'parse', 'convert', 'read'} <= set(frame.index)
+    # one query phase splits the table in parts of at most 5000 cells
+    assert frame.loc['request', 'count'] == 8 + 1
+    assert frame.loc['request', 'request_bytes'] > 0
+
+
+def test_request_bytes_of_async_requests(source):
+    query = stp.Query().all('Var0').top('Tid', 2)
+    with stp.Stats(keep_events = True) as stats:
+        run(stp.async_read_with_json(table_id = '10000', source = 'local', query = query))
+    posts = [event for event in stats.events 
+             if event['phase'] == 'request' and event['method'] == 'POST']
+    assert len(posts) == 1
+    assert posts[0]['request_bytes'] == len(json.dumps(query.to_dict()))
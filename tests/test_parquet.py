@@ -0,0 +1,46 @@
+# coding: utf-8
+
+"""
+Tests of writing tables to parquet (to_parquet) against the local PxWeb 
+stand-in server (benchmarks/server.py).
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+import stats_to_pandas as stp
+
+pytest.importorskip('pyarrow')
+
+
+def _sorted(df):
+    columns = [column for column in df.columns if column != 'value']
+    return df.sort_values(columns).reset_index(drop = True)
+
+
+def test_partitioned_files_have_the_columns_of_read_all(source, tmp_path):
+    path = str(tmp_path / 'table')
+    stp.read_all(table_id = '10000', source = 'local', 
+                 to_parquet = path, partition_by = 'Tid')
+    df = stp.read_all(table_id = '10000', source = 'local')
+    
+    assert sorted(os.listdir(path)) == ['Tid={year}'.format(year = 2000 + i) 
+                                        for i in range(10)]
+    part = pd.read_parquet(os.path.join(path, 'Tid=2003'))
+    assert list(part.columns) == list(df.columns)
+    assert set(part['time']) == {'2003'}
+    
+    # the partition column is added when the directory is read ...
+    dataset = pd.read_parquet(path)
+    assert list(dataset.columns) == list(df.columns) + ['Tid']
+    
+    # ... unless partitioning is turned off
+    dataset = pd.read_parquet(path, partitioning = None)
+    assert _sorted(dataset).equals(_sorted(df))
+    
+    recent = pd.read_parquet(path, partitioning = None, 
+                             filters = [('time', '>=', '2008')])
+    assert set(recent['time']) == {'2008', '2009'}
+    assert len(recent) == 20 * 5 * 2
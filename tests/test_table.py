@@ -0,0 +1,23 @@
+# coding: utf-8
+
+"""
+Tests of the selections of Table (no network access).
+"""
+
+import stats_to_pandas as stp
+
+
+MONTHS = {'code' : 'Tid', 
+          'text' : 'month', 
+          'values' : ['2015M11', '2015M12', '2016M01', '2016M02', '2017M01'], 
+          'valueTexts' : ['2015M11', '2015M12', '2016M01', '2016M02', '2017M01']}
+
+
+def test_slice_of_codes_includes_both_ends():
+    assert stp._slice_values(MONTHS, slice('2015M12', '2016M02')) == ['2015M12', '2016M01', '2016M02']
+
+
+def test_slice_of_years_includes_the_months_of_the_last_year():
+    assert stp._slice_values(MONTHS, slice('2015', '2016')) == MONTHS['values'][:4]
+    assert stp._slice_values(MONTHS, slice('2016', None)) == MONTHS['values'][2:]
+    assert stp._slice_values(MONTHS, slice(None, '2015')) == MONTHS['values'][:2]
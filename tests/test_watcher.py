@@ -0,0 +1,52 @@
+# coding: utf-8
+
+"""
+Tests of the Watcher against the local PxWeb stand-in server 
+(benchmarks/server.py).
+"""
+
+import pytest
+
+import stats_to_pandas as stp
+from benchmarks.server import Server
+
+
+@pytest.fixture
+def methods():
+    """
+    The methods of the requests sent during the test.
+    """
+    sent = []
+    hook = stp.add_hook(lambda event: 
+                        sent.append(event['method']) if event['phase'] == 'request' else None)
+    yield sent
+    stp.remove_hook(hook)
+
+
+def _check_premade(server, base_url, path):
+    watcher = stp.Watcher(path)
+    watcher.watch('premade', premade_id = '10000', 
+                  full_url = base_url + '/dataset/10000.json')
+    
+    assert list(watcher.check()) == ['premade']
+    watcher.done()
+    assert list(watcher.check()) == []
+    
+    server.update('10000')
+    assert list(watcher.check()) == ['premade']
+    assert watcher.errors == {}
+
+
+def test_premade_is_checked_with_head(server, source, methods, tmp_path):
+    _check_premade(server, source.base_url, str(tmp_path / 'watched.json'))
+    assert methods == ['HEAD'] * 3
+
+
+def test_premade_is_checked_with_get_without_head(source, methods, tmp_path):
+    server = Server(head = False)
+    server.start()
+    try:
+        _check_premade(server, server.base_url, str(tmp_path / 'watched.json'))
+    finally:
+        server.stop()
+    assert methods == ['HEAD', 'GET'] * 3